@@ -0,0 +1,225 @@
+# alert_engine.py
+"""Threshold alert rules evaluated on the ingest stream.
+
+Every committed metric row is run through the rules that apply to its device
+(all of a rule's tags must be on the device; a rule without tags applies to
+every device). Each (rule, device, instance) series keeps a fixed-size state:
+when the condition started holding, whether it is firing and, for rate rules,
+the previous counter reading. No history is scanned, so the cost per row is
+the number of matching rules, independent of how long the window is.
+
+A condition has to hold on every sample for ``for_seconds`` before the series
+fires, and it resolves on the first sample where it no longer holds. Only
+these transitions leave the engine (``take_transitions``); pending breaches
+stay in memory.
+
+State is per process: a worker only sees the samples it ingested itself.
+"""
+import operator
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+OPERATORS: Dict[str, Callable[[float, float], bool]] = {
+    ">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le,
+}
+
+# family -> column naming the instance within a device (None = one series per device)
+INSTANCE_KEYS = {"cpu": None, "memory": None, "disk": "mount_point", "network": "interface_name"}
+
+
+class Rule(NamedTuple):
+    id: int
+    name: str
+    family: str
+    field: str
+    op: str
+    threshold: float
+    for_seconds: float
+    rate: bool  # compare the per-second rate of a cumulative counter instead of the value
+    tags: Tuple[str, ...]
+    instance: Optional[str]  # only this mount point / interface; None = any
+    severity: str
+
+    def describe(self) -> str:
+        subject = f"{self.family}.{self.field}" + (" rate" if self.rate else "")
+        window = f" for {self.for_seconds:g}s" if self.for_seconds else ""
+        return f"{subject} {self.op} {self.threshold:g}{window}"
+
+
+class Transition(NamedTuple):
+    state: str  # "firing" or "resolved"
+    rule: Rule
+    device_id: int
+    instance: str  # "" for per-device families
+    value: float
+    at: datetime  # when the series started breaching (firing) or recovered (resolved)
+    message: str
+
+
+class _Series:
+    __slots__ = ("breach_since", "firing", "last_ts", "prev_value")
+
+    def __init__(self):
+        self.breach_since: Optional[float] = None
+        self.firing = False
+        self.last_ts = float("-inf")
+        self.prev_value: Optional[float] = None
+
+
+def _number(value: Any) -> Optional[float]:
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        return float(value)
+    return None
+
+
+class AlertEngine:
+    def __init__(self, device_tags: Callable[[int], Iterable[str]]):
+        self.device_tags = device_tags
+        self._rules: Dict[str, List[Rule]] = {}
+        self._rule_ids: set = set()
+        # device_id -> family -> rules applying to it; rebuilt lazily after rule or tag changes
+        self._matching: Dict[int, Dict[str, List[Rule]]] = {}
+        self._series: Dict[Tuple[int, int, str], _Series] = {}
+        self._transitions: List[Transition] = []
+        self.evaluated = 0
+        self.fired = 0
+        self.resolved = 0
+
+    def __len__(self) -> int:
+        return len(self._series)
+
+    def set_rules(self, rules: Iterable[Rule]) -> None:
+        """Replace the rule set; series of removed rules are dropped, changed rules start a fresh window."""
+        by_family: Dict[str, List[Rule]] = {}
+        previous = {r.id: r for family_rules in self._rules.values() for r in family_rules}
+        for rule in rules:
+            by_family.setdefault(rule.family, []).append(rule)
+        current = {r.id: r for family_rules in by_family.values() for r in family_rules}
+        for key in list(self._series):
+            rule_id = key[0]
+            if rule_id not in current:
+                del self._series[key]
+            elif previous.get(rule_id) != current[rule_id]:
+                series = self._series[key]
+                series.breach_since = None
+                series.prev_value = None
+        self._rules = by_family
+        self._rule_ids = set(current)
+        self._matching.clear()
+
+    def tags_changed(self, device_id: Optional[int] = None) -> None:
+        """Re-match rules for one device (or all) on its next sample."""
+        if device_id is None:
+            self._matching.clear()
+        else:
+            self._matching.pop(device_id, None)
+
+    def restore(self, rule_id: int, device_id: int, instance: str, started_at: datetime) -> None:
+        """Mark a series as firing (an alert still open in the database), so it resolves instead of re-firing."""
+        if rule_id not in self._rule_ids:
+            return
+        series = self._series.setdefault((rule_id, device_id, instance), _Series())
+        series.firing = True
+        series.breach_since = started_at.timestamp()
+
+    def _rules_for(self, device_id: int, family: str) -> List[Rule]:
+        families = self._matching.get(device_id)
+        if families is None:
+            tags = set(self.device_tags(device_id) or ())
+            families = {
+                fam: [r for r in rules if all(t in tags for t in r.tags)]
+                for fam, rules in self._rules.items()
+            }
+            self._matching[device_id] = families
+        return families.get(family, ())
+
+    def observe(self, family: str, rows: Iterable[Dict[str, Any]]) -> None:
+        """Evaluate committed rows of one metric family (as written: device_id, timestamp, fields)."""
+        if family not in self._rules:
+            return
+        key_column = INSTANCE_KEYS[family]
+        for row in rows:
+            rules = self._rules_for(row["device_id"], family)
+            if not rules:
+                continue
+            instance = str(row[key_column]) if key_column else ""
+            ts = row["timestamp"].timestamp()
+            for rule in rules:
+                if rule.instance is not None and rule.instance != instance:
+                    continue
+                self._evaluate(rule, row, instance, ts)
+
+    def _evaluate(self, rule: Rule, row: Dict[str, Any], instance: str, ts: float) -> None:
+        key = (rule.id, row["device_id"], instance)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = _Series()
+        if ts <= series.last_ts:
+            return  # late or duplicate sample; the window only moves forward
+
+        value = _number(row.get(rule.field))
+        if rule.rate:
+            counter, previous, elapsed = value, series.prev_value, ts - series.last_ts
+            series.prev_value = counter
+            if counter is not None and previous is not None and counter >= previous and elapsed > 0:
+                value = (counter - previous) / elapsed
+            else:
+                # First reading, counter reset, or an agent that only sends rates
+                value = _number(row.get(f"{rule.field}_per_sec"))
+        series.last_ts = ts
+        if value is None:
+            return
+        self.evaluated += 1
+
+        if OPERATORS[rule.op](value, rule.threshold):
+            if series.breach_since is None:
+                series.breach_since = ts
+            if not series.firing and ts - series.breach_since >= rule.for_seconds:
+                series.firing = True
+                self.fired += 1
+                self._emit("firing", rule, key, value, series.breach_since)
+        else:
+            series.breach_since = None
+            if series.firing:
+                series.firing = False
+                self.resolved += 1
+                self._emit("resolved", rule, key, value, ts)
+
+    def _emit(self, state: str, rule: Rule, key: Tuple[int, int, str], value: float, at: float) -> None:
+        _, device_id, instance = key
+        where = f" on {instance}" if instance else ""
+        if state == "firing":
+            message = f"{rule.name}: {rule.describe()}{where} (value {value:.2f})"
+        else:
+            message = f"{rule.name} resolved{where} (value {value:.2f})"
+        self._transitions.append(Transition(
+            state, rule, device_id, instance, value, datetime.fromtimestamp(at, tz=timezone.utc), message
+        ))
+
+    def take_transitions(self) -> List[Transition]:
+        taken, self._transitions = self._transitions, []
+        return taken
+
+    def requeue(self, transitions: List[Transition]) -> None:
+        """Put transitions that could not be persisted back in front of newer ones."""
+        self._transitions[:0] = transitions
+
+    def prune(self, cutoff: datetime) -> None:
+        """Forget quiet, non-firing series (removed mounts/interfaces) not updated since ``cutoff``."""
+        cutoff_ts = cutoff.timestamp()
+        for key in [k for k, s in self._series.items() if not s.firing and s.last_ts < cutoff_ts]:
+            del self._series[key]
+
+    def stats(self) -> dict:
+        return {
+            "rules": len(self._rule_ids),
+            "series": len(self._series),
+            "firing": sum(1 for s in self._series.values() if s.firing),
+            "pending_transitions": len(self._transitions),
+            "evaluated": self.evaluated,
+            "fired": self.fired,
+            "resolved": self.resolved,
+        }
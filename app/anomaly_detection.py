@@ -0,0 +1,376 @@
+# anomaly_detection.py
+"""Fleet-wide anomaly scores from recent metric history, computed with NumPy.
+
+A run pulls the lookback window of each raw metric table with a binary
+``COPY ... TO STDOUT``, averaged by the server onto a regular time grid.
+Every row has a fixed width (missing values become NaN on the server), so the
+whole stream is parsed with one ``np.frombuffer`` instead of building a
+Python object per row. The rows then form a ``series x slots`` matrix per
+field, with one series per device, mount point or interface.
+
+Each series is scored against its own trailing baseline: the mean and
+standard deviation of the ``baseline_slots`` before a sample. Cumulative sums
+give that baseline for any slot in constant time, for all series at once.
+The score of a sample is its z-score against the baseline. A per-field
+floor on the standard deviation keeps flat series, such as an idle CPU,
+from producing huge scores on tiny changes.
+
+Devices are processed in chunks of about ``chunk_series`` series (a device
+with many interfaces counts once per interface), which bounds both the COPY
+buffer and the ``series x slots`` matrices of one chunk.
+"""
+import asyncio
+import time
+import warnings
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+PGCOPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+PGCOPY_HEADER = np.dtype([("signature", "S11"), ("flags", ">i4"), ("extension", ">i4")])
+
+
+class AnomalyField(NamedTuple):
+    name: str
+    min_std: float  # floor for the baseline standard deviation, in the field's unit
+
+
+class AnomalySource(NamedTuple):
+    family: str
+    table: str
+    instance_column: Optional[str]  # None for families with one row per device
+    latest_table: str  # names instances: the COPY only carries hashtext(instance)
+    fields: Tuple[AnomalyField, ...]
+
+
+class CopyLayoutError(ValueError):
+    pass
+
+
+def copy_query(source: AnomalySource) -> str:
+    """SELECT for ``COPY (...) TO STDOUT (FORMAT binary)``; $1 = device ids, $2 = window start, $3 = slot seconds.
+
+    Samples are averaged per slot (agents may sample faster than the grid), and
+    every output column is NOT NULL and fixed-width, so each row has the same byte length.
+    """
+    instance = f"hashtext({source.instance_column})" if source.instance_column else "0"
+    values = ", ".join(f"COALESCE(avg(CAST({f.name} AS float8)), 'NaN')" for f in source.fields)
+    return (
+        f"SELECT device_id, {instance}, "
+        f"CAST(floor(extract(epoch FROM \"timestamp\" - $2::timestamptz) / $3) AS int4), {values} "
+        f"FROM {source.table} "
+        f"WHERE device_id = ANY($1::int4[]) AND \"timestamp\" >= $2::timestamptz "
+        f"GROUP BY 1, 2, 3"
+    )
+
+
+def instance_names_query(source: AnomalySource) -> Optional[str]:
+    if not source.instance_column:
+        return None
+    return f"SELECT DISTINCT hashtext({source.instance_column}) AS h, {source.instance_column} AS name FROM {source.latest_table}"
+
+
+def instance_counts_query(source: AnomalySource) -> Optional[str]:
+    if not source.instance_column:
+        return None
+    return f"SELECT device_id, count(*) AS n FROM {source.latest_table} GROUP BY device_id"
+
+
+def plan_chunks(device_ids: Sequence[int], series_per_device: Dict[int, int], chunk_series: int) -> List[List[int]]:
+    """Split (sorted) device ids into runs of about ``chunk_series`` series each."""
+    chunks: List[List[int]] = []
+    current: List[int] = []
+    series = 0
+    for device_id in device_ids:
+        n = series_per_device.get(device_id, 1)
+        if current and series + n > chunk_series:
+            chunks.append(current)
+            current, series = [], 0
+        current.append(device_id)
+        series += n
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def copy_row_dtype(field_count: int) -> np.dtype:
+    """Layout of one binary COPY tuple: field count, then (length, value) per column, big-endian."""
+    columns = [("fields", ">i2"), ("device_len", ">i4"), ("device_id", ">i4"),
+               ("instance_len", ">i4"), ("instance", ">i4"), ("slot_len", ">i4"), ("slot", ">i4")]
+    for i in range(field_count):
+        columns += [(f"len{i}", ">i4"), (f"v{i}", ">f8")]
+    return np.dtype(columns)
+
+
+def parse_copy(buf: bytes, field_count: int) -> np.ndarray:
+    """Structured array of the rows of a binary COPY produced by ``copy_query``."""
+    if len(buf) < PGCOPY_HEADER.itemsize or not buf.startswith(PGCOPY_SIGNATURE):
+        raise CopyLayoutError("Not a binary COPY stream")
+    header = np.frombuffer(buf, PGCOPY_HEADER, count=1)[0]
+    start = PGCOPY_HEADER.itemsize + int(header["extension"])
+    end = len(buf) - 2  # int16 -1 trailer
+    dtype = copy_row_dtype(field_count)
+    if end < start or (end - start) % dtype.itemsize:
+        raise CopyLayoutError("COPY body is not a whole number of fixed-width rows")
+    rows = np.frombuffer(buf, dtype, count=(end - start) // dtype.itemsize, offset=start)
+    if len(rows) and (rows["fields"] != 3 + field_count).any():
+        raise CopyLayoutError("Unexpected column count in COPY row")
+    return rows
+
+
+def encode_copy(device_id: np.ndarray, instance: np.ndarray, slot: np.ndarray, values: np.ndarray) -> bytes:
+    """Inverse of ``parse_copy`` (for benchmarks); ``values`` is ``rows x fields``."""
+    field_count = values.shape[1]
+    rows = np.zeros(len(device_id), copy_row_dtype(field_count))
+    rows["fields"] = 3 + field_count
+    rows["device_len"] = rows["instance_len"] = rows["slot_len"] = 4
+    rows["device_id"], rows["instance"], rows["slot"] = device_id, instance, slot
+    for i in range(field_count):
+        rows[f"len{i}"] = 8
+        rows[f"v{i}"] = values[:, i]
+    header = np.array([(PGCOPY_SIGNATURE, 0, 0)], PGCOPY_HEADER).tobytes()
+    return header + rows.tobytes() + b"\xff\xff"
+
+
+def _dense_index(values: np.ndarray, uniques: np.ndarray) -> np.ndarray:
+    """Position of each value in ``uniques`` via a lookup table (device ids of a chunk span a small range)."""
+    lut = np.empty(int(uniques[-1] - uniques[0]) + 1, np.intp)
+    lut[uniques - uniques[0]] = np.arange(len(uniques))
+    return lut[values - uniques[0]]
+
+
+def build_matrix(rows: np.ndarray, field_count: int, slots: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(device ids, instance hashes, values[field, series, slot]); missing slots are NaN.
+
+    Series numbers come from lookup tables rather than ``np.unique(return_inverse=True)``,
+    whose argsort over millions of rows would dominate the whole run.
+    """
+    # Columns are converted to native arrays first; masking the packed big-endian records is far slower
+    slot = rows["slot"].astype(np.intp)
+    device = rows["device_id"].astype(np.int64)
+    instance = rows["instance"].astype(np.int64)
+    columns = [rows[f"v{i}"].astype(np.float64) for i in range(field_count)]
+    keep = (slot >= 0) & (slot < slots)
+    if not keep.all():
+        slot, device, instance = slot[keep], device[keep], instance[keep]
+        columns = [c[keep] for c in columns]
+    if not len(slot):
+        return np.empty(0, np.int64), np.empty(0, np.int64), np.full((field_count, 0, slots), np.nan)
+    devices = np.unique(device)
+    instances = np.unique(instance)  # a handful of mount point / interface names
+    pair = _dense_index(device, devices) * len(instances) + np.searchsorted(instances, instance)
+    present = np.zeros(len(devices) * len(instances), bool)
+    present[pair] = True
+    pairs = np.flatnonzero(present)
+    series = _dense_index(pair, pairs)
+
+    values = np.full((field_count, len(pairs), slots), np.nan)
+    flat = series * slots + slot
+    for i, column in enumerate(columns):
+        values[i].reshape(-1)[flat] = column
+    return devices[pairs // len(instances)], instances[pairs % len(instances)], values
+
+
+class SeriesScores(NamedTuple):
+    last_slot: np.ndarray  # index of the newest sample, -1 without data
+    value: np.ndarray  # newest sample
+    mean: np.ndarray  # baseline before the newest sample
+    std: np.ndarray
+    score: np.ndarray  # z-score of the newest sample (NaN while the baseline is too short)
+    peak: np.ndarray  # largest |z| within the recent slots
+
+
+def score_matrix(x: np.ndarray, baseline_slots: int, recent_slots: int, min_samples: int, min_std: float) -> SeriesScores:
+    """Trailing-baseline z-scores for every series (row) of ``x`` at once.
+
+    Only the recent slots and each series' newest sample are scored; the prefix
+    sums make any other slot just as cheap should it be needed.
+    """
+    series, slots = x.shape
+    valid = ~np.isnan(x)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN series
+        center = np.nan_to_num(np.nanmean(x, axis=1, keepdims=True))
+    # Centering per series keeps the sum-of-squares variance numerically sane for large byte rates
+    d = np.where(valid, x - center, 0.0)
+
+    def prefix(a: np.ndarray) -> np.ndarray:
+        out = np.zeros((series, slots + 1))
+        np.cumsum(a, axis=1, out=out[:, 1:])
+        return out
+
+    c_n, c_1, c_2 = prefix(valid), prefix(d), prefix(d * d)
+
+    def z_at(rows: np.ndarray, cols: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Baseline of slot t covers [t - baseline_slots, t), excluding the sample itself
+        lo = np.maximum(cols - baseline_slots, 0)
+        n = c_n[rows, cols] - c_n[rows, lo]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = (c_1[rows, cols] - c_1[rows, lo]) / n
+            std = np.maximum(np.sqrt(np.maximum((c_2[rows, cols] - c_2[rows, lo]) / n - mean * mean, 0.0)), min_std)
+            z = (d[rows, cols] - mean) / std
+        z[~valid[rows, cols] | (n < min_samples)] = np.nan
+        return z, mean, std
+
+    rows = np.arange(series)
+    recent = np.arange(max(slots - recent_slots, 0), slots)
+    z_recent, _, _ = z_at(rows[:, None], recent[None, :])
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        peak = np.nanmax(np.abs(z_recent), axis=1)
+
+    has_data = valid.any(axis=1)
+    last = np.where(has_data, slots - 1 - np.argmax(valid[:, ::-1], axis=1), -1)
+    z_last, mean_last, std_last = z_at(rows, np.maximum(last, 0))
+    return SeriesScores(
+        last_slot=last,
+        value=np.where(has_data, x[rows, np.maximum(last, 0)], np.nan),
+        mean=np.where(has_data, mean_last + center[:, 0], np.nan),
+        std=np.where(has_data, std_last, np.nan),
+        score=np.where(has_data, z_last, np.nan),
+        peak=peak,
+    )
+
+
+class FieldResult(NamedTuple):
+    family: str
+    field: str
+    device_ids: np.ndarray
+    instances: np.ndarray  # hashtext of the mount point / interface, 0 for per-device families
+    scores: SeriesScores
+
+
+def score_rows(source: AnomalySource, rows: np.ndarray, slots: int, baseline_slots: int,
+               recent_slots: int, min_samples: int) -> List[FieldResult]:
+    """CPU-bound part of a chunk: matrix building and scoring (safe to run in a thread)."""
+    device_ids, instances, values = build_matrix(rows, len(source.fields), slots)
+    return [
+        FieldResult(source.family, f.name, device_ids, instances,
+                    score_matrix(values[i], baseline_slots, recent_slots, min_samples, f.min_std))
+        for i, f in enumerate(source.fields)
+    ]
+
+
+class AnomalyReport:
+    """Scores of the latest run; queried with NumPy masks, turned into dicts only for the rows returned."""
+
+    def __init__(self, results: Sequence[FieldResult], instance_names: Dict[int, str],
+                 window_start: datetime, slot_seconds: int, finished_at: datetime, duration_seconds: float):
+        self.results = list(results)
+        self.instance_names = instance_names
+        self.window_start = window_start
+        self.slot_seconds = slot_seconds
+        self.finished_at = finished_at
+        self.duration_seconds = duration_seconds
+
+    @property
+    def series(self) -> int:
+        return sum(len(r.device_ids) for r in self.results)
+
+    def _rows(self, result: FieldResult, index: Iterable[int]) -> List[dict]:
+        s = result.scores
+        start = self.window_start.timestamp()
+        out = []
+        for i in index:
+            instance = int(result.instances[i])
+            out.append({
+                "device_id": int(result.device_ids[i]),
+                "family": result.family,
+                "field": result.field,
+                "instance": self.instance_names.get(instance, f"#{instance & 0xFFFFFFFF:08x}") if instance else None,
+                "timestamp": datetime.fromtimestamp(start + int(s.last_slot[i]) * self.slot_seconds, tz=timezone.utc),
+                "value": float(s.value[i]),
+                "baseline_mean": float(s.mean[i]),
+                "baseline_std": float(s.std[i]),
+                "score": None if np.isnan(s.score[i]) else round(float(s.score[i]), 3),
+                "peak_score": None if np.isnan(s.peak[i]) else round(float(s.peak[i]), 3),
+            })
+        return out
+
+    def query(self, min_score: float = 0.0, family: Optional[str] = None,
+              device_id: Optional[int] = None, limit: int = 100) -> List[dict]:
+        """Series whose recent peak |z| is at least ``min_score``, strongest first."""
+        candidates = []
+        for result in self.results:
+            if family is not None and result.family != family:
+                continue
+            mask = result.scores.peak >= min_score  # NaN peaks never match
+            if device_id is not None:
+                mask &= result.device_ids == device_id
+            for i in np.flatnonzero(mask):
+                candidates.append((float(result.scores.peak[i]), result, int(i)))
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        out = []
+        for _, result, i in candidates[:limit]:
+            out += self._rows(result, (i,))
+        return out
+
+    def stats(self) -> dict:
+        return {
+            "finished_at": self.finished_at,
+            "duration_seconds": round(self.duration_seconds, 3),
+            "window_start": self.window_start,
+            "slot_seconds": self.slot_seconds,
+            "series": self.series,
+        }
+
+
+class AnomalyDetector:
+    """Runs the scoring job over the whole fleet and keeps the latest report."""
+
+    def __init__(self, sources: Sequence[AnomalySource], lookback_seconds: int, slot_seconds: int,
+                 baseline_seconds: int, recent_seconds: int, min_samples: int, chunk_series: int):
+        self.sources = list(sources)
+        self.slot_seconds = slot_seconds
+        self.slots = lookback_seconds // slot_seconds + 1  # the last slot is the one in progress
+        self.baseline_slots = baseline_seconds // slot_seconds
+        self.recent_slots = max(recent_seconds // slot_seconds, 1)
+        self.min_samples = min_samples
+        self.chunk_series = chunk_series
+        self.report: Optional[AnomalyReport] = None
+        self.runs = 0
+        self.copied_bytes = 0
+
+    def score_chunk(self, source: AnomalySource, buf: bytearray) -> List[FieldResult]:
+        rows = parse_copy(buf, len(source.fields))
+        return score_rows(source, rows, self.slots, self.baseline_slots, self.recent_slots, self.min_samples)
+
+    async def run(self, conn, device_ids: Sequence[int], now: datetime) -> AnomalyReport:
+        """Score every device; ``conn`` is an asyncpg connection, the NumPy work runs in a worker thread."""
+        started = time.perf_counter()
+        epoch = int(now.timestamp())
+        window_start = datetime.fromtimestamp(epoch - epoch % self.slot_seconds, tz=timezone.utc) \
+            - timedelta(seconds=(self.slots - 1) * self.slot_seconds)
+        names: Dict[int, str] = {}
+        results: List[FieldResult] = []
+        for source in self.sources:
+            counts: Dict[int, int] = {}
+            if source.instance_column:
+                names.update((r["h"], r["name"]) for r in await conn.fetch(instance_names_query(source)))
+                counts = {r["device_id"]: r["n"] for r in await conn.fetch(instance_counts_query(source))}
+            query = copy_query(source)
+            for chunk in plan_chunks(device_ids, counts, self.chunk_series):
+                buf = bytearray()
+
+                async def sink(data: bytes) -> None:
+                    buf.extend(data)
+
+                await conn.copy_from_query(query, chunk, window_start, self.slot_seconds, output=sink, format="binary")
+                self.copied_bytes += len(buf)
+                results += await asyncio.to_thread(self.score_chunk, source, buf)
+
+        self.report = AnomalyReport(
+            results, names, window_start, self.slot_seconds, datetime.now(timezone.utc), time.perf_counter() - started
+        )
+        self.runs += 1
+        return self.report
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "copied_bytes": self.copied_bytes,
+            "slots": self.slots,
+            "baseline_slots": self.baseline_slots,
+            "last_run": self.report.stats() if self.report is not None else None,
+        }
@@ -0,0 +1,507 @@
+# benchmark.py
+"""Benchmarks for the NMS API. Devices used here are registered first if missing.
+
+Compare ingest throughput of the single-sample and batch collect endpoints:
+
+    python benchmark.py --devices 50 --samples 2000 --batch-size 500
+
+Simulate a fleet of agents against a server backed by a local Postgres,
+mixing ingest with the read endpoints, and keep the results:
+
+    python benchmark.py --fleet --devices 500 --duration 60 --concurrency 32 \
+        --mix collect=90,latest=8,list=2 --output results.json --baseline previous.json
+
+The fleet run reports, per endpoint, requests/s, p50/p95/p99 latency and the
+database time per request taken from the server's Server-Timing header, plus
+samples/s and rows/s for ingest. --output writes the same as JSON (with the
+git commit and configuration) and --baseline compares against such a file.
+The load is generated by threads, so watch the client's CPU on large runs.
+
+Each synthetic sample mimics server_agent.py: one CPU and memory block, a few
+disks and a few interfaces.
+
+With --codec no server is needed: it measures the server-side decode and
+validate cost per sample of a JSON batch against a binary (wire_format) one.
+
+With --anomaly no server or database is needed either: it builds the binary
+COPY stream the anomaly job would receive for --devices devices (24h of 30s
+samples, disks and interfaces per device as in --fleet) and times parsing and
+scoring it with the server's configuration, against ANOMALY_INTERVAL_SECONDS:
+
+    python benchmark.py --anomaly --devices 10000
+
+With --serialize no server or database is needed: it encodes one history
+response of --samples CPU buckets the way FastAPI's generic encoder does
+(mappings, jsonable_encoder, json) and with the server's row serializers and
+orjson, in both the rows and the columnar shape.
+"""
+import argparse
+import json
+import platform
+import random
+import re
+import subprocess
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+import wire_format
+
+DEFAULT_API = "http://127.0.0.1:8000"
+DEFAULT_MIX = "collect=90,latest=8,list=2"
+SERVER_TIMING_DB = re.compile(r"(?:^|,)\s*db;dur=([0-9.]+)")
+
+
+def make_payload(device_ip, ts, disks=3, nics=4):
+    return {
+        "device_ip": device_ip,
+        "timestamp": ts.isoformat(),
+        "cpu": {
+            "cpu_usage_percent": round(random.uniform(0, 100), 2),
+            "cpu_user": round(random.uniform(0, 60), 2),
+            "cpu_system": round(random.uniform(0, 20), 2),
+            "cpu_idle": round(random.uniform(0, 100), 2),
+            "cpu_iowait": round(random.uniform(0, 5), 2),
+            "load_avg_1": round(random.uniform(0, 8), 2),
+            "load_avg_5": round(random.uniform(0, 8), 2),
+            "load_avg_15": round(random.uniform(0, 8), 2),
+            "core_count": 8,
+        },
+        "memory": {
+            "total_mb": 16384,
+            "used_mb": random.randint(1000, 16000),
+            "free_mb": random.randint(100, 8000),
+            "available_mb": random.randint(100, 8000),
+            "usage_percent": round(random.uniform(0, 100), 2),
+            "swap_total_mb": 2048,
+            "swap_used_mb": random.randint(0, 2048),
+            "swap_free_mb": random.randint(0, 2048),
+        },
+        "disk": [
+            {
+                "mount_point": f"/mnt/d{i}",
+                "device_name": f"/dev/sd{chr(97 + i)}1",
+                "filesystem_type": "ext4",
+                "total_gb": 500.0,
+                "used_gb": round(random.uniform(0, 500), 2),
+                "free_gb": round(random.uniform(0, 500), 2),
+                "usage_percent": round(random.uniform(0, 100), 2),
+                "inode_usage_percent": 0,
+                "read_bytes": random.randint(0, 10**12),
+                "write_bytes": random.randint(0, 10**12),
+                "read_ops": random.randint(0, 10**9),
+                "write_ops": random.randint(0, 10**9),
+            }
+            for i in range(disks)
+        ],
+        "network": [
+            {
+                "interface_name": f"eth{i}",
+                "bytes_sent": random.randint(0, 10**12),
+                "bytes_recv": random.randint(0, 10**12),
+                "packets_sent": random.randint(0, 10**9),
+                "packets_recv": random.randint(0, 10**9),
+                "errors_in": 0,
+                "errors_out": 0,
+                "drops_in": 0,
+                "drops_out": 0,
+                "speed_mbps": 1000,
+                "status": "UP",
+            }
+            for i in range(nics)
+        ],
+    }
+
+
+def make_samples(device_ips, count):
+    # Distinct timestamps per device so no sample collides on the primary key
+    start = datetime.now(timezone.utc) - timedelta(seconds=count)
+    return [make_payload(device_ips[i % len(device_ips)], start + timedelta(seconds=i)) for i in range(count)]
+
+
+def ensure_devices(session, api, device_ips):
+    for n, ip in enumerate(device_ips):
+        session.post(f"{api}/devices/", json={"hostname": f"bench-{n}", "ip_address": ip})
+
+
+def run_single(session, api, samples):
+    start = time.perf_counter()
+    for sample in samples:
+        session.post(f"{api}/devices/metrics/collect", json=sample).raise_for_status()
+    return time.perf_counter() - start
+
+
+def run_batch(session, api, samples, batch_size):
+    start = time.perf_counter()
+    for i in range(0, len(samples), batch_size):
+        r = session.post(f"{api}/devices/metrics/collect/batch", json=samples[i:i + batch_size])
+        r.raise_for_status()
+        body = r.json()
+        if body["rejected"]:
+            print(f"  batch at {i}: {body['rejected']} rejected")
+    return time.perf_counter() - start
+
+
+def run_codec(samples, rounds=5):
+    """Best-of-``rounds`` seconds to decode + validate ``samples`` as JSON and as binary, plus body sizes."""
+    from main import CollectMetricsPayload, payload_families  # server-side code path, imported only here
+
+    json_body = json.dumps(samples, separators=(",", ":")).encode()
+    binary_body = wire_format.encode(samples)
+
+    def decode_json():
+        for raw in json.loads(json_body):
+            payload_families(CollectMetricsPayload(**raw))
+
+    def decode_binary():
+        wire_format.decode(binary_body)
+
+    timings = {}
+    for name, fn in (("json", decode_json), ("binary", decode_binary)):
+        best = float("inf")
+        for _ in range(rounds):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+    return timings, {"json": len(json_body), "binary": len(binary_body)}
+
+
+# -----------------------
+# Anomaly detection
+# -----------------------
+def python_loop_scores(series, baseline_slots, recent_slots, min_samples, min_std):
+    """Reference per-series loop: the same trailing-baseline z-scores, one Python float at a time."""
+    out = []
+    for values in series:
+        n = s1 = s2 = 0.0
+        window = []
+        peak = 0.0
+        for t, v in enumerate(values):
+            if t >= len(values) - recent_slots and n >= min_samples:
+                mean = s1 / n
+                std = max((max(s2 / n - mean * mean, 0.0)) ** 0.5, min_std)
+                peak = max(peak, abs(v - mean) / std)
+            window.append(v)
+            n, s1, s2 = n + 1, s1 + v, s2 + v * v
+            if len(window) > baseline_slots:
+                old = window.pop(0)
+                n, s1, s2 = n - 1, s1 - old, s2 - old * old
+        out.append(peak)
+    return out
+
+
+def run_anomaly(agents, seed, loop_sample=50):
+    """Time the anomaly job's CPU work (COPY parsing, matrices, scoring) for a fleet, chunk by chunk."""
+    import numpy as np
+    from anomaly_detection import AnomalyReport, encode_copy, plan_chunks
+    from main import ANOMALY_SOURCES, anomaly_detector as detector  # server-side configuration
+
+    rng = np.random.default_rng(seed)
+    slots = detector.slots
+    results, timings, injected = [], {}, 0
+    device_ids = list(range(1, len(agents) + 1))
+    for source in ANOMALY_SOURCES:
+        counts = {}
+        if source.instance_column:
+            counts = {i: (a.disks if source.family == "disk" else a.nics) for i, a in zip(device_ids, agents)}
+        elapsed = copied = series_total = 0
+        for chunk in plan_chunks(device_ids, counts, detector.chunk_series):
+            per_device = [counts.get(d, 1) for d in chunk]
+            series = sum(per_device)
+            device = np.repeat(np.repeat(chunk, per_device), slots)
+            instance = np.repeat(np.concatenate([np.arange(n) for n in per_device]), slots) if counts else np.zeros_like(device)
+            slot = np.tile(np.arange(slots), series)
+            # Noise of 3 sd-floors per field, so every field is scored on its own scale
+            scale = np.array([f.min_std for f in source.fields])
+            level = rng.uniform(10, 60, (series, 1, len(source.fields))) * scale
+            values = (level + rng.normal(0, 3, (series, slots, len(source.fields))) * scale).reshape(-1, len(source.fields))
+            # One clear anomaly per chunk: the newest few samples of the first series jump by 25 sd
+            values[slots - 3:slots, 0] += 75 * scale[0]
+            injected += 1
+            buf = bytearray(encode_copy(device, instance, slot, values))
+
+            start = time.perf_counter()
+            results += detector.score_chunk(source, buf)
+            elapsed += time.perf_counter() - start
+            copied += len(buf)
+            series_total += series
+        timings[source.family] = {"seconds": elapsed, "series": series_total, "fields": len(source.fields), "copy_mb": copied / 1e6}
+
+    report = AnomalyReport(results, {}, datetime.now(timezone.utc), detector.slot_seconds, datetime.now(timezone.utc), 0)
+    found = len(report.query(min_score=10, limit=10 ** 9))
+
+    # Extrapolate a per-series Python loop from a small sample of the CPU series
+    sample = rng.normal(30, 3, (loop_sample, slots)).tolist()
+    start = time.perf_counter()
+    python_loop_scores(sample, detector.baseline_slots, detector.recent_slots, detector.min_samples, 1.0)
+    loop_per_series = (time.perf_counter() - start) / loop_sample
+    series_fields = sum(t["series"] * t["fields"] for t in timings.values())
+    return timings, found, injected, loop_per_series * series_fields
+
+
+# -----------------------
+# Response serialization
+# -----------------------
+def run_serialize(points, rounds=5):
+    """Best-of-``rounds`` seconds and body size to encode a ``points``-bucket CPU history, per encoder."""
+    from decimal import Decimal
+    from fastapi.encoders import jsonable_encoder
+    from serializers import dumps
+    from main import HISTORY_SERIALIZERS  # server-side code path, imported only here
+
+    serializer = HISTORY_SERIALIZERS["cpu"]
+    rng = random.Random(1)
+    start_ts = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for i in range(points):
+        row = [1, start_ts + timedelta(minutes=i), 60]
+        for _ in range((len(serializer.names) - 3) // 4):
+            low = rng.uniform(0, 50)
+            row += [Decimal(f"{low:.2f}"), Decimal(f"{low + 20:.2f}"), low + 10.0, Decimal(f"{low + 5:.2f}")]
+        rows.append(tuple(row))
+
+    encoders = {
+        "generic": lambda: json.dumps(jsonable_encoder([dict(zip(serializer.names, r)) for r in rows])).encode(),
+        "rows": lambda: dumps(serializer.rows(rows)),
+        "columnar": lambda: dumps(serializer.columns(rows)),
+    }
+    results = {}
+    for name, fn in encoders.items():
+        best = float("inf")
+        for _ in range(rounds):
+            start = time.perf_counter()
+            body = fn()
+            best = min(best, time.perf_counter() - start)
+        results[name] = (best, len(body))
+    return results
+
+
+# -----------------------
+# Fleet simulation
+# -----------------------
+class Agent:
+    """One simulated agent: a fixed IP and a fixed hardware profile, like a real host."""
+
+    def __init__(self, ip, disks, nics):
+        self.ip = ip
+        self.disks = disks
+        self.nics = nics
+        self.rows = 2 + disks + nics  # cpu + memory + one row per disk and interface
+        self.lock = threading.Lock()  # one request in flight per agent, as with server_agent.py
+
+
+def make_fleet(device_ips, max_disks, max_nics, seed):
+    rng = random.Random(seed)
+    return [Agent(ip, rng.randint(1, max_disks), rng.randint(1, max_nics)) for ip in device_ips]
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("collect", "latest", "list"):
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r} in --mix")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def db_ms(response):
+    match = SERVER_TIMING_DB.search(response.headers.get("Server-Timing", ""))
+    return float(match.group(1)) if match else None
+
+
+def fleet_worker(api, agents, mix, deadline, seed, records):
+    """Issue requests until ``deadline``; appends (operation, latency s, ok, db ms, rows) to ``records``."""
+    rng = random.Random(seed)
+    session = requests.Session()
+    operations, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        operation = rng.choices(operations, weights)[0]
+        agent = rng.choice(agents)
+        rows = 0
+        start = time.perf_counter()
+        try:
+            if operation == "collect":
+                with agent.lock:
+                    payload = make_payload(agent.ip, datetime.now(timezone.utc), agent.disks, agent.nics)
+                    start = time.perf_counter()
+                    r = session.post(f"{api}/devices/metrics/collect", json=payload)
+                rows = agent.rows
+            elif operation == "latest":
+                r = session.get(f"{api}/devices/{agent.ip}/metrics")
+            else:
+                r = session.get(f"{api}/devices/")
+        except requests.RequestException:
+            records.append((operation, time.perf_counter() - start, False, None, 0))
+            continue
+        records.append((operation, time.perf_counter() - start, r.ok, db_ms(r), rows if r.ok else 0))
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(records, elapsed):
+    by_operation = {}
+    for operation, latency, ok, db, rows in records:
+        by_operation.setdefault(operation, []).append((latency, ok, db, rows))
+    out = {}
+    for operation, items in sorted(by_operation.items()):
+        latencies = sorted(latency * 1000 for latency, ok, _, _ in items if ok)
+        db_times = sorted(db for _, ok, db, _ in items if ok and db is not None)
+        ok_count = len(latencies)
+        stats = {
+            "requests": len(items),
+            "errors": len(items) - ok_count,
+            "requests_per_sec": round(ok_count / elapsed, 2),
+            "latency_ms": {
+                "p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "p99": percentile(latencies, 99),
+                "mean": sum(latencies) / ok_count if ok_count else None, "max": latencies[-1] if latencies else None,
+            },
+            "db_ms": {
+                "p50": percentile(db_times, 50), "p95": percentile(db_times, 95),
+                "mean": sum(db_times) / len(db_times) if db_times else None,
+            },
+        }
+        if operation == "collect":
+            stats["samples_per_sec"] = stats["requests_per_sec"]
+            stats["rows_per_sec"] = round(sum(rows for _, _, _, rows in items) / elapsed, 2)
+        out[operation] = stats
+    return out
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_fleet(api, agents, mix, duration, concurrency, seed):
+    records = []  # list.append is atomic, so workers share it without a lock
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=fleet_worker, args=(api, agents, mix, deadline, seed + n, records), daemon=True)
+        for n in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(records, time.perf_counter() - start)
+
+
+def print_fleet_report(operations, baseline=None):
+    def fmt(value):
+        return f"{value:9.2f}" if value is not None else "        -"
+
+    print(f"{'operation':<9} {'req/s':>9} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'db ms':>9}")
+    for operation, stats in operations.items():
+        latency = stats["latency_ms"]
+        print(f"{operation:<9} {stats['requests_per_sec']:9.1f} {stats['errors']:7d} "
+              f"{fmt(latency['p50'])} {fmt(latency['p95'])} {fmt(latency['p99'])} {fmt(stats['db_ms']['mean'])}")
+        if operation == "collect":
+            print(f"{'':<9} {stats['samples_per_sec']:.1f} samples/s, {stats['rows_per_sec']:.1f} rows/s")
+        before = (baseline or {}).get(operation)
+        if before:
+            def change(new, old):
+                return f"{(new - old) / old * 100:+.1f}%" if new is not None and old else "n/a"
+            print(f"{'':<9} vs baseline: req/s {change(stats['requests_per_sec'], before['requests_per_sec'])}, "
+                  f"p95 {change(latency['p95'], before['latency_ms']['p95'])}, "
+                  f"p99 {change(latency['p99'], before['latency_ms']['p99'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api", default=DEFAULT_API)
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--samples", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--codec", action="store_true", help="benchmark JSON vs binary decoding only (no server)")
+    parser.add_argument("--fleet", action="store_true", help="simulate --devices agents for --duration seconds")
+    parser.add_argument("--anomaly", action="store_true", help="time the anomaly job's scoring for --devices devices (no server)")
+    parser.add_argument("--serialize", action="store_true", help="time history response encoding for --samples buckets (no server)")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent requests (worker threads)")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help=f"operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--max-disks", type=int, default=6)
+    parser.add_argument("--max-nics", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--label", default=None, help="free-form name stored in the --output file")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    if args.codec:
+        timings, sizes = run_codec(make_samples(["10.250.0.1"], args.samples))
+        for name in ("json", "binary"):
+            per_sample = timings[name] / args.samples * 1e6
+            print(f"{name:>6}: {per_sample:8.1f} us/sample, {sizes[name] / args.samples:7.1f} bytes/sample")
+        print(f"speedup: {timings['json'] / timings['binary']:6.1f}x")
+        return
+
+    if args.serialize:
+        results = run_serialize(args.samples)
+        for name, (seconds, size) in results.items():
+            print(f"{name:>8}: {seconds * 1e3:8.2f} ms, {size / 1024:8.1f} KiB, "
+                  f"{results['generic'][0] / seconds:5.1f}x")
+        return
+
+    device_ips = [f"10.250.{n // 250}.{n % 250 + 1}" for n in range(args.devices)]
+    if args.anomaly:
+        from main import ANOMALY_INTERVAL_SECONDS
+
+        timings, found, injected, loop_estimate = run_anomaly(make_fleet(device_ips, args.max_disks, args.max_nics, args.seed), args.seed)
+        total = sum(t["seconds"] for t in timings.values())
+        for family, t in timings.items():
+            print(f"{family:>8}: {t['series']:7d} series x {t['fields']} fields, "
+                  f"{t['copy_mb']:8.1f} MB COPY, {t['seconds']:7.2f}s")
+        print(f"   total: {total:7.2f}s for {args.devices} devices "
+              f"({total / ANOMALY_INTERVAL_SECONDS:.0%} of the {ANOMALY_INTERVAL_SECONDS}s job interval)")
+        print(f"injected anomalies found: {found}/{injected}")
+        print(f"per-series Python loop (extrapolated): {loop_estimate:7.1f}s, {loop_estimate / total:5.1f}x slower")
+        return
+
+    session = requests.Session()
+    ensure_devices(session, args.api, device_ips)
+
+    if args.fleet:
+        agents = make_fleet(device_ips, args.max_disks, args.max_nics, args.seed)
+        started_at = datetime.now(timezone.utc).isoformat()
+        operations = run_fleet(args.api, agents, args.mix, args.duration, args.concurrency, args.seed)
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)["operations"]
+        print_fleet_report(operations, baseline)
+        if args.output:
+            result = {
+                "label": args.label,
+                "started_at": started_at,
+                "git_commit": git_commit(),
+                "python": platform.python_version(),
+                "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+                "operations": operations,
+            }
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent=2)
+        return
+
+    single = run_single(session, args.api, make_samples(device_ips, args.samples))
+    batch = run_batch(session, args.api, make_samples(device_ips, args.samples), args.batch_size)
+
+    print(f"single-sample: {args.samples / single:10.1f} samples/s ({single:.2f}s)")
+    print(f"batch ({args.batch_size:>5}): {args.samples / batch:10.1f} samples/s ({batch:.2f}s)")
+    print(f"speedup:       {single / batch:10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# db_routing.py
+"""Engines for the primary and read replicas, and routing of read-only sessions.
+
+Query endpoints open their session through ``ReadRouter.session()``: it picks
+a healthy replica round-robin and falls back to the primary when there is
+none, or when connecting to the chosen replica fails. A replica counts as
+healthy while its last check succeeded and its replay lag was within
+``max_lag_seconds``; ``monitor()`` re-checks every replica periodically.
+"""
+import asyncio
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+logger = logging.getLogger(__name__)
+
+# Replication lag in seconds; 0 when the replica has replayed everything it received
+# (an idle primary makes pg_last_xact_replay_timestamp() look old without any real lag)
+REPLICA_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+def make_engine(url: str, *, pool_size: int, max_overflow: int, pool_timeout: float, pool_recycle: int,
+                statement_cache_size: int, connect_timeout: float, command_timeout: float,
+                statement_timeout_ms: int, poolclass=None, application_name: str = "nms") -> AsyncEngine:
+    """Async engine with explicit pool sizing and asyncpg timeouts/statement cache."""
+    options = {}
+    if poolclass is not None:
+        options["poolclass"] = poolclass
+    return create_async_engine(
+        url,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+        pool_recycle=pool_recycle,
+        connect_args={
+            "prepared_statement_cache_size": statement_cache_size,  # SQLAlchemy's adapter-level cache
+            "statement_cache_size": statement_cache_size,  # asyncpg's own cache
+            "timeout": connect_timeout,
+            "command_timeout": command_timeout,
+            "server_settings": {"statement_timeout": str(statement_timeout_ms), "application_name": application_name},
+        },
+        **options,
+    )
+
+
+class Replica:
+    def __init__(self, url: str, engine: AsyncEngine):
+        self.name = make_url(url).render_as_string(hide_password=True)
+        self.engine = engine
+        self.sessionmaker = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+        self.healthy = False  # until the first check passes
+        self.lag_seconds: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+
+    def mark_down(self, error: Exception) -> None:
+        if self.healthy:
+            logger.warning("Read replica %s unavailable, using the primary: %s", self.name, error)
+        self.healthy = False
+        self.last_error = str(error)
+
+
+class ReadRouter:
+    def __init__(self, primary: Callable[[], AsyncSession], replicas: List[Replica],
+                 max_lag_seconds: float, check_interval_seconds: float):
+        self.primary = primary
+        self.replicas = replicas
+        self.max_lag_seconds = max_lag_seconds
+        self.check_interval_seconds = check_interval_seconds
+        self._next = itertools.count()
+        self.replica_sessions = 0
+        self.primary_sessions = 0
+        self.fallbacks = 0
+
+    def pick(self) -> Optional[Replica]:
+        healthy = [r for r in self.replicas if r.healthy]
+        return healthy[next(self._next) % len(healthy)] if healthy else None
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[AsyncSession]:
+        """Read-only session on a healthy replica, else on the primary."""
+        replica = self.pick()
+        if replica is not None:
+            db = replica.sessionmaker()
+            try:
+                # Connect up front so an unreachable replica falls back before any query runs
+                await db.connection()
+            except Exception as e:
+                await db.close()
+                replica.mark_down(e)
+                self.fallbacks += 1
+            else:
+                self.replica_sessions += 1
+                async with db:
+                    yield db
+                return
+        self.primary_sessions += 1
+        async with self.primary() as db:
+            yield db
+
+    async def check(self, replica: Replica) -> None:
+        try:
+            async with replica.engine.connect() as conn:
+                lag = float((await conn.execute(REPLICA_LAG_QUERY)).scalar())
+        except Exception as e:
+            replica.lag_seconds = None
+            replica.mark_down(e)
+        else:
+            replica.lag_seconds = lag
+            replica.last_error = None
+            healthy = lag <= self.max_lag_seconds
+            if healthy != replica.healthy:
+                if healthy:
+                    logger.info("Read replica %s in use (lag %.1fs).", replica.name, lag)
+                else:
+                    logger.warning("Read replica %s lags %.1fs, using the primary.", replica.name, lag)
+            replica.healthy = healthy
+        replica.checked_at = time.time()
+
+    async def monitor(self) -> None:
+        """Background task: re-check every replica every ``check_interval_seconds``."""
+        while True:
+            await asyncio.gather(*(self.check(r) for r in self.replicas))
+            await asyncio.sleep(self.check_interval_seconds)
+
+    async def dispose(self) -> None:
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+    def stats(self) -> dict:
+        return {
+            "replica_sessions": self.replica_sessions,
+            "primary_sessions": self.primary_sessions,
+            "fallbacks": self.fallbacks,
+            "replicas": [
+                {"name": r.name, "healthy": r.healthy, "lag_seconds": r.lag_seconds,
+                 "last_error": r.last_error, "checked_at": r.checked_at}
+                for r in self.replicas
+            ],
+        }
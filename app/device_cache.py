@@ -0,0 +1,164 @@
+# device_cache.py
+"""Bounded in-process cache of device IP -> (id, status) for the ingest path.
+
+Each uvicorn worker keeps its own DeviceCache. Workers that change a device
+publish the IP on a Postgres NOTIFY channel; DeviceCacheListener receives
+those notifications in every other worker and drops the stale entry.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "nms_device_cache"
+INVALIDATE_ALL = "*"
+
+
+_worker_id = (os.getpid(), uuid.uuid4().hex)
+
+
+def worker_id() -> str:
+    """Random id of this process, tagging its NOTIFY messages.
+
+    Pids are not unique across containers or hosts sharing a database, so
+    they cannot tell a worker's own messages apart. The id is regenerated
+    after a fork, so workers forked from a preloaded app get their own.
+    """
+    global _worker_id
+    if _worker_id[0] != os.getpid():
+        _worker_id = (os.getpid(), uuid.uuid4().hex)
+    return _worker_id[1]
+
+
+class CachedDevice(NamedTuple):
+    id: int
+    status: Optional[str]
+    expires_at: float
+
+
+class DeviceCache:
+    """LRU map of normalized IP -> CachedDevice with a TTL safety net."""
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 300):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, CachedDevice]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, ip: str) -> Optional[CachedDevice]:
+        entry = self._entries.get(ip)
+        if entry is None or entry.expires_at < time.monotonic():
+            if entry is not None:
+                del self._entries[ip]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(ip)
+        self.hits += 1
+        return entry
+
+    def put(self, ip: str, device_id: int, status: Optional[str]) -> CachedDevice:
+        entry = CachedDevice(device_id, status, time.monotonic() + self.ttl_seconds)
+        self._entries[ip] = entry
+        self._entries.move_to_end(ip)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def set_status(self, ip: str, status: str) -> None:
+        entry = self._entries.get(ip)
+        if entry is not None:
+            self._entries[ip] = entry._replace(status=status)
+
+    def invalidate(self, ip: str) -> None:
+        if ip == INVALIDATE_ALL:
+            self.clear()
+        elif self._entries.pop(ip, None) is not None:
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+def notify_payload(ip: str) -> str:
+    """Tag a notification with this worker's id so it can ignore its own messages."""
+    return f"{worker_id()}:{ip}"
+
+
+class DeviceCacheListener:
+    """LISTENs on NOTIFY_CHANNEL and invalidates entries changed by other workers.
+
+    If the listening connection drops, the whole cache is cleared (notifications
+    may have been missed) and the listener reconnects.
+    """
+
+    def __init__(self, dsn: str, cache: DeviceCache, reconnect_seconds: float = 5):
+        self.dsn = dsn
+        self.cache = cache
+        self.reconnect_seconds = reconnect_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    def _on_notify(self, conn, pid, channel, payload: str) -> None:
+        sender, _, ip = payload.partition(":")
+        if sender != worker_id():
+            self.cache.invalidate(ip)
+
+    async def _run(self) -> None:
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda c: lost.set())
+                await conn.add_listener(NOTIFY_CHANNEL, self._on_notify)
+                # Anything cached before LISTEN took effect may already be stale
+                self.cache.clear()
+                await lost.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Device cache listener error: %s", e)
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            self.cache.clear()
+            await asyncio.sleep(self.reconnect_seconds)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,57 @@
+# export_metrics.py
+"""Download raw metric history from the NMS API's streaming export.
+
+The response is written to the output file as it arrives, so exports of any
+size use constant memory on both ends:
+
+    python export_metrics.py cpu --from 2024-01-01 --to 2024-04-01 --tag billing -o cpu.csv
+    python export_metrics.py network --from 2024-03-01 --device 10.0.0.5 --format ndjson > net.ndjson
+
+Without --device or --tag every device is exported. --format arrow and
+parquet are available when the server has pyarrow installed.
+"""
+import argparse
+import sys
+import time
+
+import requests
+
+DEFAULT_API = "http://127.0.0.1:8000"
+CHUNK_BYTES = 1024 * 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("family", choices=("cpu", "memory", "disk", "network"))
+    parser.add_argument("--api", default=DEFAULT_API)
+    parser.add_argument("--from", dest="start", required=True, help="ISO 8601 date or time (UTC when no offset)")
+    parser.add_argument("--to", dest="end", help="exclusive end; default now")
+    parser.add_argument("--device", action="append", default=[], help="device IP (repeatable)")
+    parser.add_argument("--tag", action="append", default=[], help="only devices carrying this tag (repeatable)")
+    parser.add_argument("--format", default="csv", choices=("csv", "ndjson", "arrow", "parquet"))
+    parser.add_argument("-o", "--output", help="file to write; default stdout")
+    args = parser.parse_args()
+
+    params = {"from": args.start, "format": args.format, "device": args.device, "tag": args.tag}
+    if args.end:
+        params["to"] = args.end
+
+    started = time.perf_counter()
+    written = 0
+    with requests.get(f"{args.api}/export/{args.family}", params=params, stream=True) as response:
+        if response.status_code != 200:
+            sys.exit(f"Export failed ({response.status_code}): {response.text}")
+        out = open(args.output, "wb") if args.output else sys.stdout.buffer
+        try:
+            for chunk in response.iter_content(chunk_size=CHUNK_BYTES):
+                out.write(chunk)
+                written += len(chunk)
+        finally:
+            if args.output:
+                out.close()
+    elapsed = time.perf_counter() - started
+    print(f"{written / 1e6:.1f} MB in {elapsed:.1f}s ({written / 1e6 / max(elapsed, 1e-9):.1f} MB/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
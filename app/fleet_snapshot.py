@@ -0,0 +1,159 @@
+# fleet_snapshot.py
+"""In-memory latest-state view of the whole fleet.
+
+The ingest path pushes every written row into FleetSnapshot, so
+GET /fleet/snapshot is answered without touching the database. Each change
+bumps a version counter; rendered responses are cached per filter and
+version, and the version doubles as the ETag.
+"""
+import json
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# family -> column that distinguishes rows of one device (None = one row per device)
+FAMILY_KEYS = {"cpu": None, "memory": None, "disk": "mount_point", "network": "interface_name"}
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class FleetSnapshot:
+    def __init__(self, max_cached_responses: int = 64):
+        # Changes with every process start so ETags from another worker never match by accident
+        self.generation = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.max_cached_responses = max_cached_responses
+        self._devices: Dict[int, Dict[str, Any]] = {}
+        self._rendered: "OrderedDict[Tuple[int, Tuple[str, ...]], bytes]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    @property
+    def etag(self) -> str:
+        return f'W/"{self.generation}-{self.version}"'
+
+    def _entry(self, device_id: int) -> Dict[str, Any]:
+        entry = self._devices.get(device_id)
+        if entry is None:
+            entry = {
+                "device_id": device_id, "hostname": None, "ip_address": None, "status": None,
+                "tags": [], "last_seen": None, "cpu": None, "memory": None, "disk": {}, "network": {},
+            }
+            self._devices[device_id] = entry
+        return entry
+
+    def upsert_device(self, device_id: int, hostname: str, ip_address: str, status: Optional[str],
+                      tags: Optional[list], last_seen: Optional[datetime]) -> None:
+        entry = self._entry(device_id)
+        fields = dict(hostname=hostname, ip_address=ip_address, status=status, tags=list(tags or []))
+        if entry["last_seen"] is None or (last_seen is not None and last_seen > entry["last_seen"]):
+            fields["last_seen"] = last_seen
+        if any(entry[k] != v for k, v in fields.items()):
+            entry.update(fields)
+            self.version += 1
+
+    def tags(self, device_id: int) -> List[str]:
+        entry = self._devices.get(device_id)
+        return entry["tags"] if entry is not None else []
+
+    def ip(self, device_id: int) -> Optional[str]:
+        entry = self._devices.get(device_id)
+        return entry["ip_address"] if entry is not None else None
+
+    def status(self, device_id: int) -> Optional[str]:
+        entry = self._devices.get(device_id)
+        return entry["status"] if entry is not None else None
+
+    def set_status(self, device_id: int, status: str) -> None:
+        entry = self._devices.get(device_id)
+        if entry is not None and entry["status"] != status:
+            entry["status"] = status
+            self.version += 1
+
+    def apply_rows(self, family: str, rows: Iterable[Dict[str, Any]]) -> None:
+        """Merge metric rows (as written to the database) into the snapshot, keeping the newest per key.
+
+        Re-applying a row that is already present is not a change, so periodic
+        reloads from the latest-state tables do not invalidate ETags. Fields a
+        row leaves as None keep their previous value.
+        """
+        key = FAMILY_KEYS[family]
+        changed = False
+        for row in rows:
+            entry = self._entry(row["device_id"])
+            row = dict(row)
+            current = entry[family] if key is None else entry[family].get(row[key])
+            if current is not None and current["timestamp"] >= row["timestamp"]:
+                continue
+            if current is not None:
+                row = {**current, **{k: v for k, v in row.items() if v is not None}}
+            if key is None:
+                entry[family] = row
+            else:
+                entry[family][row[key]] = row
+            changed = True
+        if changed:
+            self.version += 1
+
+    def touch(self, last_seen: Dict[int, datetime]) -> None:
+        changed = False
+        for device_id, ts in last_seen.items():
+            entry = self._entry(device_id)
+            if entry["last_seen"] is None or entry["last_seen"] < ts:
+                entry["last_seen"] = ts
+                changed = True
+            if entry["status"] != "online":
+                entry["status"] = "online"
+                changed = True
+        if changed:
+            self.version += 1
+
+    def prune(self, cutoff: datetime) -> None:
+        """Drop mounts and interfaces that have not reported since ``cutoff``."""
+        changed = False
+        for entry in self._devices.values():
+            for family in ("disk", "network"):
+                stale = [k for k, row in entry[family].items() if row["timestamp"] < cutoff]
+                for k in stale:
+                    del entry[family][k]
+                    changed = True
+        if changed:
+            self.version += 1
+
+    def _select(self, tags: Tuple[str, ...]) -> List[Dict[str, Any]]:
+        out = []
+        for entry in self._devices.values():
+            if tags and not all(t in entry["tags"] for t in tags):
+                continue
+            out.append({
+                **entry,
+                "disk": sorted(entry["disk"].values(), key=lambda r: r["mount_point"]),
+                "network": sorted(entry["network"].values(), key=lambda r: r["interface_name"]),
+            })
+        return out
+
+    def render(self, tags: Iterable[str] = ()) -> bytes:
+        """JSON body for the given tag filter, cached until the snapshot changes."""
+        cache_key = (self.version, tuple(sorted(tags)))
+        body = self._rendered.get(cache_key)
+        if body is None:
+            devices = self._select(cache_key[1])
+            body = json.dumps(
+                {"version": self.version, "count": len(devices), "devices": devices}, default=_json_default
+            ).encode()
+            self._rendered[cache_key] = body
+            # Older versions can never be served again
+            for stale in [k for k in self._rendered if k[0] != self.version]:
+                del self._rendered[stale]
+            while len(self._rendered) > self.max_cached_responses:
+                self._rendered.popitem(last=False)
+        return body
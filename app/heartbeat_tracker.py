@@ -0,0 +1,100 @@
+# heartbeat_tracker.py
+"""In-memory offline-deadline tracker.
+
+Every heartbeat (ingested sample) pushes ``last_seen + threshold`` onto a
+min-heap. Superseded entries are not removed; they are recognised and skipped
+when popped because they no longer match the device's current deadline.
+The offline checker only has to look at the top of the heap each tick.
+"""
+import heapq
+import math
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+THRESHOLD_FIELD = "offline_threshold_seconds"
+
+
+def resolve_threshold(tags: Optional[Iterable[str]], custom_fields: Optional[dict],
+                      by_tag: Dict[str, float], default: float) -> float:
+    """Per-device override in custom_fields, else the strictest matching tag threshold, else the default.
+
+    An override that is not a positive, finite number is ignored.
+    """
+    override = custom_fields.get(THRESHOLD_FIELD) if isinstance(custom_fields, dict) else None
+    if override is not None and not isinstance(override, bool):
+        try:
+            seconds = float(override)
+        except (TypeError, ValueError):
+            seconds = math.nan
+        if math.isfinite(seconds) and seconds > 0:
+            return seconds
+    matches = [by_tag[t] for t in (tags or []) if isinstance(t, str) and t in by_tag]
+    return float(min(matches)) if matches else float(default)
+
+
+class HeartbeatTracker:
+    def __init__(self, default_threshold: float):
+        self.default_threshold = default_threshold
+        self._heap: List[Tuple[float, int]] = []
+        self._deadlines: Dict[int, float] = {}
+        self._last_seen: Dict[int, float] = {}
+        self._thresholds: Dict[int, float] = {}
+        self._unresolved: set = set()
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def threshold(self, device_id: int) -> float:
+        return self._thresholds.get(device_id, self.default_threshold)
+
+    def set_threshold(self, device_id: int, seconds: float) -> None:
+        self._thresholds[device_id] = seconds
+        self._unresolved.discard(device_id)
+        if device_id in self._deadlines:
+            # Re-arm relative to the last heartbeat under the new threshold
+            self._arm(device_id, self._last_seen[device_id] + seconds)
+
+    def take_unresolved(self) -> List[int]:
+        """Devices heartbeating under the default threshold because their tags/fields were never loaded."""
+        pending, self._unresolved = list(self._unresolved), set()
+        return pending
+
+    def _arm(self, device_id: int, deadline: float) -> None:
+        self._deadlines[device_id] = deadline
+        heapq.heappush(self._heap, (deadline, device_id))
+        # Each heartbeat leaves a superseded entry behind; rebuild once they dominate
+        if len(self._heap) > 4 * len(self._deadlines) + 64:
+            self._heap = [(d, i) for i, d in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def beat(self, device_id: int, last_seen: datetime) -> None:
+        if device_id not in self._thresholds:
+            self._unresolved.add(device_id)
+        seen = last_seen.timestamp()
+        if seen > self._last_seen.get(device_id, float("-inf")) or device_id not in self._deadlines:
+            self._last_seen[device_id] = max(seen, self._last_seen.get(device_id, seen))
+            self._arm(device_id, self._last_seen[device_id] + self.threshold(device_id))
+
+    def forget(self, device_id: int) -> None:
+        self._deadlines.pop(device_id, None)
+        self._last_seen.pop(device_id, None)
+
+    def next_deadline(self) -> Optional[float]:
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def expired(self, now: datetime) -> List[Tuple[int, float]]:
+        """Pop every device whose deadline has passed, as (device_id, threshold) pairs."""
+        now_ts = now.timestamp()
+        out = []
+        while self._heap and self._heap[0][0] <= now_ts:
+            deadline, device_id = heapq.heappop(self._heap)
+            if self._deadlines.get(device_id) == deadline:
+                del self._deadlines[device_id]
+                del self._last_seen[device_id]
+                out.append((device_id, self.threshold(device_id)))
+        return out
+
+    def stats(self) -> dict:
+        return {"tracked": len(self._deadlines), "heap_size": len(self._heap), "next_deadline": self.next_deadline()}
@@ -0,0 +1,240 @@
+# ingest_buffer.py
+"""Write-behind buffer for metric ingestion.
+
+Handlers offer validated samples to a bounded asyncio queue and return
+immediately. A single background flusher drains the queue every
+``flush_interval_ms`` or once ``flush_max_rows`` rows are pending, whichever
+comes first, and hands the whole batch to ``flush_fn`` for one bulk write.
+
+A failed flush is retried with the same batch. After ``split_after_failures``
+failures in a row the batch is written in halves, recursively, so one sample
+the database refuses cannot hold back the rest. A single sample that still
+fails with an error ``is_permanent`` accepts is dropped and counted; any
+other error stops the split, and what is left is retried as before.
+
+A sample may carry an ``ack`` future; it resolves to True once the sample has
+been written, or False if it was dropped or given up on at shutdown. Samples
+that are never written are also passed to ``on_drop``. ``seqs`` are the
+agent sequence numbers the sample covers (see ingest_sequencer.py).
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedSample(NamedTuple):
+    device_id: int
+    ip: str
+    timestamp: Any
+    rows: dict
+    row_count: int
+    came_online: bool
+    ack: Optional["asyncio.Future[bool]"] = None
+    seqs: Tuple[int, ...] = ()
+
+
+def _resolve_acks(batch: List[BufferedSample], written: bool) -> None:
+    for sample in batch:
+        # The waiter may be gone (connection closed); its future is then cancelled
+        if sample.ack is not None and not sample.ack.done():
+            sample.ack.set_result(written)
+
+
+FlushFn = Callable[[List[BufferedSample]], Awaitable[None]]
+
+
+def _never_permanent(error: Exception) -> bool:
+    return False
+
+
+class IngestBuffer:
+    """Bounded queue plus flusher task; ``offer`` returning False means apply backpressure."""
+
+    def __init__(
+        self,
+        flush_fn: FlushFn,
+        max_samples: int = 20000,
+        flush_interval_ms: int = 500,
+        flush_max_rows: int = 5000,
+        retry_backoff_seconds: float = 1.0,
+        split_after_failures: int = 3,
+        is_permanent: Callable[[Exception], bool] = _never_permanent,
+        on_drop: Optional[Callable[[List[BufferedSample]], None]] = None,
+    ):
+        self.flush_fn = flush_fn
+        self.max_samples = max_samples
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_max_rows = flush_max_rows
+        self.retry_backoff_seconds = retry_backoff_seconds
+        self.split_after_failures = split_after_failures
+        self.is_permanent = is_permanent
+        self.on_drop = on_drop
+        self._queue: "asyncio.Queue[BufferedSample]" = asyncio.Queue(maxsize=max_samples)
+        self._inflight: List[BufferedSample] = []
+        self._task: Optional[asyncio.Task] = None
+        self._failures = 0  # consecutive failed flushes of the current in-flight batch
+        self.flushed_samples = 0
+        self.flushed_rows = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.dropped_samples = 0
+        self.dropped_rows = 0
+        self.rejected = 0
+        self.last_flush_seconds = 0.0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def offer(self, sample: BufferedSample) -> bool:
+        try:
+            self._queue.put_nowait(sample)
+            return True
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+
+    async def _collect(self) -> None:
+        """Fill ``self._inflight`` so samples taken off the queue survive cancellation."""
+        batch = self._inflight
+        batch.append(await self._queue.get())
+        rows = batch[0].row_count
+        deadline = time.monotonic() + self.flush_interval
+        while rows < self.flush_max_rows:
+            # Take whatever is already queued without yielding to the loop
+            while rows < self.flush_max_rows and not self._queue.empty():
+                sample = self._queue.get_nowait()
+                batch.append(sample)
+                rows += sample.row_count
+            remaining = deadline - time.monotonic()
+            if rows >= self.flush_max_rows or remaining <= 0:
+                break
+            try:
+                sample = await asyncio.wait_for(self._queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            batch.append(sample)
+            rows += sample.row_count
+
+    async def _flush(self, batch: List[BufferedSample]) -> None:
+        start = time.perf_counter()
+        await self.flush_fn(batch)
+        self.last_flush_seconds = time.perf_counter() - start
+        self.flushes += 1
+        self.flushed_samples += len(batch)
+        self.flushed_rows += sum(s.row_count for s in batch)
+        _resolve_acks(batch, True)
+
+    def _drop(self, sample: BufferedSample, error: Exception) -> None:
+        self.dropped_samples += 1
+        self.dropped_rows += sample.row_count
+        logger.error("Ingest buffer dropped a sample of %s (%d rows) the database refuses: %s",
+                     sample.ip, sample.row_count, error)
+        self._give_up([sample])
+
+    def _give_up(self, samples: List[BufferedSample]) -> None:
+        _resolve_acks(samples, False)
+        if self.on_drop is not None:
+            self.on_drop(samples)
+
+    async def _split_flush(self) -> None:
+        """Write ``self._inflight`` in ever smaller parts, dropping single samples that fail permanently.
+
+        Parts are written in order, and each one leaves ``self._inflight`` once it
+        is written or dropped, so an error that is not permanent leaves exactly
+        the unwritten remainder to retry.
+        """
+        parts = [list(self._inflight)]
+        while parts:
+            part = parts.pop()
+            try:
+                await self._flush(part)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if len(part) > 1:
+                    half = len(part) // 2
+                    parts += [part[half:], part[:half]]
+                    continue
+                if not self.is_permanent(e):
+                    raise
+                self._drop(part[0], e)
+            del self._inflight[:len(part)]
+
+    async def _run(self) -> None:
+        while True:
+            if not self._inflight:
+                await self._collect()
+            try:
+                if self._failures < self.split_after_failures:
+                    await self._flush(self._inflight)
+                    self._inflight = []
+                else:
+                    await self._split_flush()
+                self._failures = 0
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Keep the batch and retry; the bounded queue pushes back on agents meanwhile
+                self._failures += 1
+                self.flush_errors += 1
+                logger.warning("Ingest buffer flush failed (%d samples), retrying: %s", len(self._inflight), e)
+                await asyncio.sleep(self.retry_backoff_seconds)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the flusher and write out everything still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # A cancelled in-flight flush rolled back, so it is written again here
+        remaining = self._inflight
+        self._inflight = []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        chunk: List[BufferedSample] = []
+        rows = 0
+        for index, sample in enumerate(remaining):
+            chunk.append(sample)
+            rows += sample.row_count
+            if rows < self.flush_max_rows and index < len(remaining) - 1:
+                continue
+            try:
+                await self._flush(chunk)
+            except Exception:
+                self.flush_errors += 1
+                # Save whatever the database still accepts
+                self._inflight = chunk
+                try:
+                    await self._split_flush()
+                except Exception as e:
+                    logger.error("Ingest buffer final flush failed, %d samples lost: %s", len(self._inflight), e)
+                    self._give_up(self._inflight)
+                self._inflight = []
+            chunk, rows = [], 0
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "max_samples": self.max_samples,
+            "inflight": len(self._inflight),
+            "flushes": self.flushes,
+            "flushed_samples": self.flushed_samples,
+            "flushed_rows": self.flushed_rows,
+            "flush_errors": self.flush_errors,
+            "dropped_samples": self.dropped_samples,
+            "dropped_rows": self.dropped_rows,
+            "rejected": self.rejected,
+            "last_flush_seconds": round(self.last_flush_seconds, 6),
+        }
@@ -0,0 +1,174 @@
+# ingest_sequencer.py
+"""Per-device sample sequence numbers and clock offsets, kept in memory.
+
+Agents number their samples: ``seq`` grows by one per sample and is never
+reused (server_agent.py starts it from the wall clock in microseconds, so a
+restarted agent continues above its old numbers). A sample whose seq has
+already been written is a retry or a second replay, and is dropped before
+any database work. A single high-water mark is not enough, because spooled
+samples are replayed after newer live ones. Instead each device keeps the
+ranges of seqs written so far. They stay few, since a run of consecutive
+numbers is one range. Beyond ``max_ranges`` the oldest ranges are forgotten
+and their seqs let through again; the metric tables' ON CONFLICT DO NOTHING
+still drops those repeats. Seqs are recorded only after their rows are
+committed, so a failed write can be retried. Until then they are pending:
+reserved when a sample is accepted, so a retry arriving while the first
+copy waits in the write-behind buffer is a duplicate too, and released
+again if that copy is never written.
+
+Agent clocks are trusted up to an offset estimated per device. Each arrival
+gives one lag: receive time minus the timestamp of its newest sample. That
+is the time the freshest sample spent in the agent and on the wire, minus
+the agent's clock error. The smallest lag over the last ``window_seconds``
+comes from the freshest delivery. Its transit time is close to zero, so it
+estimates the clock error. Replayed samples are old, but arrivals that carry
+them also carry live samples, so they do not raise the minimum. Offsets
+within ``tolerance_seconds`` are treated as zero. The applied offset only
+moves when the estimate drifts by more than that, so a retried sample gets
+the same corrected timestamp (and primary key) as its first attempt.
+
+State is per process: with several workers, each sees only its own arrivals.
+"""
+import logging
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Deque, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _Ranges:
+    """Sorted, disjoint, inclusive ranges of integers."""
+
+    __slots__ = ("starts", "ends")
+
+    def __init__(self):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+
+    def __contains__(self, value: int) -> bool:
+        i = bisect_right(self.starts, value) - 1
+        return i >= 0 and value <= self.ends[i]
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def add(self, value: int) -> None:
+        starts, ends = self.starts, self.ends
+        i = bisect_right(starts, value) - 1
+        if i >= 0 and value <= ends[i]:
+            return
+        joins_left = i >= 0 and ends[i] == value - 1
+        joins_right = i + 1 < len(starts) and starts[i + 1] == value + 1
+        if joins_left and joins_right:
+            ends[i] = ends[i + 1]
+            del starts[i + 1], ends[i + 1]
+        elif joins_left:
+            ends[i] = value
+        elif joins_right:
+            starts[i + 1] = value
+        else:
+            starts.insert(i + 1, value)
+            ends.insert(i + 1, value)
+
+    def trim(self, max_ranges: int) -> None:
+        excess = len(self.starts) - max_ranges
+        if excess > 0:
+            del self.starts[:excess], self.ends[:excess]
+
+
+class _Device:
+    __slots__ = ("seen", "pending", "lags", "offset")
+
+    def __init__(self):
+        self.seen = _Ranges()
+        self.pending: Set[int] = set()  # accepted, not yet committed
+        self.lags: Deque[Tuple[float, float]] = deque()  # (received_at, lag seconds) per arrival
+        self.offset = 0.0
+
+
+class IngestSequencer:
+    def __init__(self, tolerance_seconds: float = 10, window_seconds: float = 600,
+                 max_ranges: int = 64, max_devices: int = 50000):
+        self.tolerance_seconds = tolerance_seconds
+        self.window_seconds = window_seconds
+        self.max_ranges = max_ranges
+        self.max_devices = max_devices
+        self._devices: "OrderedDict[str, _Device]" = OrderedDict()
+        self.duplicates = 0
+        self.offset_changes = 0
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    def _device(self, ip: str) -> _Device:
+        device = self._devices.get(ip)
+        if device is None:
+            device = self._devices[ip] = _Device()
+            if len(self._devices) > self.max_devices:
+                self._devices.popitem(last=False)
+        else:
+            self._devices.move_to_end(ip)
+        return device
+
+    def is_duplicate(self, ip: str, seq: Optional[int]) -> bool:
+        """True when ``seq`` of this device has already been written or is about to be."""
+        if seq is None:
+            return False
+        device = self._devices.get(ip)
+        if device is None or (seq not in device.seen and seq not in device.pending):
+            return False
+        self.duplicates += 1
+        return True
+
+    def reserve(self, ip: str, seqs: Iterable[Optional[int]]) -> None:
+        """Mark seqs of accepted samples as pending until ``commit`` or ``release``."""
+        pending = [seq for seq in seqs if seq is not None]
+        if pending:
+            self._device(ip).pending.update(pending)
+
+    def release(self, ip: str, seqs: Iterable[Optional[int]]) -> None:
+        """Forget pending seqs whose samples were not written, so a resend is accepted."""
+        device = self._devices.get(ip)
+        if device is not None:
+            device.pending.difference_update(seqs)
+
+    def commit(self, ip: str, seqs: Iterable[Optional[int]]) -> None:
+        """Record seqs whose rows have been committed."""
+        device = None
+        for seq in seqs:
+            if seq is not None:
+                device = device or self._device(ip)
+                device.seen.add(seq)
+                device.pending.discard(seq)
+        if device is not None:
+            device.seen.trim(self.max_ranges)
+
+    def offset(self, ip: str, newest: datetime, received_at: datetime) -> float:
+        """Seconds to add to this arrival's agent timestamps, given its newest one."""
+        device = self._device(ip)
+        now = received_at.timestamp()
+        lags = device.lags
+        lags.append((now, now - newest.timestamp()))
+        while lags and lags[0][0] < now - self.window_seconds:
+            lags.popleft()
+        estimate = min(lag for _, lag in lags)
+        target = estimate if abs(estimate) > self.tolerance_seconds else 0.0
+        if abs(target - device.offset) > self.tolerance_seconds:
+            logger.info("Clock offset of %s is now %.1fs (was %.1fs).", ip, target, device.offset)
+            device.offset = target
+            self.offset_changes += 1
+        return device.offset
+
+    def stats(self) -> dict:
+        offsets = [d.offset for d in self._devices.values() if d.offset]
+        return {
+            "devices": len(self._devices),
+            "seq_ranges": sum(len(d.seen) for d in self._devices.values()),
+            "pending_seqs": sum(len(d.pending) for d in self._devices.values()),
+            "duplicates": self.duplicates,
+            "skewed_devices": len(offsets),
+            "max_abs_offset_seconds": max((abs(o) for o in offsets), default=0.0),
+            "offset_changes": self.offset_changes,
+        }
@@ -1,10 +1,69 @@
 import asyncio
-from main import Base, engine  # Import your Base and engine from main.py
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+from datetime import datetime, timezone
+from main import Base, engine, LATEST_TABLES, PARTITION_POLICIES, PARTITION_PREMAKE  # Import your Base and engine from main.py
+from partitions import detach_legacy_table, attach_legacy_table, maintain
+
+def latest_backfill(model, table, keys):
+    """Seed a latest-state table from history (no-op once it is populated).
+
+    Columns are listed by name: add_missing_columns appends new ones to each
+    table in its own order, so the raw and latest tables need not line up.
+    """
+    columns = ", ".join(f'"{c.name}"' for c in table.columns if c.name != "updated_at")
+    key_list = ", ".join(keys)
+    return f"""INSERT INTO {table.name} ({columns}, updated_at)
+       SELECT DISTINCT ON ({key_list}) {columns}, now() FROM {model.__tablename__}
+       ORDER BY {key_list}, timestamp DESC
+       ON CONFLICT DO NOTHING"""
+
+def add_missing_columns(sync_conn):
+    """create_all never alters existing tables; add columns introduced since they were created."""
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = CreateColumn(column).compile(dialect=sync_conn.dialect)
+                sync_conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN {ddl}'))
+                print(f"Added column {table.name}.{column.name}")
+
+def add_missing_indexes(sync_conn):
+    """create_all skips indexes of tables that already exist; create the ones declared since."""
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        if not table.indexes or not inspector.has_table(table.name):
+            continue
+        existing = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(sync_conn)
+                print(f"Created index {index.name} on {table.name}")
 
 async def init_db():
     async with engine.begin() as conn:
+        # Bring existing tables up to the current columns first, so legacy tables still match when attached
+        await conn.run_sync(add_missing_columns)
+
+        # Tables created before partitioning are renamed, then attached to the new parent as a single partition
+        legacy = [p for p in PARTITION_POLICIES if await detach_legacy_table(conn, p)]
+
         # Create all tables defined in Base.metadata
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(add_missing_indexes)
+
+        for policy in legacy:
+            await attach_legacy_table(conn, policy)
+            print(f"Attached pre-partitioning {policy.table} data as a partition.")
+        now = datetime.now(timezone.utc)
+        for policy in PARTITION_POLICIES:
+            await maintain(conn, policy, now, PARTITION_PREMAKE)
+
+        for model, (table, keys) in LATEST_TABLES.items():
+            await conn.execute(text(latest_backfill(model, table, keys)))
     print("All tables created successfully!")
 
 if __name__ == "__main__":
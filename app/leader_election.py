@@ -0,0 +1,171 @@
+# leader_election.py
+"""One leader per background job across every worker and host.
+
+Jobs that write cluster-wide state (offline transitions, rollups, partition
+maintenance, ...) must run in a single process even when the API runs with
+several uvicorn workers or on several hosts. Each process's LeaderElector
+holds one dedicated connection and tries ``pg_try_advisory_lock(namespace,
+crc32(job))`` for every registered job it does not lead. Whoever gets the
+lock runs the job's coroutine as a task until the lock is lost; the others
+retry every ``retry_seconds``.
+
+Session advisory locks are released by Postgres when the holding connection
+ends, so a dead leader is replaced within one retry interval. A leader that
+cannot reach the database is caught by the ``SELECT 1`` run every round. It
+cancels its jobs after ``retry_seconds + query_timeout`` at most. The server
+needs ``tcp_keepalives_*`` (set below) to notice the lost client and free the
+locks, which takes longer, so the old leader stops before a new one starts.
+Jobs should still be idempotent: a tick in flight when leadership moves may
+be repeated by the new leader.
+"""
+import asyncio
+import logging
+import zlib
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+JobFactory = Callable[[], Awaitable[None]]
+
+# Server-side keepalives: Postgres drops a silent leader's session (and its locks) after ~25s
+KEEPALIVE_SETTINGS = {"tcp_keepalives_idle": "10", "tcp_keepalives_interval": "5", "tcp_keepalives_count": "3"}
+
+
+def lock_key(name: str) -> int:
+    """Stable signed 32-bit advisory lock key of a job name."""
+    key = zlib.crc32(name.encode())
+    return key - (1 << 32) if key >= 1 << 31 else key
+
+
+class _Job:
+    __slots__ = ("name", "factory", "key", "task", "since", "acquisitions", "restarts")
+
+    def __init__(self, name: str, factory: JobFactory):
+        self.name = name
+        self.factory = factory
+        self.key = lock_key(name)
+        self.task: Optional[asyncio.Task] = None
+        self.since: Optional[datetime] = None
+        self.acquisitions = 0
+        self.restarts = 0
+
+
+class LeaderElector:
+    def __init__(self, dsn: str, namespace: int, retry_seconds: float = 5, query_timeout: float = 5,
+                 application_name: str = "nms-leader-election"):
+        self.dsn = dsn
+        self.namespace = namespace
+        self.retry_seconds = retry_seconds
+        self.query_timeout = query_timeout
+        self.application_name = application_name
+        self._jobs: Dict[str, _Job] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.connected = False
+
+    def add(self, name: str, factory: JobFactory) -> None:
+        """Register a job; ``factory()`` is its coroutine, started each time this process becomes its leader."""
+        self._jobs[name] = _Job(name, factory)
+
+    def is_leader(self, name: str) -> bool:
+        job = self._jobs.get(name)
+        return job is not None and job.task is not None
+
+    def _start_job(self, job: _Job) -> None:
+        job.task = asyncio.create_task(job.factory())
+        job.since = datetime.now(timezone.utc)
+        job.acquisitions += 1
+        logger.info("Leading background job %s.", job.name)
+
+    async def _stop_jobs(self) -> None:
+        running = [job for job in self._jobs.values() if job.task is not None]
+        for job in running:
+            job.task.cancel()
+        for job in running:
+            try:
+                await job.task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.warning("Background job %s failed: %s", job.name, e)
+            job.task = job.since = None
+            logger.info("Stopped leading background job %s.", job.name)
+
+    async def _elect(self, conn) -> None:
+        for job in self._jobs.values():
+            if job.task is not None and job.task.done():
+                # A job that returned or crashed gives up its lock, so any worker may restart it
+                if not job.task.cancelled() and job.task.exception() is not None:
+                    logger.error("Background job %s failed.", job.name, exc_info=job.task.exception())
+                job.task = job.since = None
+                job.restarts += 1
+                await conn.fetchval("SELECT pg_advisory_unlock($1, $2)", self.namespace, job.key,
+                                    timeout=self.query_timeout)
+            if job.task is None and await conn.fetchval(
+                "SELECT pg_try_advisory_lock($1, $2)", self.namespace, job.key, timeout=self.query_timeout
+            ):
+                self._start_job(job)
+        # Proves the session, and so the locks, still exist even when every job is already held
+        await conn.fetchval("SELECT 1", timeout=self.query_timeout)
+
+    async def _run(self) -> None:
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(
+                    self.dsn, timeout=self.query_timeout,
+                    server_settings={"application_name": self.application_name, **KEEPALIVE_SETTINGS},
+                )
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda c: lost.set())
+                self.connected = True
+                while not lost.is_set():
+                    await self._elect(conn)
+                    try:
+                        await asyncio.wait_for(lost.wait(), self.retry_seconds)
+                    except asyncio.TimeoutError:
+                        pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Leader election error: %s", e)
+            finally:
+                self.connected = False
+                # Jobs stop before their locks are released, so two leaders never overlap
+                await self._stop_jobs()
+                if conn is not None and not conn.is_closed():
+                    try:
+                        await conn.close(timeout=self.query_timeout)
+                    except Exception:
+                        conn.terminate()
+            await asyncio.sleep(self.retry_seconds)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop led jobs and release their locks, letting another worker take over right away."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "connected": self.connected,
+            "jobs": {
+                job.name: {
+                    "leader": job.task is not None,
+                    "leader_since": job.since.isoformat() if job.since else None,
+                    "acquisitions": job.acquisitions,
+                    "restarts": job.restarts,
+                }
+                for job in self._jobs.values()
+            },
+        }
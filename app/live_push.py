@@ -0,0 +1,299 @@
+# live_push.py
+"""Push of newly written metrics and device status changes to live subscribers.
+
+The ingest path publishes each committed batch to the LiveHub: one event per
+device and metric family, plus ``status`` events when a device goes online or
+offline. Every event is JSON-encoded once and the same bytes are handed to
+every subscriber whose filter matches. A filter is a set of device ids and/or
+tags (a device must carry every tag) and optionally some families. Tags are
+looked up when an event is published, so tag changes apply to open
+subscriptions too.
+
+Each subscriber has a buffer of at most ``max_events`` events. When a slow
+consumer fills it, the buffer switches to latest-only: it keeps only the
+newest event per (kind, device, family) and counts the ones it replaced. It
+returns to full fidelity once the consumer has drained it. A publisher never
+waits for a consumer.
+
+Each worker only sees what it ingests itself, and offline transitions happen
+in the worker leading the offline checker. LivePushRelay, when enabled,
+forwards locally published events to every other worker through Postgres
+NOTIFY, so a subscriber connected to any worker sees the whole fleet.
+NOTIFY payloads are limited to 8000 bytes, so larger metric events are split
+by rows before they are relayed.
+"""
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+
+import asyncpg
+
+from device_cache import worker_id
+from serializers import dumps
+
+logger = logging.getLogger(__name__)
+
+RELAY_CHANNEL = "nms_live_push"
+MAX_NOTIFY_BYTES = 7900  # Postgres rejects payloads of 8000 bytes or more
+
+# (kind, device_id, family); family is None for status events
+EventKey = Tuple[str, int, Optional[str]]
+
+
+class Subscription(NamedTuple):
+    device_ids: Optional[FrozenSet[int]] = None  # None = every device
+    tags: Tuple[str, ...] = ()
+    families: Optional[FrozenSet[str]] = None  # None = every family; status events are always delivered
+
+    def matches(self, device_id: int, family: Optional[str], tags_of: Callable[[int], Iterable[str]]) -> bool:
+        if self.device_ids is not None and device_id not in self.device_ids:
+            return False
+        if family is not None and self.families is not None and family not in self.families:
+            return False
+        if self.tags:
+            device_tags = tags_of(device_id)
+            return all(t in device_tags for t in self.tags)
+        return True
+
+
+class Subscriber:
+    """Bounded event buffer of one client; see the module docstring for the latest-only fallback."""
+
+    def __init__(self, subscription: Subscription, max_events: int):
+        self.subscription = subscription
+        self.max_events = max_events
+        self._events: Deque[Tuple[EventKey, bytes]] = deque()
+        self._latest: Optional["OrderedDict[EventKey, bytes]"] = None
+        self._ready = asyncio.Event()
+        self.dropped = 0  # replaced in latest-only mode, not yet reported to the client
+        self.dropped_total = 0
+
+    @property
+    def coalescing(self) -> bool:
+        return self._latest is not None
+
+    def offer(self, key: EventKey, body: bytes) -> None:
+        if self._latest is None:
+            if len(self._events) < self.max_events:
+                self._events.append((key, body))
+                self._ready.set()
+                return
+            # Full: fold the backlog down to the newest event per key
+            self._latest = OrderedDict()
+            for queued_key, queued_body in self._events:
+                self._replace(queued_key, queued_body)
+            self._events.clear()
+        self._replace(key, body)
+        self._ready.set()
+
+    def _replace(self, key: EventKey, body: bytes) -> None:
+        if self._latest.pop(key, None) is not None:
+            self.dropped += 1
+            self.dropped_total += 1
+        self._latest[key] = body
+
+    async def next(self, timeout: float) -> Optional[List[bytes]]:
+        """Every pending event, oldest first; None when nothing arrived within ``timeout``."""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._ready.clear()
+        if self._latest is not None:
+            bodies, self._latest = list(self._latest.values()), None
+        else:
+            bodies = [body for _, body in self._events]
+            self._events.clear()
+        return bodies
+
+    def take_dropped(self) -> int:
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class LiveHub:
+    def __init__(self, tags_of: Callable[[int], Iterable[str]], max_events: int = 1000):
+        self.tags_of = tags_of
+        self.max_events = max_events
+        self._subscribers: List[Subscriber] = []
+        # Set by LivePushRelay: receives every locally published event
+        self.relay: Optional[Callable[[EventKey, Dict[str, Any]], None]] = None
+        self.published = 0
+        self.delivered = 0
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    @property
+    def active(self) -> bool:
+        """Whether publishing does anything; the ingest path skips building events otherwise."""
+        return bool(self._subscribers) or self.relay is not None
+
+    def subscribe(self, subscription: Subscription) -> Subscriber:
+        subscriber = Subscriber(subscription, self.max_events)
+        self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        try:
+            self._subscribers.remove(subscriber)
+        except ValueError:
+            pass
+
+    def publish(self, key: EventKey, event: Dict[str, Any]) -> None:
+        """Deliver a locally produced event to subscribers here and, when relayed, in other workers."""
+        self.published += 1
+        self.deliver(key, event)
+        if self.relay is not None:
+            self.relay(key, event)
+
+    def deliver(self, key: EventKey, event: Dict[str, Any], body: Optional[bytes] = None) -> None:
+        _, device_id, family = key
+        for subscriber in self._subscribers:
+            if subscriber.subscription.matches(device_id, family, self.tags_of):
+                if body is None:
+                    body = dumps(event)
+                subscriber.offer(key, body)
+                self.delivered += 1
+
+    def publish_rows(self, family: str, rows: Iterable[Dict[str, Any]], ip_of: Callable[[int], Optional[str]]) -> None:
+        """One ``metrics`` event per device for rows of one family, as written to the database."""
+        by_device: Dict[int, List[Dict[str, Any]]] = {}
+        for row in rows:
+            by_device.setdefault(row["device_id"], []).append({k: v for k, v in row.items() if k != "device_id"})
+        for device_id, device_rows in by_device.items():
+            self.publish(
+                ("metrics", device_id, family),
+                {"type": "metrics", "device_id": device_id, "ip": ip_of(device_id), "family": family, "rows": device_rows},
+            )
+
+    def publish_status(self, device_id: int, ip: Optional[str], status: str, at: Any) -> None:
+        self.publish(("status", device_id, None),
+                     {"type": "status", "device_id": device_id, "ip": ip, "status": status, "at": at})
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "coalescing": sum(1 for s in self._subscribers if s.coalescing),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": sum(s.dropped_total for s in self._subscribers),
+            "relay": self.relay is not None,
+        }
+
+
+def _split(event: Dict[str, Any], body: bytes) -> List[bytes]:
+    """Bodies under MAX_NOTIFY_BYTES, halving an event's rows until they fit."""
+    rows = event.get("rows")
+    if len(body) <= MAX_NOTIFY_BYTES:
+        return [body]
+    if not rows or len(rows) < 2:
+        return []
+    half = len(rows) // 2
+    out = []
+    for part in (rows[:half], rows[half:]):
+        sub_event = {**event, "rows": part}
+        out += _split(sub_event, dumps(sub_event))
+    return out
+
+
+class LivePushRelay:
+    """Forwards this worker's events to the others over NOTIFY and delivers theirs locally.
+
+    Outgoing events are queued (at most ``max_queue``, oldest dropped first)
+    and sent every ``flush_interval_ms`` in one ``pg_notify`` statement; a
+    failed send puts them back in front of the queue. Payloads are
+    ``sender|kind|device_id|family|json``, with the sender's ``worker_id()``,
+    so receivers can match subscribers without parsing the JSON.
+    """
+
+    def __init__(self, dsn: str, hub: LiveHub, flush_interval_ms: int = 100, max_queue: int = 10000,
+                 reconnect_seconds: float = 5):
+        self.dsn = dsn
+        self.hub = hub
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_queue = max_queue
+        self.reconnect_seconds = reconnect_seconds
+        self._outgoing: Deque[str] = deque()
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+        self.oversized = 0
+
+    def enqueue(self, key: EventKey, event: Dict[str, Any]) -> None:
+        kind, device_id, family = key
+        bodies = _split(event, dumps(event))
+        if not bodies:
+            self.oversized += 1
+            logger.debug("Live event of device %s is too large to relay.", device_id)
+        prefix = f"{worker_id()}|{kind}|{device_id}|{family or ''}|"
+        for body in bodies:
+            if len(self._outgoing) >= self.max_queue:
+                self._outgoing.popleft()
+                self.dropped += 1
+            self._outgoing.append(prefix + body.decode())
+
+    def _requeue(self, payloads: List[str]) -> None:
+        """Put unsent payloads back ahead of newer ones, dropping the oldest beyond ``max_queue``."""
+        keep = max(self.max_queue - len(self._outgoing), 0)
+        if keep < len(payloads):
+            self.dropped += len(payloads) - keep
+            payloads = payloads[len(payloads) - keep:]
+        self._outgoing.extendleft(reversed(payloads))
+
+    def _on_notify(self, conn, pid, channel, payload: str) -> None:
+        sender, kind, device_id, family, body = payload.split("|", 4)
+        if sender == worker_id():
+            return
+        self.received += 1
+        self.hub.deliver((kind, int(device_id), family or None), {}, body.encode())
+
+    async def _run(self) -> None:
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda c: lost.set())
+                await conn.add_listener(RELAY_CHANNEL, self._on_notify)
+                while not lost.is_set():
+                    if self._outgoing:
+                        payloads = list(self._outgoing)
+                        self._outgoing.clear()
+                        try:
+                            await conn.execute("SELECT pg_notify($1, p) FROM unnest($2::text[]) AS p",
+                                               RELAY_CHANNEL, payloads)
+                        except Exception:
+                            self._requeue(payloads)
+                            raise
+                        self.sent += len(payloads)
+                    await asyncio.sleep(self.flush_interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Live push relay error: %s", e)
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(self.reconnect_seconds)
+
+    def start(self) -> None:
+        if self._task is None:
+            self.hub.relay = self.enqueue
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self.hub.relay = None
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {"queued": len(self._outgoing), "sent": self.sent, "received": self.received,
+                "dropped": self.dropped, "oversized": self.oversized}
@@ -0,0 +1,211 @@
+# metric_export.py
+"""Streaming export of raw metric rows over any time range.
+
+Rows are never collected: CSV is a ``COPY (...) TO STDOUT (FORMAT csv)``
+formatted by Postgres and relayed chunk by chunk; NDJSON, Arrow and Parquet
+read a server-side cursor ``batch_rows`` rows at a time and encode each batch
+as soon as it arrives (one JSON object per line, one Arrow record batch, one
+Parquet row group). A bounded queue between the COPY and the client keeps the
+export from running ahead of a slow reader, so memory stays at a few chunks
+or one batch however long the range is.
+
+Rows come out ordered by device and time, which the tables' primary key
+provides without a sort. Arrow and Parquet need ``pyarrow`` (listed in
+requirements.txt); when it is not installed the other formats still work and
+``available_formats()`` lists what this process can produce.
+"""
+import asyncio
+from contextlib import aclosing
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+from sqlalchemy import BigInteger, Float, Integer, Numeric, String, Table, TIMESTAMP
+
+from serializers import RowSerializer, dumps
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Arrow/Parquet export disabled
+    pa = pq = None
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def available_formats() -> List[str]:
+    return [f for f in MEDIA_TYPES if pa is not None or f not in ("arrow", "parquet")]
+
+
+def export_query(table: Table, filter_devices: bool) -> str:
+    """SELECT of every column; $1 = start, $2 = end (exclusive), $3 = device ids when filtered."""
+    columns = ", ".join(f'"{c.name}"' for c in table.columns)
+    devices = " AND device_id = ANY($3::int4[])" if filter_devices else ""
+    return (
+        f"SELECT {columns} FROM {table.name} "
+        f"WHERE \"timestamp\" >= $1::timestamptz AND \"timestamp\" < $2::timestamptz{devices} "
+        f"ORDER BY device_id, \"timestamp\""
+    )
+
+
+def arrow_type(type_: Any):
+    if isinstance(type_, BigInteger):
+        return pa.int64()
+    if isinstance(type_, Integer):
+        return pa.int32()
+    if isinstance(type_, (Float, Numeric)):
+        return pa.float64()  # NUMERIC arrives converted to float by the row serializer
+    if isinstance(type_, TIMESTAMP):
+        return pa.timestamp("us", tz="UTC")
+    if isinstance(type_, String):
+        return pa.string()
+    raise TypeError(f"No Arrow type for {type_!r}")
+
+
+class _ChunkSink:
+    """Write-only file object collecting what pyarrow writes until the next ``take``."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def writable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def take(self) -> bytes:
+        data, self.buffer = bytes(self.buffer), bytearray()
+        return data
+
+
+class _NdjsonEncoder:
+    def __init__(self, serializer: RowSerializer):
+        self.serializer = serializer
+
+    def encode(self, batch: Sequence[Sequence[Any]]) -> bytes:
+        return b"".join([dumps(row) + b"\n" for row in self.serializer.rows(batch)])
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class _ArrowEncoder:
+    """Arrow IPC stream (one record batch per batch) or Parquet file (one row group per batch)."""
+
+    def __init__(self, serializer: RowSerializer, schema, parquet: bool):
+        self.serializer = serializer
+        self.schema = schema
+        self.sink = _ChunkSink()
+        self.writer = pq.ParquetWriter(self.sink, schema) if parquet else pa.ipc.new_stream(self.sink, schema)
+
+    def encode(self, batch: Sequence[Sequence[Any]]) -> bytes:
+        columns: Dict[str, list] = self.serializer.columns(batch)
+        self.writer.write_batch(pa.RecordBatch.from_pydict(columns, schema=self.schema))
+        return self.sink.take()
+
+    def finish(self) -> bytes:
+        self.writer.close()  # Parquet footer / Arrow end-of-stream marker
+        return self.sink.take()
+
+
+class MetricExport:
+    """Export definition for one raw metric table."""
+
+    def __init__(self, table: Table, batch_rows: int = 10000, queue_chunks: int = 16):
+        self.table = table
+        self.batch_rows = batch_rows
+        self.queue_chunks = queue_chunks
+        self.serializer = RowSerializer(table.columns)
+        self.schema = pa.schema([(c.name, arrow_type(c.type)) for c in table.columns]) if pa is not None else None
+
+    def _encoder(self, fmt: str):
+        if fmt == "ndjson":
+            return _NdjsonEncoder(self.serializer)
+        return _ArrowEncoder(self.serializer, self.schema, parquet=fmt == "parquet")
+
+    async def stream(self, conn, fmt: str, start: datetime, end: datetime,
+                     device_ids: Optional[Sequence[int]] = None, timeout_seconds: float = 3600) -> AsyncIterator[bytes]:
+        """Encoded chunks of the export; ``conn`` is an asyncpg connection held for the whole stream.
+
+        ``timeout_seconds`` replaces the connection's statement and command
+        timeouts for this export only: a CSV export is a single COPY statement.
+        """
+        if fmt not in available_formats():
+            raise ValueError(f"Unsupported export format '{fmt}'")
+        args: List[Any] = [start, end]
+        if device_ids is not None:
+            args.append(list(device_ids))
+        query = export_query(self.table, device_ids is not None)
+
+        async with conn.transaction(readonly=True):
+            await conn.execute(f"SET LOCAL statement_timeout = {int(timeout_seconds * 1000)}")
+            if fmt == "csv":
+                # aclosing: a client that disconnects must stop the COPY task before the transaction ends
+                async with aclosing(self._copy(conn, query, args, timeout_seconds)) as chunks:
+                    async for chunk in chunks:
+                        yield chunk
+                return
+            # Encoding runs in a worker thread so a large batch does not stall ingest on the event loop
+            encoder = self._encoder(fmt)
+            batch = []
+            async for record in conn.cursor(query, *args, prefetch=self.batch_rows):
+                batch.append(record)
+                if len(batch) >= self.batch_rows:
+                    yield await asyncio.to_thread(encoder.encode, batch)
+                    batch = []
+            if batch:
+                yield await asyncio.to_thread(encoder.encode, batch)
+            tail = encoder.finish()
+            if tail:
+                yield tail
+
+    async def _copy(self, conn, query: str, args: List[Any], timeout_seconds: float) -> AsyncIterator[bytes]:
+        # The COPY waits on the queue whenever the client falls behind
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_chunks)
+
+        async def run():
+            try:
+                await conn.copy_from_query(query, *args, output=queue.put, format="csv", header=True,
+                                           timeout=timeout_seconds)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await queue.put(e)
+            else:
+                await queue.put(None)
+
+        task = asyncio.create_task(run())
+        try:
+            while (chunk := await queue.get()) is not None:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            if not task.done():
+                # Client went away: stop the COPY
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
@@ -0,0 +1,169 @@
+# partitions.py
+"""Time-range partition management for metric and rollup tables.
+
+Each partitioned table has a PartitionPolicy: the column it is ranged on,
+the width of one partition and how long data is kept. ``maintain`` makes
+sure the next few partitions exist and drops those entirely older than the
+retention window, so expiry is a DROP TABLE instead of a bloating DELETE.
+
+A DEFAULT partition catches rows outside every range (far-future clock skew,
+very old replays), so inserts never fail for lack of a partition.
+"""
+import logging
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+logger = logging.getLogger(__name__)
+
+PARTITION_BOUND = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+class PartitionPolicy(NamedTuple):
+    table: str
+    column: str
+    interval_seconds: int
+    retention_seconds: int
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def partition_start(ts: datetime, interval_seconds: int) -> datetime:
+    epoch = int(ts.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % interval_seconds, tz=timezone.utc)
+
+
+def partition_name(policy: PartitionPolicy, start: datetime) -> str:
+    fmt = "%Y%m%d" if policy.interval_seconds % 86400 == 0 else "%Y%m%d%H%M"
+    return f"{policy.table}_p{start.strftime(fmt)}"
+
+
+def _parse_bound(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+async def list_partitions(conn: AsyncConnection, parent: str) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+    """(name, lower bound, upper bound) of every partition; bounds are None for the default partition."""
+    result = await conn.execute(
+        text(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = CAST(:parent AS regclass)"
+        ),
+        {"parent": parent},
+    )
+    out = []
+    for name, bound in result:
+        match = PARTITION_BOUND.search(bound or "")
+        if match:
+            out.append((name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+        else:
+            out.append((name, None, None))
+    return out
+
+
+async def is_partitioned(conn: AsyncConnection, table: str) -> Optional[bool]:
+    """True/False for an existing table, None if it does not exist."""
+    kind = (await conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table}
+    )).scalar()
+    return None if kind is None else kind == "p"
+
+
+async def ensure_default_partition(conn: AsyncConnection, policy: PartitionPolicy) -> None:
+    await conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {_quote(policy.table + '_default')} "
+        f"PARTITION OF {_quote(policy.table)} DEFAULT"
+    ))
+
+
+async def create_partition(conn: AsyncConnection, policy: PartitionPolicy, start: datetime) -> str:
+    """Create [start, start + interval) as a partition.
+
+    Rows for that range already sitting in the default partition are moved
+    into the new table before it is attached, otherwise ATTACH would fail.
+    """
+    end = start + timedelta(seconds=policy.interval_seconds)
+    name, parent, default = _quote(partition_name(policy, start)), _quote(policy.table), _quote(policy.table + "_default")
+    column = _quote(policy.column)
+    bounds = {"start": start, "end": end}
+    await conn.execute(text(f"CREATE TABLE {name} (LIKE {parent} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    await conn.execute(
+        text(f"WITH moved AS (DELETE FROM {default} WHERE {column} >= :start AND {column} < :end RETURNING *) "
+             f"INSERT INTO {name} SELECT * FROM moved"),
+        bounds,
+    )
+    await conn.execute(text(
+        f"ALTER TABLE {parent} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+    return partition_name(policy, start)
+
+
+async def maintain(conn: AsyncConnection, policy: PartitionPolicy, now: datetime, premake: int = 3) -> Dict[str, list]:
+    """Create the current and next ``premake`` partitions, drop expired ones.
+
+    Each partition is created in its own savepoint, so a range that overlaps an
+    existing partition (e.g. an attached pre-partitioning table) is skipped.
+    """
+    await ensure_default_partition(conn, policy)
+    existing = await list_partitions(conn, policy.table)
+    covered = [(lo, hi) for _, lo, hi in existing if lo is not None]
+    created, dropped = [], []
+
+    start = partition_start(now, policy.interval_seconds)
+    for i in range(premake + 1):
+        lo = start + timedelta(seconds=i * policy.interval_seconds)
+        hi = lo + timedelta(seconds=policy.interval_seconds)
+        if any(c_lo < hi and lo < c_hi for c_lo, c_hi in covered):
+            continue
+        try:
+            async with conn.begin_nested():
+                created.append(await create_partition(conn, policy, lo))
+        except Exception as e:
+            logger.warning("Could not create partition of %s at %s: %s", policy.table, lo.isoformat(), e)
+
+    cutoff = now - timedelta(seconds=policy.retention_seconds)
+    for name, lo, hi in existing:
+        if hi is not None and hi <= cutoff:
+            await conn.execute(text(f"DROP TABLE {_quote(name)}"))
+            dropped.append(name)
+    # Stray rows in the default partition expire by DELETE; it only ever holds outliers
+    await conn.execute(
+        text(f"DELETE FROM {_quote(policy.table + '_default')} WHERE {_quote(policy.column)} < :cutoff"),
+        {"cutoff": cutoff},
+    )
+    return {"created": created, "dropped": dropped}
+
+
+async def detach_legacy_table(conn: AsyncConnection, policy: PartitionPolicy) -> bool:
+    """Rename a pre-partitioning plain table out of the way so the partitioned parent can be created."""
+    if await is_partitioned(conn, policy.table) is not False:
+        return False
+    legacy = policy.table + "_legacy"
+    await conn.execute(text(f"ALTER TABLE {_quote(policy.table)} RENAME TO {_quote(legacy)}"))
+    await conn.execute(text(
+        f"ALTER TABLE {_quote(legacy)} RENAME CONSTRAINT {_quote(policy.table + '_pkey')} TO {_quote(legacy + '_pkey')}"
+    ))
+    return True
+
+
+async def attach_legacy_table(conn: AsyncConnection, policy: PartitionPolicy) -> None:
+    """Attach the renamed table as one partition covering its whole time span (no data is copied)."""
+    legacy, column = policy.table + "_legacy", _quote(policy.column)
+    lo, hi = (await conn.execute(text(f"SELECT min({column}), max({column}) FROM {_quote(legacy)}"))).one()
+    if lo is None:
+        await conn.execute(text(f"DROP TABLE {_quote(legacy)}"))
+        return
+    lo = partition_start(lo, policy.interval_seconds)
+    hi = partition_start(hi, policy.interval_seconds) + timedelta(seconds=policy.interval_seconds)
+    await conn.execute(text(
+        f"ALTER TABLE {_quote(policy.table)} ATTACH PARTITION {_quote(legacy)} "
+        f"FOR VALUES FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}')"
+    ))
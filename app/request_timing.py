@@ -0,0 +1,111 @@
+# request_timing.py
+"""Per-request database time, reported in a ``Server-Timing`` response header.
+
+ServerTimingMiddleware opens a RequestTiming for every HTTP request; cursor
+events on the engine add each statement's wall time to the timing of the
+request that issued it. Work done outside a request (background tasks,
+write-behind flushes) is not attributed to any request.
+
+    Server-Timing: db;dur=3.12;desc="4 queries", app;dur=5.80
+"""
+import time
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+class RequestTiming:
+    __slots__ = ("db_seconds", "db_queries")
+
+    def __init__(self):
+        self.db_seconds = 0.0
+        self.db_queries = 0
+
+
+_current: ContextVar[Optional[RequestTiming]] = ContextVar("request_timing", default=None)
+
+
+def current_timing() -> Optional[RequestTiming]:
+    return _current.get()
+
+
+def install_db_timing(sync_engine: Engine) -> None:
+    """Time every statement on ``sync_engine`` (for an AsyncEngine pass ``engine.sync_engine``)."""
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_start"].pop()
+        timing = _current.get()
+        if timing is not None:
+            timing.db_seconds += time.perf_counter() - started
+            timing.db_queries += 1
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
+
+
+_checkout_observer: Optional[Callable[[float], None]] = None
+
+
+def set_checkout_observer(observer: Optional[Callable[[float], None]]) -> None:
+    global _checkout_observer
+    _checkout_observer = observer
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Connection pool reporting how long each checkout took (waiting for a free slot or connecting)."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            if _checkout_observer is not None:
+                _checkout_observer(time.perf_counter() - started)
+
+
+# (scope, status, seconds, timing), called once per finished request
+RequestObserver = Callable[[dict, int, float, RequestTiming], None]
+
+
+class ServerTimingMiddleware:
+    """Plain ASGI middleware (no BaseHTTPMiddleware task hop) adding the Server-Timing header."""
+
+    def __init__(self, app, observer: Optional[RequestObserver] = None):
+        self.app = app
+        self.observer = observer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timing = RequestTiming()
+        token = _current.set(timing)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                app_ms = (time.perf_counter() - started) * 1000
+                value = f'db;dur={timing.db_seconds * 1000:.2f};desc="{timing.db_queries} queries", app;dur={app_ms:.2f}'
+                message["headers"] = [*message.get("headers", []), (b"server-timing", value.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            if self.observer is not None:
+                self.observer(scope, status, time.perf_counter() - started, timing)
@@ -0,0 +1,142 @@
+# rollups.py
+"""Pre-aggregated (rollup) tables for metric history.
+
+Every numeric column of a metric table gets ``<col>_min``, ``<col>_max``,
+``<col>_avg`` and ``<col>_last`` per device, series key (mount point or
+interface) and time bucket. The first level is aggregated from the raw table;
+each further level is merged from the level below it, so an hourly rollup
+never rescans raw samples.
+"""
+from datetime import datetime
+from typing import List, Optional, Sequence
+
+from sqlalchemy import Column, Float, Integer, MetaData, Numeric, String, Table, TIMESTAMP, func, literal_column, select
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array_agg, insert as pg_insert
+
+# (name, bucket width in seconds), finest first
+RESOLUTIONS = [("1m", 60), ("5m", 300), ("1h", 3600)]
+
+
+def bucket_expr(ts, seconds: int):
+    """Start of the ``seconds``-wide, epoch-aligned bucket containing ``ts``.
+
+    The width is inlined rather than bound so the expression in SELECT and
+    GROUP BY is textually identical.
+    """
+    width = literal_column(str(int(seconds)))
+    return func.to_timestamp(func.floor(func.extract("epoch", ts) / width) * width)
+
+
+def numeric_fields(table: Table, keys: Sequence[str]) -> List[Column]:
+    skip = {"device_id", "timestamp", *keys}
+    return [c for c in table.columns if c.name not in skip and isinstance(c.type, (Numeric, Integer))]
+
+
+class Rollup:
+    """One resolution of one metric family, backed by its own table."""
+
+    def __init__(self, raw: Table, name: str, seconds: int, keys: Sequence[str], metadata: MetaData,
+                 parent: Optional["Rollup"] = None):
+        self.raw = raw
+        self.name = name
+        self.seconds = seconds
+        self.keys = tuple(keys)
+        self.parent = parent
+        self.fields = numeric_fields(raw, keys)
+
+        columns = [Column("device_id", Integer, primary_key=True)]
+        columns += [Column(k, String(raw.c[k].type.length), primary_key=True) for k in self.keys]
+        columns += [Column("bucket", TIMESTAMP(timezone=True), primary_key=True), Column("samples", Integer, nullable=False)]
+        for f in self.fields:
+            columns += [
+                Column(f"{f.name}_min", f.type),
+                Column(f"{f.name}_max", f.type),
+                Column(f"{f.name}_avg", Float),
+                Column(f"{f.name}_last", f.type),
+            ]
+        # Range-partitioned on bucket so each level can expire by dropping partitions
+        self.table = Table(f"{raw.name}_{name}", metadata, *columns, postgresql_partition_by="RANGE (bucket)")
+
+    @property
+    def source(self) -> Table:
+        return self.parent.table if self.parent is not None else self.raw
+
+    def aggregate(self, bucket_seconds: int, start: datetime, end: datetime, device_id: Optional[int] = None):
+        """SELECT rolling this level's source into ``bucket_seconds`` buckets over [start, end)."""
+        return aggregate_select(self.source, self.parent is not None, self.keys, self.fields, bucket_seconds, start, end, device_id)
+
+    def refresh_statement(self, start: datetime, end: datetime):
+        """INSERT ... SELECT recomputing every bucket touched by [start, end), replacing existing rows."""
+        query = self.aggregate(self.seconds, start, end)
+        stmt = pg_insert(self.table).from_select([c.name for c in self.table.columns], query)
+        pk = ["device_id", *self.keys, "bucket"]
+        return stmt.on_conflict_do_update(
+            index_elements=pk,
+            set_={c.name: stmt.excluded[c.name] for c in self.table.columns if c.name not in pk},
+        )
+
+
+def aggregate_select(source: Table, from_rollup: bool, keys: Sequence[str], fields: Sequence[Column],
+                     bucket_seconds: int, start: datetime, end: datetime, device_id: Optional[int] = None):
+    """Aggregate raw rows, or merge rollup rows, into buckets.
+
+    Output columns are ``device_id, <keys>, bucket, samples`` followed by the
+    four aggregates of every field, in rollup-table column order.
+    """
+    ts = source.c.bucket if from_rollup else source.c.timestamp
+    bucket = bucket_expr(ts, bucket_seconds).label("bucket")
+    group = [source.c.device_id, *(source.c[k] for k in keys)]
+
+    if from_rollup:
+        samples = func.sum(source.c.samples)
+        columns = [*group, bucket, samples.label("samples")]
+        for f in fields:
+            col_min, col_max = source.c[f"{f.name}_min"], source.c[f"{f.name}_max"]
+            col_avg, col_last = source.c[f"{f.name}_avg"], source.c[f"{f.name}_last"]
+            columns += [
+                func.min(col_min).label(f"{f.name}_min"),
+                func.max(col_max).label(f"{f.name}_max"),
+                (func.sum(col_avg * source.c.samples) / func.nullif(samples, 0)).label(f"{f.name}_avg"),
+                array_agg(aggregate_order_by(col_last, ts.desc()))[1].label(f"{f.name}_last"),
+            ]
+    else:
+        columns = [*group, bucket, func.count().label("samples")]
+        for f in fields:
+            col = source.c[f.name]
+            columns += [
+                func.min(col).label(f"{f.name}_min"),
+                func.max(col).label(f"{f.name}_max"),
+                func.avg(col).cast(Float).label(f"{f.name}_avg"),
+                array_agg(aggregate_order_by(col, ts.desc()))[1].label(f"{f.name}_last"),
+            ]
+
+    query = select(*columns).where(ts >= start, ts < end)
+    if device_id is not None:
+        query = query.where(source.c.device_id == device_id)
+    return query.group_by(*group, bucket).order_by(bucket)
+
+
+def build_rollups(raw: Table, keys: Sequence[str], metadata: MetaData) -> List[Rollup]:
+    """Chain of rollups for one metric table, finest resolution first."""
+    levels: List[Rollup] = []
+    for name, seconds in RESOLUTIONS:
+        levels.append(Rollup(raw, name, seconds, keys, metadata, parent=levels[-1] if levels else None))
+    return levels
+
+
+def pick_level(levels: Sequence[Rollup], step: int) -> Optional[Rollup]:
+    """Coarsest level whose buckets are no wider than ``step``; None means read raw rows."""
+    best = None
+    for level in levels:
+        if level.seconds <= step:
+            best = level
+    return best
+
+
+def history_select(levels: Sequence[Rollup], step: int, start: datetime, end: datetime, device_id: int):
+    """(resolution name, SELECT) answering a ``step``-second history query from the cheapest source."""
+    level = pick_level(levels, step)
+    if level is None:
+        base = levels[0]
+        return "raw", aggregate_select(base.raw, False, base.keys, base.fields, step, start, end, device_id)
+    return level.name, aggregate_select(level.table, True, level.keys, level.fields, step, start, end, device_id)
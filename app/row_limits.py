@@ -0,0 +1,95 @@
+# row_limits.py
+"""Per-column value checks derived from a table's column types.
+
+Ingest validates every sample on its own, but writes whole batches with one
+multi-row INSERT. A single value the database would refuse fails that whole
+statement, such as a percentage overflowing DECIMAL(5,2) or a mount point
+longer than VARCHAR(255). ``RowLimits`` rejects such rows up front so they
+are reported against their own item.
+"""
+import math
+from typing import Any, Callable, List, Optional, Tuple
+
+from sqlalchemy import BigInteger, Float, Integer, Numeric, SmallInteger, String, Table
+
+Check = Callable[[Any], Optional[str]]
+
+
+def _float_check(value: Any) -> Optional[str]:
+    if not math.isfinite(value):
+        return "must be a finite number"
+    return None
+
+
+def _numeric_check(precision: int, scale: int) -> Check:
+    limit = 10 ** (precision - scale)
+
+    def check(value: Any) -> Optional[str]:
+        if not math.isfinite(value):
+            return "must be a finite number"
+        # Postgres rounds to the scale first, so 999.995 overflows NUMERIC(5,2)
+        if abs(round(value, scale)) >= limit:
+            return f"must be less than {limit} in magnitude"
+        return None
+
+    return check
+
+
+def _integer_check(bits: int) -> Check:
+    low, high = -(1 << (bits - 1)), (1 << (bits - 1)) - 1
+
+    def check(value: Any) -> Optional[str]:
+        if not low <= value <= high:
+            return f"must be between {low} and {high}"
+        return None
+
+    return check
+
+
+def _string_check(length: int) -> Check:
+    def check(value: Any) -> Optional[str]:
+        if len(value) > length:
+            return f"must be at most {length} characters"
+        if "\x00" in value:
+            return "must not contain NUL characters"
+        return None
+
+    return check
+
+
+def column_check(type_: Any) -> Optional[Check]:
+    """Check for values of a column type; None when the type has no limits worth checking."""
+    if isinstance(type_, Float):
+        return _float_check
+    if isinstance(type_, Numeric):
+        if type_.precision is None:
+            return _float_check
+        return _numeric_check(type_.precision, type_.scale or 0)
+    if isinstance(type_, BigInteger):
+        return _integer_check(64)
+    if isinstance(type_, SmallInteger):
+        return _integer_check(16)
+    if isinstance(type_, Integer):
+        return _integer_check(32)
+    if isinstance(type_, String) and type_.length is not None:
+        return _string_check(type_.length)
+    return None
+
+
+class RowLimits:
+    """Checks the values of row dicts keyed by the column names of ``table``."""
+
+    def __init__(self, table: Table):
+        self.checks: List[Tuple[str, Check]] = [
+            (c.name, check) for c in table.columns if (check := column_check(c.type)) is not None
+        ]
+
+    def check(self, row: dict) -> Optional[str]:
+        """First problem found in ``row`` as ``"column: reason"``, or None when it can be stored."""
+        for name, check in self.checks:
+            value = row.get(name)
+            if value is not None:
+                problem = check(value)
+                if problem:
+                    return f"{name}: {problem}"
+        return None
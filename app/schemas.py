@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Literal, Optional
 from datetime import datetime
 
 
@@ -63,9 +63,52 @@ class AlertCreate(AlertBase):
     pass
 
 
-class Alert(AlertBase):
+# ------------------------------------------------------------
+# Alert Rules & Alerts
+# ------------------------------------------------------------
+class AlertRuleBase(BaseModel):
+    name: str = Field(..., max_length=255, description="Shown in alert messages")
+    family: Literal["cpu", "memory", "disk", "network"] = Field(..., description="Metric family the rule watches")
+    field: str = Field(..., description="Numeric column of that family, e.g. cpu_usage_percent or usage_percent")
+    op: Literal[">", ">=", "<", "<="] = ">"
+    threshold: float
+    for_seconds: float = Field(0, ge=0, description="How long the condition must hold before the alert fires")
+    rate: bool = Field(False, description="Compare the per-second rate of a counter field (e.g. errors_in)")
+    tags: List[str] = Field(default_factory=list, description="Applies to devices carrying all of these tags; empty = every device")
+    instance: Optional[str] = Field(None, description="Only this mount point / interface; empty = any")
+    severity: str = Field("warning", max_length=20)
+    enabled: bool = True
+
+
+class AlertRuleCreate(AlertRuleBase):
+    pass
+
+
+class AlertRule(AlertRuleBase):
     id: int
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
 
     class Config:
-        orm_mode = True
+        from_attributes = True
+
+
+class Alert(BaseModel):
+    id: int
+    rule_id: Optional[int] = None
+    device_id: int
+    instance: str = Field("", description="Mount point / interface; empty for CPU and memory rules")
+    severity: str
+    message: str
+    state: str = Field(..., description="firing or resolved")
+    value: Optional[float] = None
+    started_at: datetime
+    resolved_at: Optional[datetime] = None
+    acknowledged_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
 
+class AlertUpdate(BaseModel):
+    acknowledged: bool = Field(..., description="Acknowledge (true) or un-acknowledge (false) the alert")
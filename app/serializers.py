@@ -0,0 +1,92 @@
+# serializers.py
+"""JSON output for query endpoints, built straight from Core result rows.
+
+A ``RowSerializer`` is prepared once per result layout (the columns of a
+table or SELECT). It records which positions need converting -- NUMERIC
+columns, which asyncpg returns as ``Decimal``, become floats and INET values
+become strings -- and leaves everything orjson encodes natively (int, float,
+str, None, datetime) untouched. Rows are never turned into ORM instances, and
+returning an ``ORJSONResponse`` directly skips FastAPI's ``jsonable_encoder``.
+
+Two output shapes: ``rows``, a list of objects, and ``columnar``, one array
+per column (``{"bucket": [...], "cpu_usage_percent_avg": [...]}``), which
+does not repeat every key in every point and is what charting clients plot.
+"""
+import ipaddress
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import orjson
+from fastapi.responses import JSONResponse
+from sqlalchemy import Float, Numeric
+from sqlalchemy.dialects.postgresql import CIDR, INET
+
+SHAPES = ("rows", "columnar")
+
+JSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _default(value: Any) -> Any:
+    """Types orjson does not encode by itself."""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (ipaddress.IPv4Address, ipaddress.IPv6Address, ipaddress.IPv4Network, ipaddress.IPv6Network)):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=JSON_OPTIONS)
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response encoded by orjson; Decimal and IP address values are accepted too."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def column_converter(type_: Any) -> Optional[Callable[[Any], Any]]:
+    """Conversion a result value of this SQL type needs before encoding; None when it needs none."""
+    if isinstance(type_, Numeric) and not isinstance(type_, Float) and type_.asdecimal:
+        return float
+    if isinstance(type_, (INET, CIDR)):
+        return str
+    return None
+
+
+class RowSerializer:
+    """Turns result rows of one fixed column layout into JSON-ready dicts or columns."""
+
+    def __init__(self, columns: Iterable[Any]):
+        columns = list(columns)
+        self.names: Tuple[str, ...] = tuple(c.name for c in columns)
+        self.converters: Tuple[Tuple[int, Callable[[Any], Any]], ...] = tuple(
+            (i, conv) for i, c in enumerate(columns) if (conv := column_converter(c.type)) is not None
+        )
+
+    def _values(self, row: Sequence[Any]) -> List[Any]:
+        values = list(row)
+        for i, conv in self.converters:
+            value = values[i]
+            if value is not None:
+                values[i] = conv(value)
+        return values
+
+    def rows(self, rows: Iterable[Sequence[Any]]) -> List[Dict[str, Any]]:
+        names = self.names
+        if not self.converters:
+            return [dict(zip(names, row)) for row in rows]
+        return [dict(zip(names, self._values(row))) for row in rows]
+
+    def columns(self, rows: Sequence[Sequence[Any]]) -> Dict[str, List[Any]]:
+        if not rows:
+            return {name: [] for name in self.names}
+        columns = [list(col) for col in zip(*rows)]
+        for i, conv in self.converters:
+            columns[i] = [None if v is None else conv(v) for v in columns[i]]
+        return dict(zip(self.names, columns))
+
+    def render(self, rows: Sequence[Sequence[Any]], shape: str = "rows") -> Any:
+        """``rows`` or ``columns`` of ``rows``, by shape name (one of ``SHAPES``)."""
+        return self.columns(rows) if shape == "columnar" else self.rows(rows)
@@ -1,13 +1,53 @@
 # server_agent.py
+import gzip
+import json
+import os
+import random
 import time
 import psutil
 import requests
 import socket
 from datetime import datetime
+from typing import NamedTuple, Optional
+
+import wire_format
+
+try:
+    from websockets.exceptions import WebSocketException
+    from websockets.sync.client import connect as ws_connect
+except ImportError:  # only needed for TRANSPORT = "stream"
+    ws_connect = None
 
 # CONFIG
 SERVER_IP = "192.168.0.108"
 NMS_API = "http://127.0.0.1:8000/devices/metrics/collect"
+NMS_BATCH_API = NMS_API + "/batch"
+NMS_STREAM_API = "ws://127.0.0.1:8000/devices/metrics/stream"
+TRANSPORT = "http"  # "http" (one batch request per flush) or "stream" (persistent WebSocket channel)
+HTTP_CONNECT_TIMEOUT_SECONDS = 5
+HTTP_READ_TIMEOUT_SECONDS = 15
+WIRE_FORMAT = "binary"  # "binary" (wire_format.py) or "json"
+# Each collector runs on its own interval; everything collected is sent as one batch per flush
+COLLECTOR_INTERVALS = {"cpu": 5, "memory": 15, "network": 30, "disk": 300}
+FLUSH_INTERVAL_SECONDS = 30
+# Static attributes and idle interfaces are only re-sent this often (keep below the server's LATEST_STALE_SECONDS)
+FULL_REFRESH_SECONDS = 600
+
+DISK_COUNTERS = ("read_bytes", "write_bytes", "read_ops", "write_ops")
+DISK_STATIC = ("device_name", "filesystem_type", "total_gb")
+NET_COUNTERS = ("bytes_sent", "bytes_recv", "packets_sent", "packets_recv", "errors_in", "errors_out", "drops_in", "drops_out")
+NET_STATIC = ("speed_mbps", "status")
+
+# Store-and-forward spool for samples the server did not accept
+SPOOL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool")
+SPOOL_SEGMENT_MAX_BYTES = 1024 * 1024
+SPOOL_SEGMENT_MAX_AGE_SECONDS = 600
+SPOOL_MAX_BYTES = 100 * 1024 * 1024  # oldest segments are dropped beyond this
+SPOOL_MAX_AGE_SECONDS = 7 * 86400
+REPLAY_BATCH_SIZE = 200  # samples per gzip-compressed batch request
+REPLAY_BATCHES_PER_CYCLE = 5  # keeps replay from monopolising the collection loop
+REPLAY_BATCH_INTERVAL_SECONDS = 1.0
+REPLAY_START_JITTER_SECONDS = 60  # spread agents out after a server outage
 
 def get_local_ip():
     """Automatically detect the primary IP of this server."""
@@ -21,36 +61,33 @@ def get_local_ip():
         s.close()
     return ip
 
-def normalize_cpu_metrics(cpu_times):
-    """Normalize CPU times to percentages to avoid DB numeric overflow."""
-    total = cpu_times.user + cpu_times.system + cpu_times.idle + getattr(cpu_times, "iowait", 0.0)
-    if total == 0:
-        return 0.0, 0.0, 0.0, 0.0
-    cpu_user_percent = min(max((cpu_times.user / total) * 100, 0), 999.99)
-    cpu_system_percent = min(max((cpu_times.system / total) * 100, 0), 999.99)
-    cpu_idle_percent = min(max((cpu_times.idle / total) * 100, 0), 999.99)
-    cpu_iowait_percent = min(max((getattr(cpu_times, "iowait", 0.0) / total) * 100, 0), 999.99)
-    return cpu_user_percent, cpu_system_percent, cpu_idle_percent, cpu_iowait_percent
+def clamp_percent(value):
+    """Keep percentages inside the DECIMAL(5, 2) columns they are stored in."""
+    return min(max(value, 0.0), 999.99)
 
 def get_cpu_metrics():
-    cpu_percent = psutil.cpu_percent(interval=1)
-    cpu_times = psutil.cpu_times()
+    # Non-blocking: both calls report usage since the previous call (see prime_cpu_metrics)
+    cpu_percent = psutil.cpu_percent(interval=None)
+    cpu_times = psutil.cpu_times_percent(interval=None)
     load1, load5, load15 = psutil.getloadavg()
-    
-    cpu_user, cpu_system, cpu_idle, cpu_iowait = normalize_cpu_metrics(cpu_times)
 
     return {
         "cpu_usage_percent": cpu_percent,
-        "cpu_user": cpu_user,
-        "cpu_system": cpu_system,
-        "cpu_idle": cpu_idle,
-        "cpu_iowait": cpu_iowait,
+        "cpu_user": clamp_percent(cpu_times.user),
+        "cpu_system": clamp_percent(cpu_times.system),
+        "cpu_idle": clamp_percent(cpu_times.idle),
+        "cpu_iowait": clamp_percent(getattr(cpu_times, "iowait", 0.0)),
         "load_avg_1": load1,
         "load_avg_5": load5,
         "load_avg_15": load15,
         "core_count": psutil.cpu_count()
     }
 
+def prime_cpu_metrics():
+    """The first non-blocking reading has no baseline; take it once at startup and discard it."""
+    psutil.cpu_percent(interval=None)
+    psutil.cpu_times_percent(interval=None)
+
 def get_memory_metrics():
     mem = psutil.virtual_memory()
     swap = psutil.swap_memory()
@@ -110,24 +147,386 @@ def get_network_metrics():
         })
     return nets
 
-def collect_and_send_metrics():
-    server_ip = get_local_ip()
-    payload = {
-        "device_ip": server_ip,
-        "timestamp": datetime.utcnow().isoformat(),
-        "cpu": get_cpu_metrics(),
-        "memory": get_memory_metrics(),
-        "disk": get_disk_metrics(),
-        "network": get_network_metrics()
-    }
-    try:
-        r = requests.post(NMS_API, json=payload)
-        print(f"[{datetime.now()}] IP {server_ip} - Status: {r.status_code}, Response: {r.json()}")
-    except Exception as e:
-        print(f"[{datetime.now()}] Failed to send metrics:", e)
+class CounterState:
+    """Previous readings, used to turn cumulative counters into per-second rates
+    and to leave out attributes that have not changed since they were last sent."""
+
+    def __init__(self):
+        self.boot_time = None
+        self.counters = {}   # (kind, name) -> (monotonic time, {counter: value})
+        self.sent_static = {}  # (kind, name) -> {attribute: value} last sent
+        self.last_full_refresh = {}  # kind -> monotonic time
+
+    def begin_sample(self, now, kind):
+        """Start a sample of ``kind`` ("disk" or "net"); returns True when its full refresh is due."""
+        boot_time = psutil.boot_time()
+        if self.boot_time is not None and boot_time != self.boot_time:
+            # Rebooted: every counter restarted from zero, old baselines are meaningless
+            self.counters.clear()
+            self.sent_static.clear()
+        self.boot_time = boot_time
+        last = self.last_full_refresh.get(kind)
+        if last is None or now - last >= FULL_REFRESH_SECONDS:
+            self.last_full_refresh[kind] = now
+            return True
+        return False
+
+    def rates(self, kind, name, current, now):
+        """Per-second rates since the previous reading, or None for a first reading or a reset counter."""
+        previous = self.counters.get((kind, name))
+        self.counters[(kind, name)] = (now, current)
+        if previous is None:
+            return None
+        then, old = previous
+        elapsed = now - then
+        if elapsed <= 0 or any(current[k] < old[k] for k in current):
+            # A counter went backwards (device re-created or wrapped past psutil's nowrap handling)
+            return None
+        return {f"{k}_per_sec": round((current[k] - old[k]) / elapsed, 3) for k in current}
+
+    def changed_static(self, kind, name, current, full):
+        last = self.sent_static.get((kind, name))
+        self.sent_static[(kind, name)] = current
+        if full or last is None:
+            return dict(current)
+        return {k: v for k, v in current.items() if last.get(k) != v}
+
+
+def compact_disk_metrics(disks, state, now, full):
+    out = []
+    for disk in disks:
+        name = disk["mount_point"]
+        item = {k: v for k, v in disk.items() if k not in DISK_COUNTERS and k not in DISK_STATIC}
+        item.update(state.changed_static("disk", name, {k: disk[k] for k in DISK_STATIC}, full))
+        item.update(state.rates("disk", name, {k: disk[k] for k in DISK_COUNTERS}, now) or {})
+        out.append(item)
+    return out
+
+
+def compact_network_metrics(nets, state, now, full):
+    out = []
+    for net in nets:
+        name = net["interface_name"]
+        static = state.changed_static("net", name, {k: net[k] for k in NET_STATIC}, full)
+        rates = state.rates("net", name, {k: net[k] for k in NET_COUNTERS}, now)
+        if not full and not static and rates is not None and not any(rates.values()):
+            continue  # idle and unchanged
+        item = {"interface_name": name}
+        item.update(static)
+        item.update(rates or {})
+        out.append(item)
+    return out
+
+
+class Spool:
+    """Bounded on-disk queue of unsent samples.
+
+    Samples are appended as JSON lines to segment files. The newest segment is
+    the only one written to; it is sealed when it exceeds its size or age cap.
+    Sealed segments are replayed oldest first, and a ``.pos`` sidecar records
+    how far a segment has been sent so a crash mid-replay resends at most one
+    batch (the server ignores duplicate samples).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.active = None
+        self.active_opened = None
+
+    def _segments(self):
+        names = sorted(n for n in os.listdir(self.directory) if n.startswith("segment-") and n.endswith(".ndjson"))
+        return [os.path.join(self.directory, n) for n in names]
+
+    def _remove(self, path):
+        for p in (path, path + ".pos"):
+            if os.path.exists(p):
+                os.remove(p)
+
+    def seal(self):
+        self.active = None
+        self.active_opened = None
+
+    def append(self, sample):
+        now = time.time()
+        if (self.active is None
+                or not os.path.exists(self.active)
+                or os.path.getsize(self.active) >= SPOOL_SEGMENT_MAX_BYTES
+                or now - self.active_opened >= SPOOL_SEGMENT_MAX_AGE_SECONDS):
+            self.active = os.path.join(self.directory, f"segment-{int(now * 1000):015d}.ndjson")
+            self.active_opened = now
+        with open(self.active, "a", encoding="utf-8") as f:
+            f.write(json.dumps(sample, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.enforce_limits()
+
+    def enforce_limits(self):
+        segments = self._segments()
+        total = sum(os.path.getsize(p) for p in segments)
+        now = time.time()
+        for path in segments:
+            if path == self.active:
+                break
+            if total <= SPOOL_MAX_BYTES and now - os.path.getmtime(path) <= SPOOL_MAX_AGE_SECONDS:
+                break
+            total -= os.path.getsize(path)
+            print(f"[{datetime.now()}] Spool limit reached, dropping {os.path.basename(path)}")
+            self._remove(path)
+
+    def pending(self):
+        return bool(self._segments())
+
+    def next_batch(self):
+        """(segment, end offset, samples) for the oldest unsent batch, or None."""
+        segments = self._segments()
+        if segments and segments[0] == self.active:
+            # Only the active segment is left: seal it so it can be replayed
+            self.seal()
+        for path in segments:
+            start = 0
+            if os.path.exists(path + ".pos"):
+                with open(path + ".pos") as f:
+                    start = int(f.read() or 0)
+            samples, end = [], start
+            with open(path, "rb") as f:
+                f.seek(start)
+                while len(samples) < REPLAY_BATCH_SIZE:
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        break  # end of segment, or a line torn by a crash
+                    end = f.tell()
+                    try:
+                        samples.append(json.loads(line))
+                    except ValueError:
+                        pass  # corrupt line
+            if samples:
+                return path, end, samples
+            self._remove(path)  # nothing sendable left in this segment
+        return None
+
+    def commit(self, path, end):
+        if end >= os.path.getsize(path):
+            self._remove(path)
+        else:
+            with open(path + ".pos", "w") as f:
+                f.write(str(end))
+
+
+def make_session():
+    """Keep-alive session reused for every request to the server."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    content_type = wire_format.CONTENT_TYPE if WIRE_FORMAT == "binary" else "application/json"
+    session.headers.update({"Content-Type": content_type, "Content-Encoding": "gzip"})
+    return session
+
+
+class Outcome(NamedTuple):
+    delivered: bool  # the server is done with these samples (stored or rejected as invalid)
+    reachable: bool
+    retry_after: Optional[float] = None
+    summary: str = ""
+
+
+class Sender:
+    """Sends batches of samples, spools the ones that fail and replays the spool at a limited pace."""
+
+    def __init__(self, spool, session):
+        self.spool = spool
+        self.session = session
+        self.connected = True
+        self.replay_not_before = 0.0
+
+    def _transmit(self, samples):
+        """POST a gzip-compressed batch."""
+        if WIRE_FORMAT == "binary":
+            body = gzip.compress(wire_format.encode(samples))
+        else:
+            body = gzip.compress(json.dumps(samples, separators=(",", ":")).encode())
+        try:
+            r = self.session.post(
+                NMS_BATCH_API, data=body, timeout=(HTTP_CONNECT_TIMEOUT_SECONDS, HTTP_READ_TIMEOUT_SECONDS)
+            )
+        except requests.RequestException as e:
+            print(f"[{datetime.now()}] Request to server failed:", e)
+            return Outcome(False, False)
+        if r.status_code >= 500 or r.status_code == 429:
+            retry_after = r.headers.get("Retry-After")
+            return Outcome(False, True, float(retry_after) if retry_after and retry_after.isdigit() else None)
+        result = r.json() if r.ok else {}
+        return Outcome(True, True, summary=f"Status: {r.status_code}, accepted: {result.get('accepted')}, "
+                                           f"rejected: {result.get('rejected')}")
+
+    def _backoff(self, retry_after):
+        self.replay_not_before = time.monotonic() + (retry_after if retry_after is not None else REPLAY_START_JITTER_SECONDS)
+
+    def send(self, samples):
+        if not samples:
+            return
+        outcome = self._transmit(samples)
+        if not outcome.delivered:
+            print(f"[{datetime.now()}] Spooling {len(samples)} samples")
+            self.connected = False
+            self._backoff(outcome.retry_after)
+            for sample in samples:
+                self.spool.append(sample)
+            return
+        print(f"[{datetime.now()}] Sent {len(samples)} samples - {outcome.summary}")
+        if not self.connected:
+            # Back online: wait a random while before replaying so recovering agents don't stampede
+            self.connected = True
+            self.replay_not_before = time.monotonic() + random.uniform(0, REPLAY_START_JITTER_SECONDS)
+        self.replay()
+
+    def replay(self):
+        for _ in range(REPLAY_BATCHES_PER_CYCLE):
+            if time.monotonic() < self.replay_not_before or not self.spool.pending():
+                return
+            batch = self.spool.next_batch()
+            if batch is None:
+                return
+            path, end, samples = batch
+            outcome = self._transmit(samples)
+            if not outcome.delivered:
+                self.connected = outcome.reachable
+                self._backoff(outcome.retry_after)
+                return
+            # Items the server rejected individually (e.g. invalid) would fail again; they are dropped
+            print(f"[{datetime.now()}] Replayed {len(samples)} spooled samples - {outcome.summary}")
+            self.spool.commit(path, end)
+            time.sleep(REPLAY_BATCH_INTERVAL_SECONDS * random.uniform(0.5, 1.5))
+
+
+class StreamSender(Sender):
+    """Sender over the server's persistent WebSocket channel (see stream_ingest.py on the server).
+
+    The device is identified once per connection. Each batch goes out as one
+    sequenced frame and counts as delivered only when the server acks it,
+    i.e. after it has been written; a nack or a lost connection spools it.
+    """
+
+    def __init__(self, spool, device_ip):
+        super().__init__(spool, session=None)
+        if ws_connect is None:
+            raise RuntimeError('TRANSPORT = "stream" requires the websockets package')
+        self.device_ip = device_ip
+        self.ws = None
+        self.seq = 0
+
+    def _connect(self):
+        if self.ws is None:
+            ws = ws_connect(NMS_STREAM_API, open_timeout=HTTP_CONNECT_TIMEOUT_SECONDS, compression="deflate")
+            ws.send(json.dumps({"device_ip": self.device_ip}))
+            ready = json.loads(ws.recv(timeout=HTTP_READ_TIMEOUT_SECONDS))
+            if ready.get("type") != "ready":
+                ws.close()
+                raise ConnectionError(f"Stream not ready: {ready}")
+            self.ws = ws
+        return self.ws
+
+    def _disconnect(self):
+        if self.ws is not None:
+            try:
+                self.ws.close()
+            except Exception:
+                pass
+            self.ws = None
+
+    def _transmit(self, samples):
+        self.seq += 1
+        try:
+            ws = self._connect()
+            if WIRE_FORMAT == "binary":
+                ws.send(wire_format.STREAM_FRAME_SEQ.pack(self.seq) + wire_format.encode(samples))
+            else:
+                ws.send(json.dumps({"seq": self.seq, "samples": samples}, separators=(",", ":")))
+            # One frame in flight at a time; acks for older frames (after a timeout) are skipped
+            while True:
+                reply = json.loads(ws.recv(timeout=HTTP_READ_TIMEOUT_SECONDS))
+                if reply.get("seq") == self.seq:
+                    break
+        except (OSError, TimeoutError, ConnectionError, WebSocketException, ValueError) as e:
+            print(f"[{datetime.now()}] Stream to server failed:", e)
+            self._disconnect()
+            return Outcome(False, False)
+        if reply["type"] == "nack":
+            return Outcome(False, True, reply.get("retry_after"))
+        return Outcome(True, True, summary=f"ack {self.seq}, accepted: {reply['accepted']}, rejected: {reply['rejected']}")
+
+
+class CollectionScheduler:
+    """Runs each collector on its own fixed-rate schedule and flushes everything collected in one batch.
+
+    Deadlines advance by whole intervals on the monotonic clock, so the
+    schedule does not drift with collection or send time; if the loop falls
+    behind, missed runs are skipped rather than bunched up.
+    """
+
+    def __init__(self, sender, intervals=None, flush_interval=FLUSH_INTERVAL_SECONDS):
+        self.sender = sender
+        self.intervals = dict(intervals or COLLECTOR_INTERVALS)
+        self.flush_interval = flush_interval
+        self.counters = CounterState()
+        self.buffer = []
+        self.device_ip = get_local_ip()
+        # Sample numbers let the server drop retried and replayed duplicates; starting
+        # from the clock (in microseconds) keeps them increasing across agent restarts
+        self.seq = time.time_ns() // 1000
+
+    def collect(self, kinds):
+        """One sample holding every collector that is due at this instant."""
+        now = time.monotonic()
+        self.seq += 1
+        sample = {"device_ip": self.device_ip, "timestamp": datetime.utcnow().isoformat(), "seq": self.seq}
+        if "cpu" in kinds:
+            sample["cpu"] = get_cpu_metrics()
+        if "memory" in kinds:
+            sample["memory"] = get_memory_metrics()
+        if "disk" in kinds:
+            full = self.counters.begin_sample(now, "disk")
+            sample["disk"] = compact_disk_metrics(get_disk_metrics(), self.counters, now, full)
+        if "network" in kinds:
+            full = self.counters.begin_sample(now, "net")
+            sample["network"] = compact_network_metrics(get_network_metrics(), self.counters, now, full)
+        return sample
+
+    def flush(self):
+        batch, self.buffer = self.buffer, []
+        self.sender.send(batch)
+
+    @staticmethod
+    def _advance(deadline, interval, now):
+        deadline += interval
+        if deadline <= now:
+            deadline += ((now - deadline) // interval + 1) * interval
+        return deadline
+
+    def run(self):
+        prime_cpu_metrics()
+        start = time.monotonic()
+        due = {kind: start for kind in self.intervals}
+        next_flush = start + self.flush_interval
+        while True:
+            now = time.monotonic()
+            ready = [kind for kind, deadline in due.items() if deadline <= now]
+            if ready:
+                self.buffer.append(self.collect(ready))
+                for kind in ready:
+                    due[kind] = self._advance(due[kind], self.intervals[kind], now)
+            if now >= next_flush:
+                self.flush()
+                next_flush = self._advance(next_flush, self.flush_interval, time.monotonic())
+            time.sleep(max(0.0, min(min(due.values()), next_flush) - time.monotonic()))
+
 
 if __name__ == "__main__":
     print("Starting Server Metrics Agent...")
-    while True:
-        collect_and_send_metrics()
-        time.sleep(30)  # every 30 seconds
+    spool = Spool(SPOOL_DIR)
+    if TRANSPORT == "stream":
+        sender = StreamSender(spool, get_local_ip())
+    else:
+        sender = Sender(spool, make_session())
+    CollectionScheduler(sender).run()
@@ -0,0 +1,549 @@
+# ssh_poller.py
+"""Agentless collection: the fields server_agent.py sends, read from /proc over SSH.
+
+One command per poll prints /proc/stat, /proc/loadavg, /proc/meminfo,
+/proc/diskstats, /proc/net/dev and /proc/mounts, ``df`` (filesystem usage is
+not in /proc) and the link state of each interface, separated by ``==> name``
+lines. It needs nothing but a POSIX shell on the host, so busybox appliances
+work too. The output is parsed here into the same sample dict an agent
+posts, so polled samples go through the normal ingest validation.
+
+CPU percentages and counter rates are deltas between two polls, so a host's
+first poll (and the first after a reboot) has no CPU block and no rates.
+
+Each host keeps one SSH connection open between polls. Polls run on a bounded
+thread pool, because paramiko is blocking; each open connection also holds
+paramiko's transport thread. Every host has its own fixed-rate schedule with
+a random initial offset, so the fleet's polls are spread over the interval.
+Failures back off exponentially, with jitter, up to ``max_backoff``.
+
+The connection layer is pluggable. ``ParamikoConnector`` talks to real sshd
+servers. ``LocalConnector`` runs the same command on this machine, which
+exercises everything except the SSH hop:
+
+    python ssh_poller.py --local --polls 2
+    python ssh_poller.py 10.0.0.5 10.0.0.6 --user nms --key ~/.ssh/id_ed25519
+"""
+import asyncio
+import logging
+import random
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import paramiko
+
+logger = logging.getLogger(__name__)
+
+COLLECT_COMMAND = (
+    "for f in /proc/stat /proc/loadavg /proc/meminfo /proc/diskstats /proc/net/dev /proc/mounts; "
+    "do echo \"==> $f\"; cat \"$f\"; done; "
+    "echo '==> df'; df -Pk 2>/dev/null; "
+    "echo '==> df -i'; df -Pi 2>/dev/null; "
+    "echo '==> links'; for i in /sys/class/net/*; "
+    "do echo \"${i##*/} $(cat \"$i/operstate\" 2>/dev/null) $(cat \"$i/speed\" 2>/dev/null)\"; done"
+)
+SECTION_PREFIX = "==> "
+
+MB = 1024 * 1024
+GB = 1024 ** 3
+SECTOR_BYTES = 512  # /proc/diskstats counts 512-byte sectors whatever the device's block size
+
+DISK_COUNTERS = ("read_bytes", "write_bytes", "read_ops", "write_ops")
+NET_COUNTERS = ("bytes_sent", "bytes_recv", "packets_sent", "packets_recv", "errors_in", "errors_out", "drops_in", "drops_out")
+
+
+class PollError(Exception):
+    pass
+
+
+class HostTarget(NamedTuple):
+    ip: str
+    port: int = 22
+    username: Optional[str] = None  # None: the connector's default
+
+
+# -----------------------
+# /proc parsing
+# -----------------------
+def parse_sections(output: str) -> Dict[str, List[str]]:
+    sections: Dict[str, List[str]] = {}
+    current: Optional[List[str]] = None
+    for line in output.splitlines():
+        if line.startswith(SECTION_PREFIX):
+            current = sections.setdefault(line[len(SECTION_PREFIX):].strip(), [])
+        elif current is not None:
+            current.append(line)
+    return sections
+
+
+def _percent(part: float, whole: float) -> float:
+    return round(min(max(part / whole * 100, 0.0), 100.0), 2) if whole > 0 else 0.0
+
+
+def cpu_times(stat: List[str]) -> Tuple[Optional[Tuple[int, ...]], int, Optional[int]]:
+    """(user, nice, system, idle, iowait, irq, softirq, steal) jiffies of the ``cpu`` line, core count, boot time."""
+    times, cores, boot_time = None, 0, None
+    for line in stat:
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == "cpu":
+            times = tuple(int(v) for v in (fields[1:9] + ["0"] * 8)[:8])
+        elif fields[0].startswith("cpu"):
+            cores += 1
+        elif fields[0] == "btime":
+            boot_time = int(fields[1])
+    return times, cores, boot_time
+
+
+def cpu_fields(previous: Tuple[int, ...], current: Tuple[int, ...], loadavg: List[str], cores: int) -> Optional[Dict[str, Any]]:
+    """CPU block from two readings of /proc/stat, percentages as psutil computes them."""
+    delta = [max(c - p, 0) for c, p in zip(current, previous)]
+    total = sum(delta)
+    if total <= 0:
+        return None
+    user, _nice, system, idle, iowait = delta[:5]
+    load = (loadavg[0].split() + ["0", "0", "0"])[:3] if loadavg else ["0", "0", "0"]
+    return {
+        "cpu_usage_percent": _percent(total - idle - iowait, total),
+        "cpu_user": _percent(user, total),
+        "cpu_system": _percent(system, total),
+        "cpu_idle": _percent(idle, total),
+        "cpu_iowait": _percent(iowait, total),
+        "load_avg_1": float(load[0]),
+        "load_avg_5": float(load[1]),
+        "load_avg_15": float(load[2]),
+        "core_count": cores,
+    }
+
+
+def memory_fields(meminfo: List[str]) -> Optional[Dict[str, Any]]:
+    """Memory block from /proc/meminfo, with psutil's definitions of used and available."""
+    kb: Dict[str, int] = {}
+    for line in meminfo:
+        name, _, rest = line.partition(":")
+        value = rest.split()
+        if value:
+            kb[name.strip()] = int(value[0])
+    total = kb.get("MemTotal")
+    if not total:
+        return None
+    free = kb.get("MemFree", 0)
+    buffers = kb.get("Buffers", 0)
+    cached = kb.get("Cached", 0) + kb.get("SReclaimable", 0)
+    used = total - free - buffers - cached
+    if used < 0:
+        used = total - free
+    available = kb.get("MemAvailable", free + buffers + cached)
+    swap_total, swap_free = kb.get("SwapTotal", 0), kb.get("SwapFree", 0)
+    return {
+        "total_mb": total * 1024 // MB,
+        "used_mb": used * 1024 // MB,
+        "free_mb": free * 1024 // MB,
+        "available_mb": available * 1024 // MB,
+        "usage_percent": round((total - available) / total * 100, 1),
+        "swap_total_mb": swap_total * 1024 // MB,
+        "swap_used_mb": (swap_total - swap_free) * 1024 // MB,
+        "swap_free_mb": swap_free * 1024 // MB,
+    }
+
+
+def _unescape_mount(path: str) -> str:
+    # /proc/mounts writes space, tab, newline and backslash as octal escapes
+    return path.replace("\\040", " ").replace("\\011", "\t").replace("\\012", "\n").replace("\\134", "\\")
+
+
+def _df_rows(lines: List[str], columns: int) -> Dict[str, List[str]]:
+    """Mount point -> numeric columns of POSIX ``df -P`` output (the mount point may contain spaces)."""
+    rows = {}
+    for line in lines[1:]:
+        fields = line.split(None, columns)
+        if len(fields) == columns + 1:
+            rows[fields[columns]] = fields[1:columns]
+    return rows
+
+
+def disk_fields(sections: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+    """One item per mounted block device (like psutil.disk_partitions(all=False)), with cumulative I/O counters."""
+    io: Dict[str, List[int]] = {}
+    for line in sections.get("/proc/diskstats", []):
+        fields = line.split()
+        if len(fields) >= 11:
+            # reads completed, sectors read, writes completed, sectors written
+            io[fields[2]] = [int(fields[3]), int(fields[5]), int(fields[7]), int(fields[9])]
+    usage = _df_rows(sections.get("df", []), 5)
+    inodes = _df_rows(sections.get("df -i", []), 5)
+
+    disks, seen = [], set()
+    for line in sections.get("/proc/mounts", []):
+        fields = line.split()
+        if len(fields) < 3 or not fields[0].startswith("/dev/"):
+            continue
+        device, mount_point, fstype = fields[0], _unescape_mount(fields[1]), fields[2]
+        if mount_point in seen or mount_point not in usage:
+            continue
+        seen.add(mount_point)
+        blocks, used, available = (int(v) * 1024 for v in usage[mount_point][:3])
+        inode_use = inodes.get(mount_point, [])
+        reads, sectors_read, writes, sectors_written = io.get(device.rsplit("/", 1)[-1], [0, 0, 0, 0])
+        disks.append({
+            "mount_point": mount_point,
+            "device_name": device,
+            "filesystem_type": fstype,
+            "total_gb": round(blocks / GB, 2),
+            "used_gb": round(used / GB, 2),
+            "free_gb": round(available / GB, 2),
+            "usage_percent": round(used / (used + available) * 100, 1) if used + available else 0.0,
+            "inode_usage_percent": float(inode_use[3].rstrip("%")) if len(inode_use) > 3 and inode_use[3] != "-" else 0.0,
+            "read_bytes": sectors_read * SECTOR_BYTES,
+            "write_bytes": sectors_written * SECTOR_BYTES,
+            "read_ops": reads,
+            "write_ops": writes,
+        })
+    return disks
+
+
+def network_fields(sections: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+    links: Dict[str, Tuple[str, int]] = {}
+    for line in sections.get("links", []):
+        fields = line.split()
+        if fields:
+            state = fields[1] if len(fields) > 1 else ""
+            speed = int(fields[2]) if len(fields) > 2 and fields[2].lstrip("-").isdigit() else 0
+            links[fields[0]] = (state, max(speed, 0))
+
+    nets = []
+    for line in sections.get("/proc/net/dev", [])[2:]:
+        name, sep, rest = line.partition(":")
+        values = rest.split()
+        if not sep or len(values) < 16:
+            continue
+        name = name.strip()
+        rx, tx = [int(v) for v in values[:8]], [int(v) for v in values[8:16]]
+        state, speed = links.get(name, ("", 0))
+        nets.append({
+            "interface_name": name,
+            "bytes_sent": tx[0],
+            "bytes_recv": rx[0],
+            "packets_sent": tx[1],
+            "packets_recv": rx[1],
+            "errors_in": rx[2],
+            "errors_out": tx[2],
+            "drops_in": rx[3],
+            "drops_out": tx[3],
+            "speed_mbps": speed,
+            # Loopback and some virtual links report "unknown" while up
+            "status": "UP" if state in ("up", "unknown") else "DOWN",
+        })
+    return nets
+
+
+# -----------------------
+# Connections
+# -----------------------
+class ParamikoSession:
+    def __init__(self, client: paramiko.SSHClient):
+        self.client = client
+
+    def alive(self) -> bool:
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def run(self, command: str, timeout: float) -> str:
+        _, stdout, _ = self.client.exec_command(command, timeout=timeout)
+        output = stdout.read().decode("utf-8", "replace")
+        stdout.channel.recv_exit_status()  # the loops end with a successful echo; failures show as missing sections
+        return output
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class ParamikoConnector:
+    """Opens authenticated SSH sessions; host keys are checked against ``known_hosts`` unless ``accept_unknown_hosts``."""
+
+    def __init__(self, username: str, password: Optional[str] = None, key_filename: Optional[str] = None,
+                 known_hosts: Optional[str] = None, accept_unknown_hosts: bool = False, keepalive_seconds: int = 30):
+        self.username = username
+        self.password = password
+        self.key_filename = key_filename
+        self.known_hosts = known_hosts
+        self.accept_unknown_hosts = accept_unknown_hosts
+        self.keepalive_seconds = keepalive_seconds
+
+    def connect(self, target: HostTarget, timeout: float) -> ParamikoSession:
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        if self.known_hosts:
+            client.load_host_keys(self.known_hosts)
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy() if self.accept_unknown_hosts else paramiko.RejectPolicy())
+        try:
+            client.connect(
+                target.ip, port=target.port, username=target.username or self.username,
+                password=self.password, key_filename=self.key_filename,
+                look_for_keys=self.password is None and self.key_filename is None, allow_agent=False,
+                timeout=timeout, banner_timeout=timeout, auth_timeout=timeout,
+            )
+        except Exception:
+            client.close()
+            raise
+        client.get_transport().set_keepalive(self.keepalive_seconds)
+        return ParamikoSession(client)
+
+
+class LocalSession:
+    def alive(self) -> bool:
+        return True
+
+    def run(self, command: str, timeout: float) -> str:
+        return subprocess.run(["sh", "-c", command], capture_output=True, text=True, timeout=timeout).stdout
+
+    def close(self) -> None:
+        pass
+
+
+class LocalConnector:
+    """Stand-in for SSH: runs the poll command on this machine, whatever the target."""
+
+    def connect(self, target: HostTarget, timeout: float) -> LocalSession:
+        return LocalSession()
+
+
+# -----------------------
+# Polling
+# -----------------------
+class _Host:
+    __slots__ = ("target", "session", "cpu", "boot_time", "counters", "next_due", "busy", "removed",
+                 "failures", "last_error", "last_poll_seconds")
+
+    def __init__(self, target: HostTarget, next_due: float):
+        self.target = target
+        self.session = None
+        self.cpu: Optional[Tuple[int, ...]] = None
+        self.boot_time: Optional[int] = None
+        self.counters: Dict[Tuple[str, str], Tuple[float, Dict[str, int]]] = {}
+        self.next_due = next_due
+        self.busy = False
+        self.removed = False
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_poll_seconds: Optional[float] = None
+
+    def rates(self, kind: str, name: str, current: Dict[str, int], now: float) -> Dict[str, float]:
+        """Per-second rates since the previous poll; empty for a first reading or a counter reset."""
+        previous = self.counters.get((kind, name))
+        self.counters[(kind, name)] = (now, current)
+        if previous is None:
+            return {}
+        then, old = previous
+        elapsed = now - then
+        if elapsed <= 0 or any(current[k] < old[k] for k in current):
+            return {}
+        return {f"{k}_per_sec": round((current[k] - old[k]) / elapsed, 3) for k in current}
+
+
+class SshPoller:
+    """Polls every target every ``interval`` seconds and hands the samples to ``sink`` in batches."""
+
+    def __init__(self, connector, sink: Callable[[List[Dict[str, Any]]], Awaitable[None]], interval: float = 30,
+                 workers: int = 64, timeout: float = 10, max_backoff: float = 600, flush_interval: float = 1):
+        self.connector = connector
+        self.sink = sink
+        self.interval = interval
+        self.workers = workers
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.flush_interval = flush_interval
+        self._hosts: Dict[str, _Host] = {}
+        self._pending: List[Dict[str, Any]] = []
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks: set = set()
+        self.polls = 0
+        self.failures = 0
+        self.samples = 0
+
+    def __len__(self) -> int:
+        return len(self._hosts)
+
+    def set_targets(self, targets: Iterable[HostTarget]) -> None:
+        """Replace the polled hosts; new hosts start at a random point of the interval."""
+        wanted = {t.ip: t for t in targets}
+        for ip, host in list(self._hosts.items()):
+            if wanted.get(ip) != host.target:
+                del self._hosts[ip]
+                host.removed = True
+                if not host.busy:
+                    self._close(host)
+        now = time.monotonic()
+        for ip, target in wanted.items():
+            if ip not in self._hosts:
+                self._hosts[ip] = _Host(target, now + random.uniform(0, self.interval))
+
+    def _close(self, host: _Host) -> None:
+        session, host.session = host.session, None
+        if session is not None and self._executor is not None:
+            self._executor.submit(session.close)
+
+    # Runs on a worker thread
+    def _collect(self, host: _Host) -> Dict[str, Any]:
+        started = time.monotonic()
+        if host.session is None or not host.session.alive():
+            host.session = None
+            host.session = self.connector.connect(host.target, self.timeout)
+        output = host.session.run(COLLECT_COMMAND, self.timeout)
+        now = time.monotonic()
+        sections = parse_sections(output)
+        if "/proc/stat" not in sections or "/proc/meminfo" not in sections:
+            raise PollError("No /proc data in command output")
+
+        times, cores, boot_time = cpu_times(sections["/proc/stat"])
+        if boot_time != host.boot_time:
+            # Rebooted (or first poll): every counter restarted, old baselines are meaningless
+            host.cpu = None
+            host.counters.clear()
+            host.boot_time = boot_time
+        sample: Dict[str, Any] = {"device_ip": host.target.ip, "timestamp": datetime.now(timezone.utc).isoformat()}
+        if host.cpu is not None and times is not None:
+            cpu = cpu_fields(host.cpu, times, sections.get("/proc/loadavg", []), cores)
+            if cpu is not None:
+                sample["cpu"] = cpu
+        host.cpu = times
+        memory = memory_fields(sections["/proc/meminfo"])
+        if memory is not None:
+            sample["memory"] = memory
+        sample["disk"] = [
+            {**d, **host.rates("disk", d["mount_point"], {k: d[k] for k in DISK_COUNTERS}, now)}
+            for d in disk_fields(sections)
+        ]
+        sample["network"] = [
+            {**n, **host.rates("net", n["interface_name"], {k: n[k] for k in NET_COUNTERS}, now)}
+            for n in network_fields(sections)
+        ]
+        host.last_poll_seconds = now - started
+        return sample
+
+    async def _poll(self, host: _Host) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            async with self._slots:
+                sample = await loop.run_in_executor(self._executor, self._collect, host)
+        except Exception as e:
+            self.failures += 1
+            host.failures += 1
+            host.last_error = f"{type(e).__name__}: {e}"
+            self._close(host)
+            if host.failures == 1:
+                logger.warning("SSH poll of %s failed: %s", host.target.ip, host.last_error)
+            backoff = min(self.interval * 2 ** (host.failures - 1), self.max_backoff)
+            host.next_due = time.monotonic() + backoff * random.uniform(0.75, 1.25)
+        else:
+            if host.failures:
+                logger.info("SSH poll of %s recovered after %d failures.", host.target.ip, host.failures)
+            self.polls += 1
+            host.failures = 0
+            host.last_error = None
+            self._pending.append(sample)
+            # Fixed rate: missed slots are skipped rather than bunched up
+            now = time.monotonic()
+            host.next_due += self.interval
+            if host.next_due <= now:
+                host.next_due += ((now - host.next_due) // self.interval + 1) * self.interval
+        finally:
+            host.busy = False
+            if host.removed:
+                self._close(host)
+
+    async def flush(self) -> None:
+        batch, self._pending = self._pending, []
+        if batch:
+            self.samples += len(batch)
+            await self.sink(batch)
+
+    async def run(self) -> None:
+        """Background task: start polls as hosts come due and flush their samples every ``flush_interval``."""
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ssh-poll")
+        self._slots = asyncio.Semaphore(self.workers)
+        try:
+            while True:
+                now = time.monotonic()
+                for host in self._hosts.values():
+                    if not host.busy and host.next_due <= now:
+                        host.busy = True
+                        task = asyncio.create_task(self._poll(host))
+                        self._tasks.add(task)
+                        task.add_done_callback(self._tasks.discard)
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.exception("Error writing polled samples: %s", e)
+                await asyncio.sleep(self.flush_interval)
+        finally:
+            for task in self._tasks:
+                task.cancel()
+            for host in self._hosts.values():
+                self._close(host)
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        failing = [h for h in self._hosts.values() if h.failures]
+        return {
+            "hosts": len(self._hosts),
+            "connected": sum(1 for h in self._hosts.values() if h.session is not None),
+            "in_flight": sum(1 for h in self._hosts.values() if h.busy),
+            "polls": self.polls,
+            "failures": self.failures,
+            "samples": self.samples,
+            "failing": [
+                {"ip": h.target.ip, "failures": h.failures, "last_error": h.last_error}
+                for h in sorted(failing, key=lambda h: -h.failures)[:20]
+            ],
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Poll hosts once or a few times and print the samples as JSON lines.")
+    parser.add_argument("hosts", nargs="*", help="host IPs (ignored with --local)")
+    parser.add_argument("--local", action="store_true", help="run the poll command on this machine instead of over SSH")
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--port", type=int, default=22)
+    parser.add_argument("--key", help="private key file")
+    parser.add_argument("--password")
+    parser.add_argument("--accept-unknown-hosts", action="store_true")
+    parser.add_argument("--interval", type=float, default=5)
+    parser.add_argument("--polls", type=int, default=2, help="stop after this many polls per host")
+    parser.add_argument("--timeout", type=float, default=10)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.local:
+        connector, targets = LocalConnector(), [HostTarget("127.0.0.1")]
+    else:
+        connector = ParamikoConnector(args.user, args.password, args.key, accept_unknown_hosts=args.accept_unknown_hosts)
+        targets = [HostTarget(ip, args.port) for ip in args.hosts]
+
+    async def main():
+        async def print_samples(samples):
+            for s in samples:
+                print(json.dumps(s))
+
+        poller = SshPoller(connector, print_samples, interval=args.interval, timeout=args.timeout, flush_interval=0.2)
+        poller.set_targets(targets)
+        task = asyncio.create_task(poller.run())
+        while poller.polls + poller.failures < args.polls * len(targets):
+            await asyncio.sleep(0.2)
+        await poller.flush()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        print(json.dumps(poller.stats()))
+
+    asyncio.run(main())
@@ -0,0 +1,134 @@
+# stream_ingest.py
+"""Persistent per-agent ingest channel over a WebSocket.
+
+An agent connects once, identifies its device in a hello message and then
+streams frames, each carrying a sequence number and a batch of samples:
+
+* text frame:   ``{"seq": n, "samples": [...]}`` (samples as in the JSON batch endpoint)
+* binary frame: ``seq:u64`` followed by a wire_format batch
+
+Every frame is answered, in order, with either
+
+* ``{"type": "ack", "seq": n, "accepted": a, "rejected": r, "errors": [...]}``
+  once its samples have been written (or rejected) — the agent can drop it, or
+* ``{"type": "nack", "seq": n, "detail": ..., "retry_after": s}`` when the
+  server could not take it — the agent keeps it and resends later.
+
+Flow control is a credit window: the server reads at most ``window`` frames
+ahead of the acks it has sent. Beyond that it stops reading, so TCP pushes
+back on the agent instead of frames piling up in server memory.
+"""
+import asyncio
+import json
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from wire_format import STREAM_FRAME_SEQ
+
+
+class StreamProtocolError(Exception):
+    """The peer broke the framing; the connection is closed with ``code``."""
+
+    def __init__(self, detail: str, code: int = 1007):
+        super().__init__(detail)
+        self.detail = detail
+        self.code = code
+
+
+class FrameResult(NamedTuple):
+    accepted: int
+    errors: List[Dict[str, Any]]  # {"index": i, "detail": ...} per rejected sample
+    written: Optional["asyncio.Future[bool]"] = None  # resolves once accepted samples are stored
+    retry_after: Optional[float] = None  # set when the frame was refused as a whole (nack)
+
+
+# (payload, is_binary) -> result; payload is the decoded JSON sample list or the raw wire_format batch
+FrameHandler = Callable[[Any, bool], Awaitable[FrameResult]]
+
+
+def parse_frame(message: Dict[str, Any]) -> Tuple[int, Any, bool]:
+    """(seq, payload, is_binary) of one received ASGI websocket message."""
+    data = message.get("bytes")
+    if data is not None:
+        if len(data) < STREAM_FRAME_SEQ.size:
+            raise StreamProtocolError("Binary frame shorter than its sequence number")
+        (seq,) = STREAM_FRAME_SEQ.unpack_from(data, 0)
+        return seq, memoryview(data)[STREAM_FRAME_SEQ.size:], True
+    try:
+        frame = json.loads(message.get("text") or "")
+    except ValueError:
+        raise StreamProtocolError("Text frame is not JSON")
+    if not isinstance(frame, dict) or not isinstance(frame.get("seq"), int) or not isinstance(frame.get("samples"), list):
+        raise StreamProtocolError('Text frame must be {"seq": int, "samples": [...]}')
+    return frame["seq"], frame["samples"], False
+
+
+class StreamStats:
+    def __init__(self):
+        self.connections = 0
+        self.opened = 0
+        self.frames = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.nacks = 0
+        self.protocol_errors = 0
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class StreamConnection:
+    """Reader/acker pair for one open channel."""
+
+    def __init__(self, websocket, handle_frame: FrameHandler, window: int, stats: StreamStats):
+        self.websocket = websocket
+        self.handle_frame = handle_frame
+        self.window = window
+        self.stats = stats
+        self._credit = asyncio.Semaphore(window)
+        self._pending: "asyncio.Queue[Tuple[int, FrameResult]]" = asyncio.Queue()
+
+    async def _acker(self) -> None:
+        """Answer frames in arrival order, each once its write has finished."""
+        while True:
+            seq, result = await self._pending.get()
+            written = True
+            if result.written is not None:
+                written = await result.written
+            if result.retry_after is not None or not written:
+                self.stats.nacks += 1
+                reply = {"type": "nack", "seq": seq, "detail": "Not stored, resend later",
+                         "retry_after": result.retry_after or 1}
+            else:
+                self.stats.accepted += result.accepted
+                self.stats.rejected += len(result.errors)
+                reply = {"type": "ack", "seq": seq, "accepted": result.accepted,
+                         "rejected": len(result.errors), "errors": result.errors}
+            await self.websocket.send_text(json.dumps(reply))
+            self._credit.release()
+
+    async def serve(self) -> None:
+        self.stats.connections += 1
+        self.stats.opened += 1
+        acker = asyncio.create_task(self._acker())
+        try:
+            while not acker.done():
+                await self._credit.acquire()
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                try:
+                    seq, payload, binary = parse_frame(message)
+                except StreamProtocolError as e:
+                    self.stats.protocol_errors += 1
+                    await self.websocket.close(code=e.code, reason=e.detail)
+                    return
+                self.stats.frames += 1
+                self._pending.put_nowait((seq, await self.handle_frame(payload, binary)))
+        finally:
+            self.stats.connections -= 1
+            acker.cancel()
+            # Unacked frames are simply resent by the agent after it reconnects
+            while not self._pending.empty():
+                _, result = self._pending.get_nowait()
+                if result.written is not None:
+                    result.written.cancel()
@@ -0,0 +1,158 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from alert_engine import AlertEngine, Rule
+
+T0 = datetime(2026, 10, 17, 12, 0, tzinfo=timezone.utc)
+TAGS = {1: ("prod",), 2: ()}
+
+
+def rule(**overrides):
+    fields = dict(id=1, name="High CPU", family="cpu", field="cpu_usage_percent", op=">", threshold=90.0,
+                  for_seconds=0.0, rate=False, tags=(), instance=None, severity="warning")
+    fields.update(overrides)
+    return Rule(**fields)
+
+
+def engine(*rules):
+    e = AlertEngine(lambda device_id: TAGS.get(device_id, ()))
+    e.set_rules(rules)
+    return e
+
+
+def cpu(seconds, value, device_id=1):
+    return {"device_id": device_id, "timestamp": T0 + timedelta(seconds=seconds), "cpu_usage_percent": value}
+
+
+def net(seconds, errors_in=None, per_sec=None, interface="eth0"):
+    return {"device_id": 1, "timestamp": T0 + timedelta(seconds=seconds), "interface_name": interface,
+            "errors_in": errors_in, "errors_in_per_sec": per_sec}
+
+
+def states(e):
+    return [(t.state, t.device_id, t.instance, t.at) for t in e.take_transitions()]
+
+
+def test_fires_immediately_without_duration():
+    e = engine(rule())
+    e.observe("cpu", [cpu(0, 50), cpu(10, 95)])
+    assert states(e) == [("firing", 1, "", T0 + timedelta(seconds=10))]
+
+
+def test_pending_until_duration_elapses():
+    e = engine(rule(for_seconds=60))
+    e.observe("cpu", [cpu(0, 95), cpu(30, 96), cpu(59, 97)])
+    assert states(e) == []
+    e.observe("cpu", [cpu(60, 98)])
+    # Reported as firing since the breach started
+    [transition] = e.take_transitions()
+    assert transition.state == "firing" and transition.at == T0
+    assert transition.value == 98
+    # Still breaching: no second firing
+    e.observe("cpu", [cpu(90, 99)])
+    assert states(e) == []
+
+
+def test_breach_interrupted_restarts_window():
+    e = engine(rule(for_seconds=60))
+    e.observe("cpu", [cpu(0, 95), cpu(40, 50), cpu(50, 95), cpu(100, 95)])
+    assert states(e) == []
+    e.observe("cpu", [cpu(110, 95)])
+    assert states(e) == [("firing", 1, "", T0 + timedelta(seconds=50))]
+
+
+def test_resolves_on_first_good_sample():
+    e = engine(rule())
+    e.observe("cpu", [cpu(0, 95)])
+    e.take_transitions()
+    e.observe("cpu", [cpu(10, 40), cpu(20, 30)])
+    assert states(e) == [("resolved", 1, "", T0 + timedelta(seconds=10))]
+    assert e.stats()["firing"] == 0 and e.fired == 1 and e.resolved == 1
+
+
+def test_late_and_duplicate_samples_ignored():
+    e = engine(rule())
+    e.observe("cpu", [cpu(10, 50), cpu(5, 99), cpu(10, 99)])
+    assert states(e) == []
+
+
+def test_rules_match_device_tags():
+    e = engine(rule(tags=("prod",)))
+    e.observe("cpu", [cpu(0, 95, device_id=2)])
+    assert states(e) == []
+    e.observe("cpu", [cpu(0, 95, device_id=1)])
+    assert [t[1] for t in states(e)] == [1]
+
+
+def test_rate_from_counter_pairs():
+    e = engine(rule(family="network", field="errors_in", threshold=5.0, rate=True))
+    e.observe("network", [net(0, errors_in=100), net(10, errors_in=140)])
+    assert states(e) == []  # 4/s
+    e.observe("network", [net(20, errors_in=200)])
+    [transition] = e.take_transitions()
+    assert transition.instance == "eth0" and transition.value == pytest.approx(6.0)
+
+
+def test_rate_on_counter_reset_uses_per_sec_field():
+    e = engine(rule(family="network", field="errors_in", threshold=5.0, rate=True))
+    e.observe("network", [net(0, errors_in=10_000), net(10, errors_in=10_010)])
+    assert states(e) == []
+    # The counter went backwards (reboot): no negative or huge rate, the agent's own rate is used
+    e.observe("network", [net(20, errors_in=3, per_sec=0.5)])
+    assert states(e) == []
+    e.observe("network", [net(30, errors_in=5, per_sec=9.0)])
+    assert states(e) == []  # counter pair available again: (5 - 3) / 10 = 0.2/s
+    e.observe("network", [net(40, errors_in=None, per_sec=9.0)])
+    [transition] = e.take_transitions()
+    assert transition.value == pytest.approx(9.0)
+
+
+def test_rate_first_reading_without_per_sec_is_skipped():
+    e = engine(rule(family="network", field="errors_in", threshold=0.0, rate=True))
+    e.observe("network", [net(0, errors_in=100)])
+    assert states(e) == [] and e.evaluated == 0
+
+
+def test_instance_filter_and_series_per_instance():
+    e = engine(rule(family="network", field="errors_in_per_sec", threshold=1.0, instance="eth1"))
+    e.observe("network", [net(0, per_sec=5.0, interface="eth0"), net(0, per_sec=5.0, interface="eth1")])
+    assert [t[2] for t in states(e)] == ["eth1"]
+
+
+def test_restore_resolves_instead_of_refiring():
+    e = engine(rule())
+    e.restore(1, 1, "", T0)
+    e.restore(99, 1, "", T0)  # unknown rule
+    e.observe("cpu", [cpu(10, 95)])
+    assert states(e) == []
+    e.observe("cpu", [cpu(20, 10)])
+    assert states(e) == [("resolved", 1, "", T0 + timedelta(seconds=20))]
+
+
+def test_changed_rule_restarts_window_and_removed_rule_drops_series():
+    e = engine(rule(for_seconds=60))
+    e.observe("cpu", [cpu(0, 95)])
+    e.set_rules([rule(for_seconds=30)])
+    e.observe("cpu", [cpu(40, 95)])
+    assert states(e) == []  # the breach restarted at 40s
+    e.observe("cpu", [cpu(70, 95)])
+    assert states(e) == [("firing", 1, "", T0 + timedelta(seconds=40))]
+    e.set_rules([])
+    assert len(e) == 0
+
+
+def test_prune_keeps_firing_series():
+    e = engine(rule())
+    e.observe("cpu", [cpu(0, 95), cpu(0, 50, device_id=2)])
+    e.prune(T0 + timedelta(hours=1))
+    assert len(e) == 1 and e.stats()["firing"] == 1
+
+
+def test_requeue_puts_transitions_first():
+    e = engine(rule())
+    e.observe("cpu", [cpu(0, 95)])
+    first = e.take_transitions()
+    e.observe("cpu", [cpu(10, 10)])
+    e.requeue(first)
+    assert [t.state for t in e.take_transitions()] == ["firing", "resolved"]
@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+import device_cache
+from device_cache import DeviceCache, DeviceCacheListener, notify_payload, worker_id
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(device_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_hit_and_miss_stats(clock):
+    cache = DeviceCache()
+    assert cache.get("10.0.0.1") is None
+    cache.put("10.0.0.1", 1, "online")
+    assert cache.get("10.0.0.1").id == 1
+    assert cache.get("10.0.0.1").status == "online"
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_ratio"]) == (2, 1, 0.6667)
+
+
+def test_evicts_least_recently_used(clock):
+    cache = DeviceCache(max_size=2)
+    cache.put("a", 1, None)
+    cache.put("b", 2, None)
+    cache.get("a")  # b is now the least recently used
+    cache.put("c", 3, None)
+    assert cache.get("b") is None
+    assert cache.get("a").id == 1 and cache.get("c").id == 3
+    assert cache.evictions == 1 and len(cache) == 2
+
+
+def test_put_refreshes_recency(clock):
+    cache = DeviceCache(max_size=2)
+    cache.put("a", 1, None)
+    cache.put("b", 2, None)
+    cache.put("a", 1, "online")
+    cache.put("c", 3, None)
+    assert cache.get("b") is None and cache.get("a").status == "online"
+
+
+def test_ttl_expiry(clock):
+    cache = DeviceCache(ttl_seconds=300)
+    cache.put("a", 1, None)
+    clock[0] += 300
+    assert cache.get("a") is not None
+    clock[0] += 1
+    assert cache.get("a") is None
+    assert len(cache) == 0 and cache.misses == 1
+
+
+def test_set_status_keeps_expiry(clock):
+    cache = DeviceCache(ttl_seconds=10)
+    cache.put("a", 1, "offline")
+    clock[0] += 5
+    cache.set_status("a", "online")
+    cache.set_status("missing", "online")
+    assert cache.get("a").status == "online"
+    clock[0] += 6
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_invalidate(clock):
+    cache = DeviceCache()
+    cache.put("a", 1, None)
+    cache.put("b", 2, None)
+    cache.invalidate("a")
+    cache.invalidate("unknown")
+    assert cache.get("a") is None and cache.invalidations == 1
+    cache.invalidate(device_cache.INVALIDATE_ALL)
+    assert len(cache) == 0 and cache.invalidations == 2
+
+
+def test_listener_ignores_own_notifications(clock):
+    cache = DeviceCache()
+    cache.put("10.0.0.1", 1, None)
+    cache.put("::1", 2, None)
+    listener = DeviceCacheListener("postgresql://unused", cache)
+    listener._on_notify(None, 0, device_cache.NOTIFY_CHANNEL, notify_payload("10.0.0.1"))
+    assert cache.get("10.0.0.1") is not None
+    # Another worker, possibly with the same pid in another container
+    listener._on_notify(None, os.getpid(), device_cache.NOTIFY_CHANNEL, f"{os.getpid()}:10.0.0.1")
+    assert cache.get("10.0.0.1") is None
+    # IPv6 addresses contain the separator; only the first one splits
+    listener._on_notify(None, 0, device_cache.NOTIFY_CHANNEL, "other-worker:::1")
+    assert cache.get("::1") is None
+
+
+def test_worker_id_is_random_and_stable():
+    assert worker_id() == worker_id()
+    assert len(worker_id()) == 32 and worker_id() != str(os.getpid())
+
+
+def test_worker_id_changes_after_fork(monkeypatch):
+    before = worker_id()
+    monkeypatch.setattr(device_cache.os, "getpid", lambda: -1)
+    assert worker_id() != before
@@ -0,0 +1,106 @@
+import json
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from fleet_snapshot import FleetSnapshot
+
+T0 = datetime(2026, 10, 17, 12, 0, tzinfo=timezone.utc)
+
+
+def snapshot():
+    s = FleetSnapshot()
+    s.upsert_device(1, "web-1", "10.0.0.1", "online", ["prod", "web"], T0)
+    s.upsert_device(2, "db-1", "10.0.0.2", "online", ["prod"], T0)
+    return s
+
+
+def cpu(device_id, seconds, value):
+    return {"device_id": device_id, "timestamp": T0 + timedelta(seconds=seconds), "cpu_usage_percent": value}
+
+
+def disk(device_id, seconds, mount, used):
+    return {"device_id": device_id, "timestamp": T0 + timedelta(seconds=seconds), "mount_point": mount,
+            "used_gb": used, "free_gb": None}
+
+
+def test_etag_is_weak_and_changes_on_update():
+    s = snapshot()
+    before = s.etag
+    assert before.startswith('W/"')
+    s.apply_rows("cpu", [cpu(1, 10, 5.0)])
+    assert s.etag != before
+
+
+def test_etag_stable_when_nothing_changes():
+    s = snapshot()
+    s.apply_rows("cpu", [cpu(1, 10, 5.0)])
+    etag = s.etag
+    # Periodic reloads re-apply the same rows and device metadata
+    s.apply_rows("cpu", [cpu(1, 10, 5.0), cpu(1, 5, 1.0)])
+    s.upsert_device(1, "web-1", "10.0.0.1", "online", ["prod", "web"], T0)
+    s.set_status(1, "online")
+    s.prune(T0)
+    assert s.etag == etag
+
+
+def test_etag_differs_between_processes():
+    assert FleetSnapshot().etag != FleetSnapshot().etag
+
+
+def test_status_and_touch_change_etag():
+    s = snapshot()
+    etag = s.etag
+    s.set_status(1, "offline")
+    assert s.etag != etag
+    etag = s.etag
+    s.touch({1: T0 + timedelta(seconds=30)})
+    assert s.etag != etag and s.status(1) == "online"
+
+
+def test_render_cached_until_update():
+    s = snapshot()
+    s.apply_rows("cpu", [cpu(1, 10, 5.0)])
+    body = s.render()
+    assert s.render() is body
+    s.apply_rows("cpu", [cpu(1, 20, 7.5)])
+    fresh = s.render()
+    assert fresh is not body
+    assert json.loads(fresh)["devices"][0]["cpu"]["cpu_usage_percent"] == 7.5
+
+
+def test_render_cache_per_tag_filter():
+    s = snapshot()
+    everyone, web = json.loads(s.render()), json.loads(s.render(["web"]))
+    assert everyone["count"] == 2 and web["count"] == 1
+    assert s.render(["web", "prod"]) is s.render(["prod", "web"])
+    s.upsert_device(2, "db-1", "10.0.0.2", "online", ["prod", "web"], T0)
+    assert json.loads(s.render(["web"]))["count"] == 2
+    # Bodies of old versions are gone
+    assert all(key[0] == s.version for key in s._rendered)
+
+
+def test_render_cache_is_bounded():
+    s = FleetSnapshot(max_cached_responses=2)
+    for tag in ("a", "b", "c"):
+        s.render([tag])
+    assert len(s._rendered) == 2
+
+
+def test_rows_merge_newest_per_key():
+    s = snapshot()
+    s.apply_rows("disk", [disk(1, 10, "/", Decimal("10.5")), disk(1, 10, "/data", 1.0)])
+    s.apply_rows("disk", [{**disk(1, 20, "/", None), "free_gb": 90.0}])
+    body = json.loads(s.render())
+    mounts = body["devices"][0]["disk"]
+    assert [m["mount_point"] for m in mounts] == ["/", "/data"]
+    # Fields a newer row leaves out keep their previous value
+    assert mounts[0]["used_gb"] == 10.5 and mounts[0]["free_gb"] == 90.0
+
+
+def test_prune_drops_stale_mounts():
+    s = snapshot()
+    s.apply_rows("disk", [disk(1, 0, "/old", 1.0), disk(1, 100, "/", 1.0)])
+    etag = s.etag
+    s.prune(T0 + timedelta(seconds=50))
+    assert s.etag != etag
+    assert [m["mount_point"] for m in json.loads(s.render())["devices"][0]["disk"]] == ["/"]
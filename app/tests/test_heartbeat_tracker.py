@@ -0,0 +1,81 @@
+import math
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from heartbeat_tracker import THRESHOLD_FIELD, HeartbeatTracker, resolve_threshold
+
+T0 = datetime(2026, 10, 17, 12, 0, tzinfo=timezone.utc)
+BY_TAG = {"edge": 600.0, "core": 60.0}
+
+
+def test_threshold_override_wins():
+    assert resolve_threshold(["core"], {THRESHOLD_FIELD: 30}, BY_TAG, 300) == 30.0
+    assert resolve_threshold([], {THRESHOLD_FIELD: "45.5"}, BY_TAG, 300) == 45.5
+
+
+def test_strictest_tag_then_default():
+    assert resolve_threshold(["edge", "core", "other"], {}, BY_TAG, 300) == 60.0
+    assert resolve_threshold(["edge"], None, BY_TAG, 300) == 600.0
+    assert resolve_threshold(None, None, BY_TAG, 300) == 300.0
+    assert resolve_threshold([None, 3], None, BY_TAG, 300) == 300.0
+
+
+@pytest.mark.parametrize("bad", ["soon", "", None, [], {}, True, -5, 0, math.nan, math.inf, "nan", "-inf"])
+def test_invalid_override_falls_back(bad):
+    assert resolve_threshold(["core"], {THRESHOLD_FIELD: bad}, BY_TAG, 300) == 60.0
+    assert resolve_threshold([], {THRESHOLD_FIELD: bad}, BY_TAG, 300) == 300.0
+
+
+def test_custom_fields_not_a_dict():
+    assert resolve_threshold([], ["not", "a", "dict"], BY_TAG, 300) == 300.0
+
+
+def test_expires_in_deadline_order():
+    tracker = HeartbeatTracker(60)
+    tracker.set_threshold(1, 30)
+    tracker.set_threshold(2, 60)
+    tracker.beat(1, T0)
+    tracker.beat(2, T0)
+    assert tracker.next_deadline() == (T0 + timedelta(seconds=30)).timestamp()
+    assert tracker.expired(T0 + timedelta(seconds=29)) == []
+    assert tracker.expired(T0 + timedelta(seconds=45)) == [(1, 30)]
+    assert tracker.expired(T0 + timedelta(seconds=90)) == [(2, 60)]
+    assert len(tracker) == 0 and tracker.next_deadline() is None
+
+
+def test_heartbeat_pushes_deadline_back():
+    tracker = HeartbeatTracker(60)
+    tracker.set_threshold(1, 60)
+    tracker.beat(1, T0)
+    tracker.beat(1, T0 + timedelta(seconds=50))
+    # The superseded deadline at T0+60 is skipped
+    assert tracker.expired(T0 + timedelta(seconds=70)) == []
+    assert tracker.expired(T0 + timedelta(seconds=110)) == [(1, 60)]
+
+
+def test_late_heartbeat_does_not_move_deadline_back():
+    tracker = HeartbeatTracker(60)
+    tracker.set_threshold(1, 60)
+    tracker.beat(1, T0 + timedelta(seconds=50))
+    tracker.beat(1, T0)
+    assert tracker.next_deadline() == (T0 + timedelta(seconds=110)).timestamp()
+
+
+def test_set_threshold_rearms_from_last_heartbeat():
+    tracker = HeartbeatTracker(300)
+    tracker.beat(1, T0)
+    assert tracker.take_unresolved() == [1]
+    assert tracker.take_unresolved() == []
+    tracker.set_threshold(1, 20)
+    assert tracker.expired(T0 + timedelta(seconds=21)) == [(1, 20)]
+
+
+def test_forget_and_heap_compaction():
+    tracker = HeartbeatTracker(60)
+    tracker.set_threshold(1, 60)
+    for i in range(500):
+        tracker.beat(1, T0 + timedelta(seconds=i))
+    assert tracker.stats()["heap_size"] <= 4 * len(tracker) + 64
+    tracker.forget(1)
+    assert tracker.expired(T0 + timedelta(days=1)) == []
@@ -0,0 +1,186 @@
+import asyncio
+
+import pytest
+
+from ingest_buffer import BufferedSample, IngestBuffer
+
+
+class Poisoned(Exception):
+    """What the database raises for a value it cannot store."""
+
+
+class Writer:
+    """Fake flush_fn: refuses any batch containing a poisoned sample, optionally after being down for a while."""
+
+    def __init__(self, poisoned=(), down_for=0):
+        self.poisoned = set(poisoned)
+        self.down_for = down_for
+        self.written = []
+        self.calls = 0
+
+    async def __call__(self, batch):
+        self.calls += 1
+        if self.down_for > 0:
+            self.down_for -= 1
+            raise ConnectionError("database unreachable")
+        if any(s.ip in self.poisoned for s in batch):
+            raise Poisoned("numeric field overflow")
+        self.written += [s.ip for s in batch]
+
+
+def make_samples(n, loop):
+    return [BufferedSample(1, f"s{i}", i, {}, 2, False, loop.create_future(), (i,)) for i in range(n)]
+
+
+def make_buffer(writer, dropped, **kwargs):
+    return IngestBuffer(writer, flush_interval_ms=20, retry_backoff_seconds=0.001,
+                        is_permanent=lambda e: isinstance(e, Poisoned), on_drop=dropped.extend, **kwargs)
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+
+def test_flushes_and_resolves_acks():
+    async def scenario():
+        writer, dropped = Writer(), []
+        buffer = make_buffer(writer, dropped)
+        buffer.start()
+        samples = make_samples(5, asyncio.get_running_loop())
+        assert all(buffer.offer(s) for s in samples)
+        assert await asyncio.gather(*(s.ack for s in samples)) == [True] * 5
+        await buffer.stop()
+        return writer, dropped, buffer.stats()
+
+    writer, dropped, stats = run(scenario())
+    assert writer.written == [f"s{i}" for i in range(5)]
+    assert dropped == []
+    assert stats["flushed_samples"] == 5 and stats["flushed_rows"] == 10 and stats["flush_errors"] == 0
+
+
+def test_poisoned_sample_is_isolated_and_dropped():
+    async def scenario():
+        writer, dropped = Writer(poisoned={"s6"}), []
+        buffer = make_buffer(writer, dropped)
+        buffer.start()
+        samples = make_samples(11, asyncio.get_running_loop())
+        for s in samples:
+            buffer.offer(s)
+        acks = await asyncio.gather(*(s.ack for s in samples))
+        await buffer.stop()
+        return writer, dropped, acks, buffer.stats()
+
+    writer, dropped, acks, stats = run(scenario())
+    assert acks == [i != 6 for i in range(11)]
+    assert sorted(writer.written) == sorted(f"s{i}" for i in range(11) if i != 6)
+    assert [s.ip for s in dropped] == ["s6"]
+    assert stats["dropped_samples"] == 1 and stats["dropped_rows"] == 2
+    assert stats["flush_errors"] == 3  # whole-batch attempts before splitting
+    assert stats["inflight"] == 0
+
+
+def test_whole_batch_retried_before_splitting():
+    async def scenario():
+        writer, dropped = Writer(down_for=2), []
+        buffer = make_buffer(writer, dropped, split_after_failures=3)
+        buffer.start()
+        samples = make_samples(4, asyncio.get_running_loop())
+        for s in samples:
+            buffer.offer(s)
+        acks = await asyncio.gather(*(s.ack for s in samples))
+        await buffer.stop()
+        return writer, dropped, acks, buffer.stats()
+
+    writer, dropped, acks, stats = run(scenario())
+    assert acks == [True] * 4
+    assert writer.calls == 3 and stats["flushes"] == 1
+    assert dropped == []
+
+
+def test_transient_error_while_splitting_keeps_the_rest():
+    async def scenario():
+        writer, dropped = Writer(poisoned={"s1"}), []
+        buffer = make_buffer(writer, dropped, split_after_failures=1)
+        loop = asyncio.get_running_loop()
+        samples = make_samples(4, loop)
+        buffer._inflight = list(samples)
+        flush = writer.__call__
+
+        async def flaky(batch):
+            # The database goes away once the first half has been dealt with
+            if any(s.ip in ("s2", "s3") for s in batch) and writer.written:
+                raise ConnectionError("database unreachable")
+            await flush(batch)
+
+        buffer.flush_fn = flaky
+        with pytest.raises(ConnectionError):
+            await buffer._split_flush()
+        return writer, dropped, buffer, samples
+
+    writer, dropped, buffer, samples = run(scenario())
+    assert writer.written == ["s0"]
+    assert [s.ip for s in dropped] == ["s1"]
+    # Written and dropped samples left; the rest waits for the next retry
+    assert [s.ip for s in buffer._inflight] == ["s2", "s3"]
+    assert samples[0].ack.result() is True and samples[1].ack.result() is False
+    assert not samples[2].ack.done()
+
+
+def test_stop_flushes_queued_samples():
+    async def scenario():
+        writer, dropped = Writer(), []
+        buffer = make_buffer(writer, dropped, flush_max_rows=4)
+        samples = make_samples(5, asyncio.get_running_loop())
+        for s in samples:
+            buffer.offer(s)
+        # Never started: everything is still queued when stop() runs
+        await buffer.stop()
+        return writer, samples, buffer.stats()
+
+    writer, samples, stats = run(scenario())
+    assert writer.written == [f"s{i}" for i in range(5)]
+    assert all(s.ack.result() for s in samples)
+    assert writer.calls == 3  # chunks of flush_max_rows rows
+    assert stats["depth"] == 0
+
+
+def test_stop_saves_what_it_can_and_gives_up_on_the_rest():
+    async def scenario():
+        writer, dropped = Writer(poisoned={"s2"}), []
+        buffer = make_buffer(writer, dropped)
+        samples = make_samples(4, asyncio.get_running_loop())
+        for s in samples:
+            buffer.offer(s)
+        await buffer.stop()
+        return writer, dropped, samples
+
+    writer, dropped, samples = run(scenario())
+    assert sorted(writer.written) == ["s0", "s1", "s3"]
+    assert [s.ip for s in dropped] == ["s2"]
+    assert [s.ack.result() for s in samples] == [True, True, False, True]
+
+
+def test_stop_gives_up_when_database_is_down():
+    async def scenario():
+        writer, dropped = Writer(down_for=100), []
+        buffer = make_buffer(writer, dropped)
+        samples = make_samples(3, asyncio.get_running_loop())
+        for s in samples:
+            buffer.offer(s)
+        await buffer.stop()
+        return dropped, samples
+
+    dropped, samples = run(scenario())
+    assert [s.ip for s in dropped] == ["s0", "s1", "s2"]
+    assert [s.ack.result() for s in samples] == [False, False, False]
+
+
+def test_full_queue_rejects():
+    async def scenario():
+        buffer = make_buffer(Writer(), [], max_samples=2)
+        samples = make_samples(3, asyncio.get_running_loop())
+        return [buffer.offer(s) for s in samples], buffer.stats()
+
+    offered, stats = run(scenario())
+    assert offered == [True, True, False]
+    assert stats["rejected"] == 1
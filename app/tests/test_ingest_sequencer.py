@@ -0,0 +1,152 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from ingest_sequencer import IngestSequencer, _Ranges
+
+T0 = datetime(2026, 10, 17, 12, 0, tzinfo=timezone.utc)
+
+
+def ranges_of(*values):
+    ranges = _Ranges()
+    for value in values:
+        ranges.add(value)
+    return list(zip(ranges.starts, ranges.ends))
+
+
+def test_ranges_merge_adjacent():
+    assert ranges_of(1, 2, 3) == [(1, 3)]
+    assert ranges_of(3, 2, 1) == [(1, 3)]
+
+
+def test_ranges_bridge_gap():
+    assert ranges_of(1, 3) == [(1, 1), (3, 3)]
+    assert ranges_of(1, 3, 2) == [(1, 3)]
+    assert ranges_of(1, 2, 5, 6, 3, 4) == [(1, 6)]
+
+
+def test_ranges_overlapping_add_is_noop():
+    assert ranges_of(1, 2, 3, 2, 1, 3) == [(1, 3)]
+    assert ranges_of(10, 20, 10, 20) == [(10, 10), (20, 20)]
+
+
+def test_ranges_contains():
+    ranges = _Ranges()
+    for value in (5, 6, 7, 10):
+        ranges.add(value)
+    assert [v in ranges for v in (4, 5, 7, 8, 9, 10, 11)] == [False, True, True, False, False, True, False]
+
+
+def test_ranges_trim_forgets_oldest():
+    ranges = _Ranges()
+    for value in (1, 3, 5, 7):
+        ranges.add(value)
+    ranges.trim(2)
+    assert list(zip(ranges.starts, ranges.ends)) == [(5, 5), (7, 7)]
+    assert 1 not in ranges and 7 in ranges
+
+
+def test_duplicates_only_after_commit():
+    seq = IngestSequencer()
+    assert not seq.is_duplicate("10.0.0.1", 1)
+    seq.commit("10.0.0.1", [1, 2, None])
+    assert seq.is_duplicate("10.0.0.1", 1)
+    assert seq.is_duplicate("10.0.0.1", 2)
+    assert not seq.is_duplicate("10.0.0.1", 3)
+    assert not seq.is_duplicate("10.0.0.2", 1)
+    assert not seq.is_duplicate("10.0.0.1", None)
+    assert seq.duplicates == 2
+
+
+def test_duplicates_after_agent_restart():
+    seq = IngestSequencer()
+    ip = "10.0.0.1"
+    # First run: live samples 1000..1009 written, 1010..1014 only spooled
+    seq.commit(ip, range(1000, 1010))
+    # Restarted agent numbers from a later clock reading; its live samples arrive before the spool replay
+    seq.commit(ip, range(5000, 5003))
+    assert not seq.is_duplicate(ip, 5003)
+    assert [seq.is_duplicate(ip, s) for s in (1008, 1009, 1010, 1014)] == [True, True, False, False]
+    seq.commit(ip, range(1010, 1015))
+    # The replayed spool is retried after a lost response: everything is a duplicate now
+    assert all(seq.is_duplicate(ip, s) for s in range(1000, 1015))
+    assert seq.stats()["seq_ranges"] == 2
+
+
+def test_forgotten_devices_let_seqs_through():
+    seq = IngestSequencer(max_devices=2)
+    for ip in ("a", "b", "c"):
+        seq.commit(ip, [1])
+    assert len(seq) == 2
+    assert not seq.is_duplicate("a", 1)
+    assert seq.is_duplicate("c", 1)
+
+
+def test_offset_within_tolerance_is_zero():
+    seq = IngestSequencer(tolerance_seconds=10)
+    assert seq.offset("10.0.0.1", T0 - timedelta(seconds=3), T0) == 0.0
+    assert seq.offset("10.0.0.1", T0 + timedelta(seconds=9), T0 + timedelta(seconds=30)) == 0.0
+    assert seq.offset_changes == 0
+
+
+@pytest.mark.parametrize("skew", [120, -120])
+def test_offset_corrects_skewed_clock(skew):
+    seq = IngestSequencer(tolerance_seconds=10)
+    # An agent clock running ``skew`` seconds behind: every newest sample looks ``skew`` seconds old
+    offset = seq.offset("10.0.0.1", T0 - timedelta(seconds=skew), T0)
+    assert offset == pytest.approx(skew)
+    assert seq.offset_changes == 1
+
+
+def test_offset_uses_freshest_arrival():
+    seq = IngestSequencer(tolerance_seconds=10)
+    ip = "10.0.0.1"
+    assert seq.offset(ip, T0 - timedelta(seconds=60), T0) == pytest.approx(60)
+    # A delivery that spent longer in transit (or a replay) does not raise the estimate
+    assert seq.offset(ip, T0 - timedelta(seconds=20), T0 + timedelta(seconds=40)) == pytest.approx(60)
+    # A fresher one lowers it
+    assert seq.offset(ip, T0 + timedelta(seconds=30), T0 + timedelta(seconds=60)) == pytest.approx(30)
+
+
+def test_offset_moves_only_beyond_tolerance():
+    seq = IngestSequencer(tolerance_seconds=10, window_seconds=60)
+    ip = "10.0.0.1"
+    assert seq.offset(ip, T0 - timedelta(seconds=100), T0) == pytest.approx(100)
+    # Drift within tolerance keeps the applied offset, so retries get the same timestamps
+    now = T0 + timedelta(seconds=120)
+    assert seq.offset(ip, now - timedelta(seconds=95), now) == pytest.approx(100)
+    now += timedelta(seconds=120)
+    assert seq.offset(ip, now - timedelta(seconds=85), now) == pytest.approx(85)
+    assert seq.offset_changes == 2
+
+
+def test_offset_window_expires_old_lags():
+    seq = IngestSequencer(tolerance_seconds=10, window_seconds=60)
+    ip = "10.0.0.1"
+    assert seq.offset(ip, T0 - timedelta(seconds=5), T0) == 0.0
+    # Within the window the old, fresher arrival keeps the estimate at zero
+    now = T0 + timedelta(seconds=30)
+    assert seq.offset(ip, now - timedelta(seconds=50), now) == 0.0
+    # Once it has aged out, the clock is found to be behind
+    now = T0 + timedelta(seconds=120)
+    assert seq.offset(ip, now - timedelta(seconds=50), now) == pytest.approx(50)
+
+
+def test_pending_seqs_are_duplicates_until_released():
+    seq = IngestSequencer()
+    seq.reserve("10.0.0.1", [7, None])
+    # A retry arriving while the first copy waits to be written
+    assert seq.is_duplicate("10.0.0.1", 7)
+    seq.release("10.0.0.1", [7])
+    assert not seq.is_duplicate("10.0.0.1", 7)
+    assert seq.stats()["pending_seqs"] == 0
+
+
+def test_commit_turns_pending_into_seen():
+    seq = IngestSequencer()
+    seq.reserve("10.0.0.1", [7, 8])
+    seq.commit("10.0.0.1", [7, 8])
+    # Releasing after a successful write does not forget it
+    seq.release("10.0.0.1", [7, 8])
+    assert seq.is_duplicate("10.0.0.1", 7) and seq.is_duplicate("10.0.0.1", 8)
+    assert seq.stats()["pending_seqs"] == 0
@@ -0,0 +1,132 @@
+import asyncio
+import json
+
+import live_push
+from device_cache import worker_id
+from live_push import LiveHub, LivePushRelay, Subscriber, Subscription, _split
+
+TAGS = {1: ("prod",), 2: ("lab",)}
+
+
+def hub(max_events=3):
+    return LiveHub(lambda device_id: TAGS.get(device_id, ()), max_events=max_events)
+
+
+def metrics(device_id, family, n_rows=1, value=0):
+    rows = [{"timestamp": f"2026-10-17T12:00:{i:02d}", "value": value, "pad": "x" * 40} for i in range(n_rows)]
+    return {"type": "metrics", "device_id": device_id, "ip": f"10.0.0.{device_id}", "family": family, "rows": rows}
+
+
+def drain(subscriber):
+    return asyncio.run(subscriber.next(0.01))
+
+
+def test_subscription_filters():
+    tags_of = lambda d: TAGS.get(d, ())
+    assert Subscription().matches(1, "cpu", tags_of)
+    assert not Subscription(device_ids=frozenset({2})).matches(1, "cpu", tags_of)
+    assert not Subscription(tags=("lab",)).matches(1, "cpu", tags_of)
+    only_cpu = Subscription(families=frozenset({"cpu"}))
+    assert not only_cpu.matches(1, "disk", tags_of)
+    assert only_cpu.matches(1, None, tags_of)  # status events always pass
+
+
+def test_events_delivered_in_order_below_capacity():
+    h = hub()
+    sub = h.subscribe(Subscription())
+    h.publish(("metrics", 1, "cpu"), metrics(1, "cpu", value=1))
+    h.publish(("metrics", 1, "cpu"), metrics(1, "cpu", value=2))
+    bodies = drain(sub)
+    assert [json.loads(b)["rows"][0]["value"] for b in bodies] == [1, 2]
+    assert not sub.coalescing and sub.take_dropped() == 0
+    assert drain(sub) is None
+
+
+def test_full_buffer_coalesces_repeated_device_events():
+    h = hub()
+    sub = h.subscribe(Subscription())
+    for value in range(5):
+        h.publish(("metrics", 1, "cpu"), metrics(1, "cpu", value=value))
+    h.publish(("metrics", 2, "cpu"), metrics(2, "cpu", value=9))
+    h.publish_status(1, "10.0.0.1", "offline", "2026-10-17T12:01:00")
+    assert sub.coalescing
+    events = [json.loads(b) for b in drain(sub)]
+    # Only the newest event per (kind, device, family) survives, the rest are counted
+    assert [(e["type"], e["device_id"]) for e in events] == [("metrics", 1), ("metrics", 2), ("status", 1)]
+    assert events[0]["rows"][0]["value"] == 4
+    assert sub.take_dropped() == 4 and sub.take_dropped() == 0
+    # Drained: back to full fidelity
+    assert not sub.coalescing
+    h.publish(("metrics", 1, "cpu"), metrics(1, "cpu"))
+    h.publish(("metrics", 1, "cpu"), metrics(1, "cpu"))
+    assert len(drain(sub)) == 2
+
+
+def test_body_encoded_once_for_all_subscribers():
+    h = hub()
+    a, b = h.subscribe(Subscription()), h.subscribe(Subscription(tags=("prod",)))
+    c = h.subscribe(Subscription(tags=("lab",)))
+    h.publish(("metrics", 1, "cpu"), metrics(1, "cpu"))
+    assert drain(a)[0] is drain(b)[0]
+    assert drain(c) is None
+    assert h.stats()["delivered"] == 2
+
+
+def test_split_keeps_every_row_under_the_limit(monkeypatch):
+    monkeypatch.setattr(live_push, "MAX_NOTIFY_BYTES", 400)
+    event = metrics(1, "disk", n_rows=9)
+    parts = _split(event, live_push.dumps(event))
+    assert len(parts) > 1
+    assert all(len(p) <= 400 for p in parts)
+    decoded = [json.loads(p) for p in parts]
+    assert all(d["device_id"] == 1 and d["family"] == "disk" for d in decoded)
+    # Reassembled in order, the parts carry exactly the original rows
+    assert [row for d in decoded for row in d["rows"]] == event["rows"]
+
+
+def test_split_gives_up_on_a_single_oversized_row(monkeypatch):
+    monkeypatch.setattr(live_push, "MAX_NOTIFY_BYTES", 50)
+    event = metrics(1, "disk", n_rows=1)
+    assert _split(event, live_push.dumps(event)) == []
+
+
+def test_relay_round_trip_and_own_events_dropped(monkeypatch):
+    monkeypatch.setattr(live_push, "MAX_NOTIFY_BYTES", 400)
+    sender_hub, receiver_hub = hub(), hub(max_events=100)
+    relay = LivePushRelay("postgresql://unused", sender_hub)
+    sender_hub.relay = relay.enqueue
+    event = metrics(1, "disk", n_rows=9)
+    sender_hub.publish(("metrics", 1, "disk"), event)
+    payloads = list(relay._outgoing)
+    assert len(payloads) > 1 and all(p.startswith(worker_id() + "|") for p in payloads)
+
+    # Our own notifications come back on the shared channel and are ignored
+    own = hub()
+    own_sub = own.subscribe(Subscription())
+    relay.hub = own
+    for p in payloads:
+        relay._on_notify(None, 0, live_push.RELAY_CHANNEL, p)
+    assert relay.received == 0 and drain(own_sub) is None
+
+    # Another worker delivers the parts to its subscribers, matching on the prefix alone
+    other = LivePushRelay("postgresql://unused", receiver_hub)
+    sub = receiver_hub.subscribe(Subscription(families=frozenset({"disk"})))
+    for p in payloads:
+        other._on_notify(None, 0, live_push.RELAY_CHANNEL, p.replace(worker_id(), "another-worker", 1))
+    bodies = [json.loads(b) for b in drain(sub)]
+    assert other.received == len(payloads)
+    assert [row for b in bodies for row in b["rows"]] == event["rows"]
+
+
+def test_relay_queue_bounded_and_requeue():
+    relay = LivePushRelay("postgresql://unused", hub(), max_queue=2)
+    for device_id in (1, 2, 3):
+        relay.enqueue(("status", device_id, None), {"device_id": device_id})
+    assert relay.dropped == 1 and [p.split("|")[2] for p in relay._outgoing] == ["2", "3"]
+    unsent = list(relay._outgoing)
+    relay._outgoing.clear()
+    relay.enqueue(("status", 4, None), {"device_id": 4})
+    relay._requeue(unsent)
+    # Oldest unsent payload gives way; order is preserved
+    assert [p.split("|")[2] for p in relay._outgoing] == ["3", "4"]
+    assert relay.dropped == 2
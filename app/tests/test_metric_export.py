@@ -0,0 +1,32 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import metric_export
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main.app.router, "on_startup", [])
+    monkeypatch.setattr(main.app.router, "on_shutdown", [])
+    with TestClient(main.app) as c:
+        yield c
+
+
+def test_available_formats_follow_pyarrow(monkeypatch):
+    monkeypatch.setattr(metric_export, "pa", None)
+    assert metric_export.available_formats() == ["csv", "ndjson"]
+
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_export_without_pyarrow_is_not_implemented(client, monkeypatch, fmt):
+    monkeypatch.setattr(metric_export, "pa", None)
+    response = client.get("/export/cpu", params={"from": "2026-01-01", "format": fmt})
+    assert response.status_code == 501
+    assert "pyarrow" in response.json()["detail"]
+
+
+def test_export_unknown_format_is_rejected(client):
+    response = client.get("/export/cpu", params={"from": "2026-01-01", "format": "xml"})
+    assert response.status_code == 400
+    assert "csv" in response.json()["detail"]
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.dialects import postgresql
+
+import main
+from main import CpuMetric, ROLLUPS, align, late_timestamps, rollup_start
+
+NOW = datetime(2026, 10, 17, 12, 0, 30, tzinfo=timezone.utc)
+
+
+def cpu_row(ts):
+    return {"device_id": 1, "timestamp": ts, "cpu_usage_percent": 10.0}
+
+
+def refresh_window(level, start, end):
+    """(lower, upper) sample time bounds of a level's refresh statement."""
+    params = level.refresh_statement(start, end).compile(dialect=postgresql.dialect()).params
+    bounds = sorted(v for v in params.values() if isinstance(v, datetime))
+    return bounds[0], bounds[-1]
+
+
+def test_fresh_rows_are_not_late():
+    rows = {CpuMetric: [cpu_row(NOW - timedelta(seconds=5))], main.DiskMetric: []}
+    assert late_timestamps(rows, NOW) == {}
+
+
+def test_late_rows_record_earliest_per_table():
+    old = NOW - timedelta(hours=3)
+    rows = {CpuMetric: [cpu_row(NOW), cpu_row(old), cpu_row(old + timedelta(minutes=1))]}
+    assert late_timestamps(rows, NOW) == {"cpu_metrics": old}
+
+
+def test_rollup_start_without_late_rows():
+    done = NOW - timedelta(seconds=60)
+    assert rollup_start(done, None, NOW) == done - timedelta(seconds=main.ROLLUP_LATE_SECONDS)
+    assert rollup_start(None, None, NOW) == NOW - timedelta(seconds=main.ROLLUP_BACKFILL_SECONDS)
+
+
+def test_replayed_sample_lands_in_1m_rollup():
+    # An agent replays its spool: a sample taken three hours ago is written after the last rollup run
+    replayed = datetime(2026, 10, 17, 9, 0, 42, tzinfo=timezone.utc)
+    late = late_timestamps({CpuMetric: [cpu_row(replayed)]}, NOW)
+
+    done_until = NOW - timedelta(seconds=main.ROLLUP_INTERVAL_SECONDS)
+    start = rollup_start(done_until, late["cpu_metrics"], NOW)
+    level_1m = ROLLUPS[CpuMetric][0]
+    assert level_1m.name == "1m"
+    lower, upper = refresh_window(level_1m, align(start, level_1m.seconds), NOW)
+    assert lower <= align(replayed, 60) <= replayed < upper
+    # Without the late mark its bucket would have been left as finalized
+    lower, _ = refresh_window(level_1m, align(rollup_start(done_until, None, NOW), 60), NOW)
+    assert replayed < lower
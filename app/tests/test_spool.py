@@ -0,0 +1,148 @@
+import json
+import os
+import time
+
+import pytest
+
+import server_agent
+from server_agent import Spool
+
+
+class Clock:
+    """Stands in for time.time: moves 1ms per reading, so segment names never collide, unless told otherwise."""
+
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        self.now += 0.001
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(server_agent.time, "time", clock)
+    return clock
+
+
+def sample(n):
+    return {"device_ip": "10.0.0.1", "seq": n, "timestamp": f"2026-10-17T12:00:{n % 60:02d}"}
+
+
+def drain(spool):
+    """Replay everything, committing each batch; returns the seqs in replay order."""
+    seqs = []
+    while True:
+        batch = spool.next_batch()
+        if batch is None:
+            return seqs
+        path, end, samples = batch
+        seqs += [s["seq"] for s in samples]
+        spool.commit(path, end)
+
+
+def segment_files(directory):
+    return sorted(n for n in os.listdir(directory) if n.endswith(".ndjson"))
+
+
+def test_replays_in_order_and_removes_segments(tmp_path, clock):
+    spool = Spool(str(tmp_path))
+    for n in range(5):
+        spool.append(sample(n))
+    assert spool.pending()
+    assert drain(spool) == [0, 1, 2, 3, 4]
+    assert not spool.pending()
+    assert os.listdir(tmp_path) == []
+
+
+def test_rotates_by_size(tmp_path, clock, monkeypatch):
+    line = len(json.dumps(sample(0), separators=(",", ":"))) + 1
+    monkeypatch.setattr(server_agent, "SPOOL_SEGMENT_MAX_BYTES", line * 3)
+    spool = Spool(str(tmp_path))
+    for n in range(10):
+        spool.append(sample(n))
+    assert len(segment_files(tmp_path)) == 4  # 3 + 3 + 3 + 1 lines
+    assert drain(spool) == list(range(10))
+
+
+def test_rotates_by_age(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(server_agent, "SPOOL_SEGMENT_MAX_AGE_SECONDS", 60)
+    spool = Spool(str(tmp_path))
+    spool.append(sample(0))
+    spool.append(sample(1))
+    clock.now += 61
+    spool.append(sample(2))
+    assert len(segment_files(tmp_path)) == 2
+    assert drain(spool) == [0, 1, 2]
+
+
+def test_enforce_limits_drops_oldest_sealed_segments(tmp_path, clock, monkeypatch):
+    line = len(json.dumps(sample(0), separators=(",", ":"))) + 1
+    monkeypatch.setattr(server_agent, "SPOOL_SEGMENT_MAX_BYTES", line * 2)
+    monkeypatch.setattr(server_agent, "SPOOL_MAX_BYTES", line * 5)
+    spool = Spool(str(tmp_path))
+    for n in range(8):
+        spool.append(sample(n))
+    # 8 lines in segments of 2; only whole sealed segments are dropped, oldest first
+    assert drain(spool) == [4, 5, 6, 7]
+
+
+def test_pos_sidecar_survives_restart(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(server_agent, "REPLAY_BATCH_SIZE", 2)
+    spool = Spool(str(tmp_path))
+    for n in range(5):
+        spool.append(sample(n))
+    path, end, samples = spool.next_batch()
+    assert [s["seq"] for s in samples] == [0, 1]
+    spool.commit(path, end)
+    with open(path + ".pos") as f:
+        assert int(f.read()) == end
+
+    # A restarted agent resumes after the committed batch
+    restarted = Spool(str(tmp_path))
+    path2, end2, samples2 = restarted.next_batch()
+    assert path2 == path
+    assert [s["seq"] for s in samples2] == [2, 3]
+    # ...and a crash before commit resends that batch, not the ones before it
+    restarted = Spool(str(tmp_path))
+    assert drain(restarted) == [2, 3, 4]
+    assert os.listdir(tmp_path) == []
+
+
+def test_torn_last_line_is_skipped(tmp_path, clock):
+    spool = Spool(str(tmp_path))
+    spool.append(sample(0))
+    spool.append(sample(1))
+    # A crash in the middle of writing the third line
+    with open(spool.active, "a") as f:
+        f.write(json.dumps(sample(2))[:15])
+
+    restarted = Spool(str(tmp_path))
+    path, end, samples = restarted.next_batch()
+    assert [s["seq"] for s in samples] == [0, 1]
+    assert end < os.path.getsize(path)
+    restarted.commit(path, end)
+    # Only the torn tail is left: nothing sendable, so the segment goes
+    assert restarted.next_batch() is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_appends_after_restart_go_to_a_new_segment(tmp_path, clock):
+    spool = Spool(str(tmp_path))
+    spool.append(sample(0))
+    with open(spool.active, "a") as f:
+        f.write('{"device_ip": "10.')
+    restarted = Spool(str(tmp_path))
+    restarted.append(sample(1))
+    assert len(segment_files(tmp_path)) == 2
+    assert drain(restarted) == [0, 1]
+
+
+def test_corrupt_line_is_skipped(tmp_path, clock):
+    spool = Spool(str(tmp_path))
+    spool.append(sample(0))
+    with open(spool.active, "a") as f:
+        f.write("not json\n")
+    spool.append(sample(1))
+    assert drain(spool) == [0, 1]
@@ -0,0 +1,131 @@
+import math
+import struct
+from datetime import datetime, timezone
+
+import pytest
+
+import wire_format
+from wire_format import BatchTooLarge, WireFormatError, decode, encode
+
+CPU = {"cpu_usage_percent": 12.5, "cpu_user": 8.0, "cpu_system": 4.5, "cpu_idle": 87.5, "cpu_iowait": 0.0,
+       "load_avg_1": 0.5, "load_avg_5": 0.25, "load_avg_15": 0.125, "core_count": 8}
+MEMORY = {"total_mb": 16384, "used_mb": 8192, "free_mb": 4096, "available_mb": 8192, "usage_percent": 50.0,
+          "swap_total_mb": 2048, "swap_used_mb": 0, "swap_free_mb": 2048}
+DISK = {"mount_point": "/", "device_name": "/dev/sda1", "filesystem_type": None, "used_gb": 10.0, "free_gb": 90.0,
+        "usage_percent": 10.0, "inode_usage_percent": 1.0, "read_bytes": 1 << 40}
+NETWORK = {"interface_name": "eth0", "status": "up", "bytes_sent": 123, "speed_mbps": 1000}
+
+
+def sample(**overrides):
+    return {"device_ip": "10.0.0.1", "timestamp": "2026-10-17T12:00:00.250000+00:00", "seq": 42,
+            "cpu": CPU, "memory": MEMORY, "disk": [DISK], "network": [NETWORK], **overrides}
+
+
+def test_round_trip():
+    [decoded] = decode(encode([sample()]))
+    assert decoded.device_ip == "10.0.0.1"
+    assert decoded.timestamp == datetime(2026, 10, 17, 12, 0, 0, 250000, tzinfo=timezone.utc)
+    assert decoded.seq == 42
+    assert decoded.families["cpu"] == [CPU]
+    assert decoded.families["memory"] == [MEMORY]
+    [disk] = decoded.families["disk"]
+    assert {k: v for k, v in disk.items() if v is not None} == {k: v for k, v in DISK.items() if v is not None}
+    assert disk["filesystem_type"] is None and disk["total_gb"] is None and disk["write_ops"] is None
+    [network] = decoded.families["network"]
+    assert network["bytes_sent"] == 123 and network["speed_mbps"] == 1000 and network["bytes_recv"] is None
+
+
+def test_absent_timestamp_seq_and_families():
+    [decoded] = decode(encode([{"device_ip": "::1"}]))
+    assert decoded.timestamp is None
+    assert decoded.seq is None
+    assert decoded.families == {"cpu": [], "memory": [], "disk": [], "network": []}
+
+
+def test_empty_batch():
+    assert decode(encode([])) == []
+
+
+def test_version_1_has_no_seq():
+    body = bytearray(encode([sample(seq=None)]))
+    body[4] = 1
+    # Version 1 samples lack the u64 seq after the timestamp (2 + len("10.0.0.1") + 8 bytes in)
+    seq_at = wire_format._HEADER.size + 2 + len("10.0.0.1") + 8
+    del body[seq_at:seq_at + 8]
+    [decoded] = decode(bytes(body))
+    assert decoded.seq is None
+    assert decoded.families["cpu"] == [CPU]
+
+
+@pytest.mark.parametrize("cut", [1, 8, 40, 200])
+def test_truncated_body(cut):
+    body = encode([sample(), sample(seq=43)])
+    with pytest.raises(WireFormatError):
+        decode(body[:-cut])
+
+
+def test_truncated_header():
+    with pytest.raises(WireFormatError, match="Truncated header"):
+        decode(b"NMSB\x02")
+
+
+def test_trailing_bytes():
+    with pytest.raises(WireFormatError, match="Trailing bytes"):
+        decode(encode([sample()]) + b"\x00")
+
+
+def test_unknown_version():
+    body = bytearray(encode([sample()]))
+    body[4] = wire_format.VERSION + 1
+    with pytest.raises(WireFormatError, match="Unsupported wire format version"):
+        decode(bytes(body))
+
+
+def test_bad_magic():
+    with pytest.raises(WireFormatError, match="Not a binary metrics batch"):
+        decode(b"JSON" + encode([sample()])[4:])
+
+
+def test_batch_too_large():
+    with pytest.raises(BatchTooLarge):
+        decode(encode([sample(), sample(seq=43)]), max_samples=1)
+
+
+def test_missing_required_field():
+    cpu = dict(CPU, cpu_idle=None)
+    with pytest.raises(WireFormatError, match="cpu is missing cpu_idle"):
+        decode(encode([sample(cpu=cpu)]))
+
+
+def test_too_many_records():
+    body = encode([sample(cpu=[CPU, CPU])])
+    with pytest.raises(WireFormatError, match="too many cpu records"):
+        decode(body)
+
+
+@pytest.mark.parametrize("value", [math.nan, math.inf, -math.inf])
+def test_non_finite_float_rejected(value):
+    with pytest.raises(WireFormatError, match="memory.usage_percent is not a finite number"):
+        decode(encode([sample(memory=dict(MEMORY, usage_percent=value))]))
+
+
+def test_seq_out_of_range():
+    body = bytearray(encode([sample()]))
+    seq_at = wire_format._HEADER.size + 2 + len("10.0.0.1") + 8
+    struct.pack_into("<Q", body, seq_at, 1 << 63)
+    with pytest.raises(WireFormatError, match="seq out of range"):
+        decode(bytes(body))
+
+
+def test_timestamp_out_of_range():
+    body = bytearray(encode([sample()]))
+    struct.pack_into("<d", body, wire_format._HEADER.size + 2 + len("10.0.0.1"), 1e300)
+    with pytest.raises(WireFormatError, match="invalid timestamp"):
+        decode(bytes(body))
+
+
+def test_invalid_utf8():
+    body = bytearray(encode([sample()]))
+    body[wire_format._HEADER.size + 2] = 0xFF
+    with pytest.raises(WireFormatError, match="Invalid UTF-8"):
+        decode(bytes(body))
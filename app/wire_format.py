@@ -0,0 +1,246 @@
+# wire_format.py
+"""Compact binary encoding of metric samples (content type ``application/x-nms-metrics``).
+
+Shared by server_agent.py (encode) and the batch collect endpoint (decode).
+Field names are fixed by the format version instead of being repeated in
+every sample, and values arrive already typed, so the server can build
+insert-ready rows without JSON parsing or model validation.
+
+Layout, all little-endian::
+
+    frame   := seq:u64 batch          (streaming channel only)
+    batch   := MAGIC version:u8 count:u32 sample*
+    sample  := device_ip:str timestamp:f64 (NaN = none) seq:u64 (0 = none) family_count:u16 x 4 record*
+    record  := str* presence:u32 value*
+    str     := length:u16 utf-8 bytes (length 0xFFFF = none)
+
+Families come in the order of FAMILIES and their records carry the string
+fields, then the numeric fields, of that family's layout. Bit ``i`` of
+``presence`` is set when numeric field ``i`` has a value; absent values are
+packed as zero and decoded as None. Float values must be finite and
+``seq`` must fit a signed 64-bit integer. Version 1 batches, which have no
+``seq``, are still decoded.
+"""
+import math
+import struct
+from datetime import datetime, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+CONTENT_TYPE = "application/x-nms-metrics"
+MAGIC = b"NMSB"
+VERSION = 2
+_DECODABLE_VERSIONS = (1, 2)
+
+_HEADER = struct.Struct("<4sBI")
+# Binary frames on the streaming channel: sequence number, then one batch
+STREAM_FRAME_SEQ = struct.Struct("<Q")
+_STR_LEN = struct.Struct("<H")
+_TIMESTAMP = struct.Struct("<d")
+_SAMPLE_SEQ = struct.Struct("<Q")
+_NO_STRING = 0xFFFF
+_MAX_SEQ = (1 << 63) - 1
+
+
+class WireFormatError(ValueError):
+    """The body is not a valid binary batch; nothing in it can be trusted."""
+
+
+class BatchTooLarge(WireFormatError):
+    pass
+
+
+class Family(NamedTuple):
+    name: str
+    strings: Tuple[str, ...]
+    numbers: Tuple[Tuple[str, str], ...]  # (field, struct code): "d" float, "q" integer
+    required: frozenset
+    max_records: int
+
+
+def _family(name, strings, numbers, required, max_records=0xFFFF):
+    return Family(name, tuple(strings), tuple(numbers), frozenset(required), max_records)
+
+
+_CPU_NUMBERS = [(f, "d") for f in ("cpu_usage_percent", "cpu_user", "cpu_system", "cpu_idle", "cpu_iowait",
+                                   "load_avg_1", "load_avg_5", "load_avg_15")] + [("core_count", "q")]
+_MEMORY_NUMBERS = [("total_mb", "q"), ("used_mb", "q"), ("free_mb", "q"), ("available_mb", "q"),
+                   ("usage_percent", "d"), ("swap_total_mb", "q"), ("swap_used_mb", "q"), ("swap_free_mb", "q")]
+_DISK_NUMBERS = ([(f, "d") for f in ("total_gb", "used_gb", "free_gb", "usage_percent", "inode_usage_percent")]
+                 + [(f, "q") for f in ("read_bytes", "write_bytes", "read_ops", "write_ops")]
+                 + [(f, "d") for f in ("read_bytes_per_sec", "write_bytes_per_sec", "read_ops_per_sec", "write_ops_per_sec")])
+_NET_COUNTERS = ("bytes_sent", "bytes_recv", "packets_sent", "packets_recv", "errors_in", "errors_out", "drops_in", "drops_out")
+_NETWORK_NUMBERS = ([(f, "q") for f in _NET_COUNTERS] + [("speed_mbps", "q")]
+                    + [(f + "_per_sec", "d") for f in _NET_COUNTERS])
+
+# Version 1 layout; mirrors the *MetricsSchema models in main.py
+FAMILIES = (
+    _family("cpu", [], _CPU_NUMBERS, [f for f, _ in _CPU_NUMBERS], max_records=1),
+    _family("memory", [], _MEMORY_NUMBERS, [f for f, _ in _MEMORY_NUMBERS], max_records=1),
+    _family("disk", ["mount_point", "device_name", "filesystem_type"], _DISK_NUMBERS,
+            ["mount_point", "used_gb", "free_gb", "usage_percent", "inode_usage_percent"]),
+    _family("network", ["interface_name", "status"], _NETWORK_NUMBERS, ["interface_name"]),
+)
+_COUNTS = struct.Struct("<" + "H" * len(FAMILIES))
+_RECORDS = {f.name: struct.Struct("<I" + "".join(code for _, code in f.numbers)) for f in FAMILIES}
+_NUMBER_NAMES = {f.name: tuple(name for name, _ in f.numbers) for f in FAMILIES}
+_FLOAT_FIELDS = {f.name: tuple(i for i, (_, code) in enumerate(f.numbers) if code == "d") for f in FAMILIES}
+
+
+class DecodedSample(NamedTuple):
+    device_ip: str
+    timestamp: Optional[datetime]
+    seq: Optional[int]
+    families: Dict[str, List[Dict[str, Any]]]  # family -> rows keyed like the metric tables, without device_id/timestamp
+
+
+def is_binary(content_type: Optional[str]) -> bool:
+    return (content_type or "").split(";")[0].strip().lower() == CONTENT_TYPE
+
+
+# -----------------------
+# Encoding (agent side)
+# -----------------------
+def _pack_str(out: bytearray, value: Optional[str]) -> None:
+    if value is None:
+        out += _STR_LEN.pack(_NO_STRING)
+        return
+    data = str(value).encode()
+    if len(data) >= _NO_STRING:
+        raise WireFormatError("String field too long")
+    out += _STR_LEN.pack(len(data)) + data
+
+
+def _encode_timestamp(ts: Any) -> float:
+    if ts is None:
+        return math.nan
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts.timestamp()
+
+
+def encode(samples: List[Dict[str, Any]]) -> bytes:
+    """Encode samples shaped like CollectMetricsPayload dicts; missing keys are sent as absent."""
+    out = bytearray(_HEADER.pack(MAGIC, VERSION, len(samples)))
+    for sample in samples:
+        _pack_str(out, sample["device_ip"])
+        out += _TIMESTAMP.pack(_encode_timestamp(sample.get("timestamp")))
+        out += _SAMPLE_SEQ.pack(sample.get("seq") or 0)
+        records = []
+        for family in FAMILIES:
+            value = sample.get(family.name)
+            records.append([] if value is None else [value] if isinstance(value, dict) else list(value))
+        out += _COUNTS.pack(*(len(r) for r in records))
+        for family, family_records in zip(FAMILIES, records):
+            record_struct = _RECORDS[family.name]
+            for record in family_records:
+                for field in family.strings:
+                    _pack_str(out, record.get(field))
+                presence, values = 0, []
+                for i, (field, code) in enumerate(family.numbers):
+                    value = record.get(field)
+                    if value is None:
+                        values.append(0 if code == "q" else 0.0)
+                    else:
+                        presence |= 1 << i
+                        values.append(int(value) if code == "q" else float(value))
+                out += record_struct.pack(presence, *values)
+    return bytes(out)
+
+
+# -----------------------
+# Decoding (server side)
+# -----------------------
+def decode(body: bytes, max_samples: Optional[int] = None) -> List[DecodedSample]:
+    """Decode and validate a whole batch.
+
+    Field types are guaranteed by the layout; required fields, value ranges,
+    family record limits and trailing bytes are checked here. Any error
+    rejects the batch, since the stream cannot be resynchronised after a
+    malformed sample. Limits of the metric tables' columns are left to the
+    caller, which can reject single samples.
+    """
+    view = memoryview(body)
+    try:
+        magic, version, count = _HEADER.unpack_from(view, 0)
+    except struct.error:
+        raise WireFormatError("Truncated header")
+    if magic != MAGIC:
+        raise WireFormatError("Not a binary metrics batch")
+    if version not in _DECODABLE_VERSIONS:
+        raise WireFormatError(f"Unsupported wire format version {version}")
+    if max_samples is not None and count > max_samples:
+        raise BatchTooLarge(f"Batch exceeds {max_samples} items")
+
+    offset = _HEADER.size
+    samples = []
+    str_len, unpack_ts, unpack_counts = _STR_LEN.unpack_from, _TIMESTAMP.unpack_from, _COUNTS.unpack_from
+    has_seq = version >= 2
+    try:
+        for index in range(count):
+            (n,) = str_len(view, offset)
+            offset += 2
+            if n == _NO_STRING:
+                raise WireFormatError(f"Sample {index}: device_ip is required")
+            device_ip = bytes(view[offset:offset + n]).decode()
+            offset += n
+            (epoch,) = unpack_ts(view, offset)
+            offset += _TIMESTAMP.size
+            if math.isnan(epoch):
+                timestamp = None
+            else:
+                try:
+                    timestamp = datetime.fromtimestamp(epoch, tz=timezone.utc)
+                except (OverflowError, OSError, ValueError):
+                    raise WireFormatError(f"Sample {index}: invalid timestamp")
+            seq = None
+            if has_seq:
+                (seq,) = _SAMPLE_SEQ.unpack_from(view, offset)
+                offset += _SAMPLE_SEQ.size
+                if seq > _MAX_SEQ:
+                    raise WireFormatError(f"Sample {index}: seq out of range")
+            counts = unpack_counts(view, offset)
+            offset += _COUNTS.size
+
+            families = {}
+            for family, n_records in zip(FAMILIES, counts):
+                if n_records > family.max_records:
+                    raise WireFormatError(f"Sample {index}: too many {family.name} records")
+                record_struct, names = _RECORDS[family.name], _NUMBER_NAMES[family.name]
+                float_fields = _FLOAT_FIELDS[family.name]
+                all_present = (1 << len(names)) - 1
+                rows = []
+                for _ in range(n_records):
+                    row = {}
+                    for field in family.strings:
+                        (n,) = str_len(view, offset)
+                        offset += 2
+                        if n == _NO_STRING:
+                            row[field] = None
+                        else:
+                            row[field] = bytes(view[offset:offset + n]).decode()
+                            offset += n
+                    presence, *values = record_struct.unpack_from(view, offset)
+                    offset += record_struct.size
+                    for i in float_fields:
+                        if not math.isfinite(values[i]):
+                            raise WireFormatError(f"Sample {index}: {family.name}.{names[i]} is not a finite number")
+                    row.update(zip(names, values))
+                    if presence != all_present:
+                        for i, field in enumerate(names):
+                            if not presence >> i & 1:
+                                row[field] = None
+                    missing = [f for f in family.required if row[f] is None]
+                    if missing:
+                        raise WireFormatError(f"Sample {index}: {family.name} is missing {', '.join(sorted(missing))}")
+                    rows.append(row)
+                families[family.name] = rows
+            samples.append(DecodedSample(device_ip, timestamp, seq or None, families))
+    except struct.error:
+        raise WireFormatError("Truncated body")
+    except UnicodeDecodeError:
+        raise WireFormatError("Invalid UTF-8 in string field")
+    if offset != len(view):
+        raise WireFormatError("Trailing bytes after last sample")
+    return samples